@@ -0,0 +1,109 @@
+'''
+Consumer aggregation throughput: per-message loop vs vectorized batch path.
+
+  python -m benchmarks.bench_aggregation [--sizes 100 1000 10000] [--repeat 5]
+
+Both paths start from an XREADGROUP-shaped response (list of (id, fields)
+with string values, as redis-py returns them) and include parsing.
+
+ohlcv_loop is the per-message loop without order flow (OHLCV only, the
+aggregator before quote/buy/sell volume, trade count and max size were
+added); order_flow_ns_per_trade is what those fields cost per trade on the
+loop path.
+'''
+import argparse
+import json
+import random
+import time
+
+from src.aggregator import Candle, CandleAggregator, floor_bucket
+from src.consumer import parse_trades
+
+
+def make_msgs(n: int, start_ms: int = 1_700_000_000_000, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    px, ts = 30000.0, start_ms
+    out = []
+    for i in range(n):
+        ts += rng.randint(0, 20)
+        px *= 1 + rng.gauss(0, 1e-4)
+        out.append((f"{ts}-{i}", {
+            "ts_ms": str(ts), "symbol": "btcusdt",
+            "price": f"{px:.10f}", "qty": f"{rng.expovariate(10):.10f}",
+            "side": "sell" if rng.random() < 0.5 else "buy", "src": "binance",
+        }))
+    return out
+
+
+class OhlcvAggregator(CandleAggregator):
+    # add() as it was before order flow: same checks, OHLCV updates only
+    def add(self, symbol: str, ts: int, price: float, qty: float, sell: bool = False) -> list:
+        t0 = floor_bucket(ts, self.bucket_ms)
+        c = self.current.get(symbol)
+        if t0 < self.closed_until.get(symbol, t0) or (c is not None and t0 < c.t_start_ms):
+            self.late_trades += 1
+            return []
+        self.last_trade[symbol] = (ts, price, qty)
+        if c is not None and c.t_start_ms == t0:
+            c.high = max(c.high, price)
+            c.low = min(c.low, price)
+            c.close = price
+            c.volume += qty
+            return []
+        out = self._finalize(symbol, c) if c is not None else []
+        self.current[symbol] = Candle(t_start_ms=t0, t_end_ms=t0 + self.bucket_ms, open=price, high=price, low=price, close=price, volume=qty)
+        self._schedule(symbol, t0 + self.bucket_ms + self.grace_ms)
+        return out
+
+
+def loop_path(agg: CandleAggregator, msgs: list) -> None:
+    for _, fields in msgs:
+        agg.add("btcusdt", int(fields["ts_ms"]), float(fields["price"]), float(fields["qty"]), fields["side"] == "sell")
+
+
+def batch_path(agg: CandleAggregator, msgs: list) -> None:
+    ts, price, qty, sell = parse_trades(msgs)
+    agg.add_batch("btcusdt", ts, price, qty, sell)
+
+
+def bench(fn, batches: list, repeat: int, cls=CandleAggregator) -> float:
+    best = float("inf")
+    n = sum(len(b) for b in batches)
+    for _ in range(repeat):
+        agg = cls(5000)
+        t0 = time.perf_counter()
+        for msgs in batches:
+            fn(agg, msgs)
+        best = min(best, time.perf_counter() - t0)
+    return n / best
+
+
+def run(sizes=(100, 1000, 10_000), total: int = 200_000, repeat: int = 5) -> dict:
+    msgs = make_msgs(total)
+    out = {}
+    for size in sizes:
+        batches = [msgs[i:i + size] for i in range(0, total, size)]
+        base = bench(loop_path, batches, repeat, OhlcvAggregator)
+        loop = bench(loop_path, batches, repeat)
+        vec = bench(batch_path, batches, repeat)
+        out[str(size)] = {
+            "ohlcv_loop_trades_per_sec": base,
+            "loop_trades_per_sec": loop,
+            "order_flow_ns_per_trade": (1 / loop - 1 / base) * 1e9,
+            "batch_trades_per_sec": vec,
+            "speedup": vec / loop,
+        }
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000])
+    ap.add_argument("--total", type=int, default=200_000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    print(json.dumps(run(args.sizes, args.total, args.repeat), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+'''
+Consumer throughput and end-to-end latency, against the in-process Redis stand-in.
+
+  python -m benchmarks.bench_consumer [--symbols 50] [--rate 20] [--seconds 60]
+
+throughput: pre-loads symbols x rate x seconds synthetic trades into the
+streams and times draining them through handle_batch (parse, aggregate,
+SQLite group commit, indicators, XACK), with the per-message loop and the
+vectorized path.
+
+e2e: runs a real-time producer thread (trades stamped with wall clock)
+and the consumer loop side by side, and reports percentiles of
+trade -> consumer read lag and candle end -> latest:{symbol} publish.
+'''
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+
+from benchmarks.harness import LocalRedis, synthetic_trades, percentiles, symbols as make_symbols
+from src.common import Config, now_ms
+from src.aggregator import CandleAggregator
+from src.consumer import ensure_group, stream_key, handle_batch, finalize_candles
+from src.storage import init_sqlite, CandleWriter
+
+
+def _setup(cfg: Config, syms: list[str]) -> LocalRedis:
+    r = LocalRedis()
+    init_sqlite(cfg.sqlite_path)
+    for s in syms:
+        ensure_group(r, stream_key(cfg, s), cfg.consumer_group)
+    return r
+
+
+def throughput(n_symbols: int, rate: float, seconds: float, batch_agg_min: int, read_count: int = 1000) -> dict:
+    syms = make_symbols(n_symbols)
+    trades = synthetic_trades(syms, rate, seconds)
+    with tempfile.TemporaryDirectory() as d:
+        cfg = Config(sqlite_path=os.path.join(d, "bench.db"), read_count=read_count, batch_agg_min=batch_agg_min)
+        r = _setup(cfg, syms)
+        for s, f in trades:
+            r.xadd(stream_key(cfg, s), f)
+        streams = {stream_key(cfg, s): ">" for s in syms}
+
+        agg, engines = CandleAggregator(cfg.candle_sec * 1000), {}
+        t0 = time.perf_counter()
+        with CandleWriter(cfg.sqlite_path, cfg.sqlite_batch_size, cfg.sqlite_flush_ms) as w:
+            while True:
+                resp = r.xreadgroup(cfg.consumer_group, cfg.consumer_name, streams, count=cfg.read_count)
+                if not resp:
+                    break
+                handle_batch(cfg, r, resp, agg, engines, w, batch_ack=True)
+        dt = time.perf_counter() - t0
+        pending = sum(r.xpending_count(st, cfg.consumer_group) for st in streams)
+    return {"trades": len(trades), "trades_per_sec": len(trades) / dt, "unacked": pending}
+
+
+def _seed_history(cfg: Config, syms: list[str], bucket_ms: int, n: int = 300) -> None:
+    # enough stored candles that indicators publish from the first close
+    start = (now_ms() // bucket_ms - n - 1) * bucket_ms
+    with CandleWriter(cfg.sqlite_path, batch_size=10_000) as w:
+        for s in syms:
+            for i in range(n):
+                t = start + i * bucket_ms
+                w.add({"symbol": s, "t_start_ms": t, "t_end_ms": t + bucket_ms,
+                       "open": 100.0, "high": 100.0, "low": 100.0, "close": 100.0, "volume": 1.0})
+
+
+def end_to_end(n_symbols: int, rate: float, seconds: float) -> dict:
+    syms = make_symbols(n_symbols)
+    with tempfile.TemporaryDirectory() as d:
+        cfg = Config(sqlite_path=os.path.join(d, "bench.db"), candle_sec=1,
+                     finalize_grace_ms=200, finalize_interval_ms=50, gap_fill=False)
+        bucket_ms = cfg.candle_sec * 1000
+        r = _setup(cfg, syms)
+        _seed_history(cfg, syms, bucket_ms)
+
+        publish_lag = []
+        def on_hset(key, mapping):
+            if key.startswith("latest:"):
+                publish_lag.append(now_ms() - int(mapping["t_end_ms"]))
+        r.on_hset = on_hset
+
+        stop = threading.Event()
+        produced = [0]
+
+        def produce():
+            rng = np.random.default_rng(2)
+            tick = 0.01
+            px = {s: 100.0 for s in syms}
+            while not stop.is_set():
+                for s in syms:
+                    for _ in range(rng.poisson(rate * tick)):
+                        px[s] *= 1 + rng.normal(0, 1e-4)
+                        r.xadd(stream_key(cfg, s), {"ts_ms": str(now_ms()), "symbol": s,
+                                                    "price": f"{px[s]:.10f}", "qty": "0.1", "side": "buy", "src": "bench"})
+                        produced[0] += 1
+                time.sleep(tick)
+
+        read_lag = []
+        streams = {stream_key(cfg, s): ">" for s in syms}
+        agg, engines = CandleAggregator(bucket_ms, cfg.finalize_grace_ms, cfg.gap_fill), {}
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        deadline = time.monotonic() + seconds
+        with CandleWriter(cfg.sqlite_path, cfg.sqlite_batch_size, cfg.sqlite_flush_ms) as w:
+            while time.monotonic() < deadline:
+                resp = r.xreadgroup(cfg.consumer_group, cfg.consumer_name, streams,
+                                    count=cfg.read_count, block=cfg.finalize_interval_ms)
+                if resp:
+                    t = now_ms()
+                    read_lag.extend(t - int(f["ts_ms"]) for _, msgs in resp for _, f in msgs)
+                    handle_batch(cfg, r, resp, agg, engines, w, batch_ack=True)
+                closed = agg.advance(now_ms())
+                if closed:
+                    finalize_candles(cfg, r, engines, w, closed)
+                w.maybe_flush()
+        stop.set()
+        producer.join()
+
+    return {
+        "trades": produced[0],
+        "read_lag_ms": percentiles(read_lag),
+        "close_to_latest_ms": percentiles(publish_lag),
+        "published": len(publish_lag),
+    }
+
+
+def run(n_symbols: int = 50, rate: float = 20.0, seconds: float = 60.0, e2e_seconds: float = 5.0) -> dict:
+    return {
+        "throughput_loop": throughput(n_symbols, rate, seconds, batch_agg_min=0),
+        "throughput_vectorized": throughput(n_symbols, rate, seconds, batch_agg_min=64),
+        "e2e": end_to_end(n_symbols, rate, e2e_seconds),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=50)
+    ap.add_argument("--rate", type=float, default=20.0, help="trades/sec per symbol")
+    ap.add_argument("--seconds", type=float, default=60.0, help="simulated seconds for the throughput run")
+    ap.add_argument("--e2e-seconds", type=float, default=5.0)
+    args = ap.parse_args()
+    print(json.dumps(run(args.symbols, args.rate, args.seconds, args.e2e_seconds), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Indicator cost per closed candle in compute_and_cache.
+
+  python -m benchmarks.bench_indicators [--candles 2000]
+
+incremental: compute_and_cache with a warm per-symbol engine (what the consumer does).
+incremental_checkpoint: the same plus serializing the engine for the
+checkpoint (CHECKPOINT=true; once per close, with the next XACK).
+recompute: the pre-engine approach, reading 300 rows from SQLite and
+recomputing everything with pandas, kept here as the reference point.
+'''
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.harness import LocalRedis, percentiles
+from src.common import Config
+from src.consumer import compute_and_cache
+from src.checkpoint import engine_fields
+from src.indicators import sma, ema, rsi, macd, bollinger
+from src.storage import init_sqlite, connect, CandleWriter
+
+
+def recompute(path: str, symbol: str) -> dict:
+    con = connect(path)
+    try:
+        df = pd.read_sql_query(
+            "SELECT * FROM candles WHERE symbol=? ORDER BY t_start_ms DESC LIMIT 300",
+            con, params=(symbol,)
+        )
+    finally:
+        con.close()
+    df = df.sort_values("t_start_ms")
+    close = df["close"]
+    df["sma20"] = sma(close, 20)
+    df["ema20"] = ema(close, 20)
+    df["rsi14"] = rsi(close, 14)
+    df["macd"], df["macd_signal"], df["macd_hist"] = macd(close)
+    df["bb_lower"], df["bb_mid"], df["bb_upper"] = bollinger(close, 20, 2.0)
+    return df.iloc[-1].to_dict()
+
+
+def run(candles: int = 2000) -> dict:
+    rng = np.random.default_rng(1)
+    closes = (30000 + np.cumsum(rng.normal(0, 5, candles))).tolist()
+    rows = [{"symbol": "btcusdt", "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+             "open": c, "high": c, "low": c, "close": c, "volume": 1.0} for i, c in enumerate(closes)]
+
+    out = {}
+    with tempfile.TemporaryDirectory() as d:
+        cfg = Config(sqlite_path=os.path.join(d, "bench.db"))
+        init_sqlite(cfg.sqlite_path)
+        with CandleWriter(cfg.sqlite_path) as w:
+            for row in rows:
+                w.add(row)
+
+        for name, checkpoint in (("incremental", False), ("incremental_checkpoint", True)):
+            r, engines = LocalRedis(), {}
+            lat = []
+            for row in rows:
+                t0 = time.perf_counter()
+                compute_and_cache(cfg, r, engines, row)
+                if checkpoint:
+                    engine_fields("btcusdt", engines["btcusdt"])
+                lat.append((time.perf_counter() - t0) * 1e6)
+            # first call warms the engine from SQLite; report steady state
+            out[f"{name}_us"] = percentiles(lat[1:])
+            out[f"{name}_warmup_us"] = lat[0]
+
+        lat = []
+        for _ in range(min(200, candles)):
+            t0 = time.perf_counter()
+            recompute(cfg.sqlite_path, "btcusdt")
+            lat.append((time.perf_counter() - t0) * 1e6)
+        out["recompute_us"] = percentiles(lat)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--candles", type=int, default=2000)
+    args = ap.parse_args()
+    print(json.dumps(run(args.candles), indent=2))
+
+
+if __name__ == "__main__":
+    main()
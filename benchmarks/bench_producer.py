@@ -0,0 +1,143 @@
+'''
+Producer decode/normalize throughput, legacy path vs fast path.
+
+  python -m benchmarks.bench_producer [--messages 200000] [--symbols 50]
+
+"cpu" runs decode+normalize over pre-built frames in a tight loop.
+"ws" serves the same frames from a local websocket stand-in (separate
+process) and measures the producer side: messages per CPU-second of the
+receiving process, i.e. messages/sec per core.
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import random
+import time
+
+import websockets
+
+from src.producer import (
+    json_loads,
+    normalize_binance_trade,
+    normalize_binance_trade_fast,
+)
+
+
+def make_trades(n: int, symbols: list[str], seed: int = 1) -> list[tuple[str, dict]]:
+    rng = random.Random(seed)
+    px = {s: 100.0 + 10 * i for i, s in enumerate(symbols)}
+    ts = 1_700_000_000_000
+    out = []
+    for i in range(n):
+        s = symbols[i % len(symbols)]
+        px[s] *= 1 + rng.gauss(0, 1e-4)
+        ts += rng.randint(0, 3)
+        out.append((s, {
+            "e": "aggTrade", "E": ts, "s": s.upper(), "a": i,
+            "p": f"{px[s]:.8f}", "q": f"{rng.expovariate(10):.8f}",
+            "f": i, "l": i, "T": ts, "m": rng.random() < 0.5, "M": True,
+        }))
+    return out
+
+
+def frames(trades, combined: bool) -> list[str]:
+    if combined:
+        return [json.dumps({"stream": f"{s}@aggTrade", "data": m}) for s, m in trades]
+    return [json.dumps(m) for _, m in trades]
+
+
+def handle_legacy(raw, symbol):
+    return normalize_binance_trade(json.loads(raw), symbol)
+
+
+def handle_fast_combined(raw, symbol=None):
+    env = json_loads(raw)
+    return normalize_binance_trade_fast(env["data"], env["stream"].split("@", 1)[0])
+
+
+def bench_cpu(trades) -> dict:
+    out = {}
+    legacy_frames = frames(trades, combined=False)
+    symbols = [s for s, _ in trades]
+    t0 = time.perf_counter()
+    for raw, s in zip(legacy_frames, symbols):
+        handle_legacy(raw, s)
+    out["legacy_msgs_per_sec"] = len(trades) / (time.perf_counter() - t0)
+
+    fast_frames = frames(trades, combined=True)
+    t0 = time.perf_counter()
+    for raw in fast_frames:
+        handle_fast_combined(raw)
+    out["fast_msgs_per_sec"] = len(trades) / (time.perf_counter() - t0)
+    out["speedup"] = out["fast_msgs_per_sec"] / out["legacy_msgs_per_sec"]
+    return out
+
+
+def _serve(port_q: mp.Queue, payload: list[str]) -> None:
+    async def handler(ws):
+        for raw in payload:
+            await ws.send(raw)
+        await ws.close()
+
+    async def go():
+        async with websockets.serve(handler, "127.0.0.1", 0, max_queue=None) as server:
+            port_q.put(server.sockets[0].getsockname()[1])
+            await asyncio.Future()
+
+    asyncio.run(go())
+
+
+async def _consume(url: str, handle, symbol: str) -> int:
+    n = 0
+    async with websockets.connect(url, max_size=None) as ws:
+        async for raw in ws:
+            handle(raw, symbol)
+            n += 1
+    return n
+
+
+def bench_ws(trades) -> dict:
+    out = {}
+    single = trades[0][0]
+    for name, combined, handle in (
+        ("legacy", False, handle_legacy),
+        ("fast", True, handle_fast_combined),
+    ):
+        q = mp.Queue()
+        proc = mp.Process(target=_serve, args=(q, frames(trades, combined)), daemon=True)
+        proc.start()
+        try:
+            port = q.get(timeout=30)
+            cpu0, wall0 = time.process_time(), time.perf_counter()
+            n = asyncio.run(_consume(f"ws://127.0.0.1:{port}/", handle, single))
+            cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+        finally:
+            proc.terminate()
+            proc.join()
+        out[f"{name}_msgs_per_cpu_sec"] = n / cpu if cpu else float("inf")
+        out[f"{name}_msgs_per_wall_sec"] = n / wall
+    out["speedup_per_core"] = out["fast_msgs_per_cpu_sec"] / out["legacy_msgs_per_cpu_sec"]
+    return out
+
+
+def run(messages: int = 200_000, symbols: int = 50) -> dict:
+    syms = [f"sym{i}usdt" for i in range(symbols)]
+    trades = make_trades(messages, syms)
+    return {
+        "decoder": getattr(json_loads, "__module__", None) or "json",
+        "cpu": bench_cpu(trades),
+        "ws": bench_ws(trades),
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=200_000)
+    ap.add_argument("--symbols", type=int, default=50)
+    args = ap.parse_args()
+    print(json.dumps(run(args.messages, args.symbols), indent=2))
+
+
+if __name__ == "__main__":
+    main()
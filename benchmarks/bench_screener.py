@@ -0,0 +1,83 @@
+'''
+Screener pass over many symbols (src/screener.py) vs the per-symbol approach.
+
+  python -m benchmarks.bench_screener [--symbols 500,1000] [--window 300]
+
+vectorized: Screener.compute() + ranks() + rows() over all symbols at once,
+what runs on every bucket boundary. per_symbol: the same indicators through
+the pandas functions in src/indicators.py one symbol at a time (the data is
+already in memory, so this leaves out the per-symbol SQLite reads it would
+need in practice). budget_pct: vectorized time as a share of a 5s candle.
+'''
+import json
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from src.indicators import rsi, macd, bollinger
+from src.screener import Screener
+
+BUCKET_MS = 5000
+
+
+def make_screener(symbols: int, window: int, seed: int = 1) -> Screener:
+    rng = np.random.default_rng(seed)
+    scr = Screener([f"sym{i}" for i in range(symbols)], BUCKET_MS, window)
+    scr.last_start = (window - 1) * BUCKET_MS
+    scr.close[:] = 100 + np.cumsum(rng.normal(0, 1, (symbols, window)), axis=1)
+    scr.volume[:] = rng.exponential(1.0, (symbols, window))
+    # a few quiet symbols with gaps
+    scr.close[: symbols // 20, -5:] = np.nan
+    return scr
+
+
+def best_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def per_symbol(scr: Screener) -> None:
+    for i in range(len(scr.symbols)):
+        c = pd.Series(scr.close[i]).ffill()
+        rsi(c)
+        macd(c)
+        bollinger(c)
+
+
+def run(symbols=(500, 1000), window: int = 300, repeat: int = 5) -> dict:
+    out = {}
+    for n in symbols:
+        scr = make_screener(n, window)
+
+        def vectorized():
+            res = scr.compute()
+            scr.ranks(res)
+            scr.rows(res)
+
+        v = best_ms(vectorized, repeat)
+        p = best_ms(lambda: per_symbol(scr), max(1, repeat // 2))
+        out[str(n)] = {
+            "vectorized_ms": v,
+            "per_symbol_ms": p,
+            "speedup": p / v,
+            "budget_pct": v / BUCKET_MS * 100,
+        }
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", default="500,1000")
+    ap.add_argument("--window", type=int, default=300)
+    args = ap.parse_args()
+    print(json.dumps(run(tuple(int(s) for s in args.symbols.split(",")), args.window), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+'''
+Soak test: exchange simulator -> producer -> Redis -> consumer, for minutes or hours.
+
+  python -m benchmarks.bench_soak [--symbols 50] [--rate 20] [--seconds 300] [--combined --connections 4]
+  python -m benchmarks.bench_soak --seconds 3600 --drop-rate 0.001 --stall-rate 0.005 --malformed 0.0001
+  python -m benchmarks.bench_soak --redis        # real Redis at REDIS_HOST:REDIS_PORT
+
+The simulator (src/simulator.py) runs in a child process. The real producer
+code (run_symbol / run_combined feeding a StreamPublisher, WS_BASE_URL pointed
+at the simulator) runs on an asyncio loop in a thread, and the consumer read
+loop (handle_batch, timer finalization, rollups, indicator pool, live
+candles, checkpoints, SQLite group commit) on the main thread, as in
+src/consumer.py. Redis is the in-process stand-in unless --redis; that run
+uses its own stream prefix and group and deletes them afterwards, but leaves
+the latest:/live: keys of its sym*usdt symbols, so point it at a scratch instance.
+
+Every --sample-sec it records trades/sec published and consumed, the stream
+backlog (published - consumed), read lag (trade time -> consumer read) and
+the RSS of this process (producer + consumer; the simulator is separate).
+The report has the sustained rates and lag percentiles after --warmup, and
+the RSS growth over the same span, total and as a least-squares slope in
+MB/min: a slope that stays positive over a long run is a leak.
+'''
+import os
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing as mp
+from dataclasses import asdict, replace
+
+import numpy as np
+
+from benchmarks.harness import LocalRedis, AsyncLocalRedis, percentiles, symbols as make_symbols
+from src import producer, consumer
+from src.common import Config, now_ms, rollup_frames
+from src.aggregator import CandleAggregator, RollupAggregator
+from src.consumer import ensure_group, stream_key, handle_batch, finalize_candles, indicator_pool, checkpoint_now
+from src.live import LivePublisher
+from src.simulator import Simulator, Faults, serve
+from src.storage import init_sqlite, CandleWriter
+from src.wire import decode_trade
+
+# read lag histogram: 1ms bins up to a minute, constant memory however long the run
+LAG_BINS = 60_000
+# stream trimming with the in-process Redis: its entries live in our RSS, and
+# short streams level off within the warm-up (a consumer this far behind loses trades)
+LOCAL_MAXLEN = 500
+
+
+def _serve_simulator(port_q: mp.Queue, rate: float, faults: Faults, seed: int) -> None:
+    asyncio.run(serve(Simulator(rate, faults, seed=seed), "127.0.0.1", 0, port_q.put))
+
+
+def rss_mb() -> float:
+    # current resident set size; peak RSS where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def hist_percentiles(hist: np.ndarray, ps=(50, 95, 99)) -> dict:
+    total = hist.sum()
+    if not total:
+        return {f"p{p}": float("nan") for p in ps}
+    cum = np.cumsum(hist)
+    return {f"p{p}": float(np.searchsorted(cum, total * p / 100)) for p in ps}
+
+
+class ProducerThread(threading.Thread):
+    # the producer's websocket readers and XADD writer on their own event loop
+    def __init__(self, cfg: Config, syms: list[str], make_redis):
+        super().__init__(name="producer", daemon=True)
+        self.cfg = cfg
+        self.syms = syms
+        self.make_redis = make_redis
+        self.ready = threading.Event()
+        self.pub = None
+
+    def run(self) -> None:
+        asyncio.run(self._main())
+
+    async def _main(self) -> None:
+        cfg = self.cfg
+        self.loop = asyncio.get_running_loop()
+        self.pub = producer.StreamPublisher(
+            self.make_redis(), cfg.stream_maxlen,
+            queue_size=cfg.producer_queue_size,
+            batch_size=cfg.producer_batch_size,
+            linger_ms=cfg.producer_linger_ms,
+            drop_when_full=cfg.producer_queue_policy == "drop",
+        )
+        normalize = producer.normalizer(cfg)
+        coros = [self.pub.run()]
+        if cfg.ws_combined:
+            coros += [producer.run_combined(cfg, self.pub, group, normalize, conn)
+                      for conn, group in enumerate(producer.split_symbols(self.syms, cfg.ws_connections))]
+        else:
+            coros += [producer.run_symbol(cfg, self.pub, s, normalize) for s in self.syms]
+        self.tasks = [asyncio.create_task(c) for c in coros]
+        self.ready.set()
+        try:
+            await asyncio.gather(*self.tasks)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(lambda: [t.cancel() for t in self.tasks])
+        self.join(10)
+
+
+def _reconnects() -> float:
+    return sum(c.value for c in producer.WS_RECONNECTS.children.values())
+
+
+def run(symbols: int = 50, rate: float = 20.0, seconds: float = 60.0, warmup: float = 10.0,
+        sample_sec: float = 5.0, combined: bool = False, connections: int = 1,
+        faults: Faults = None, use_redis: bool = False, seed: int = 1) -> dict:
+    syms = make_symbols(symbols)
+    faults = faults or Faults()
+    warmup = min(warmup, seconds / 2)
+    q = mp.Queue()
+    sim = mp.Process(target=_serve_simulator, args=(q, rate, faults, seed), daemon=True)
+    sim.start()
+    try:
+        port = q.get(timeout=30)
+        with tempfile.TemporaryDirectory() as d:
+            cfg = Config(
+                sqlite_path=os.path.join(d, "soak.db"), candle_sec=1, finalize_grace_ms=200,
+                finalize_interval_ms=50, ws_base_url=f"ws://127.0.0.1:{port}",
+                ws_combined=combined, ws_connections=connections, metrics_port=0,
+                stream_prefix=f"soak{os.getpid()}:", consumer_group=f"soak{os.getpid()}",
+            )
+            if not use_redis:
+                cfg = replace(cfg, stream_maxlen=LOCAL_MAXLEN, updates_maxlen=LOCAL_MAXLEN)
+            if use_redis:
+                r = consumer.redis_client(cfg)
+                make_redis = lambda: producer.redis_client(cfg)
+            else:
+                r = LocalRedis()
+                make_redis = lambda: AsyncLocalRedis(r)
+            try:
+                return _soak(cfg, r, make_redis, syms, rate, seconds, warmup, sample_sec)
+            finally:
+                if use_redis:
+                    r.delete(*[stream_key(cfg, s) for s in syms],
+                             *[f"checkpoint:{cfg.consumer_group}:{s}" for s in syms])
+    finally:
+        sim.terminate()
+        sim.join()
+
+
+def _soak(cfg: Config, r, make_redis, syms: list[str], rate: float, seconds: float,
+          warmup: float, sample_sec: float) -> dict:
+    init_sqlite(cfg.sqlite_path)
+    streams = {stream_key(cfg, s): ">" for s in syms}
+    for st in streams:
+        ensure_group(r, st, cfg.consumer_group)
+
+    agg = CandleAggregator(cfg.candle_sec * 1000, cfg.finalize_grace_ms, cfg.gap_fill)
+    frames = rollup_frames(cfg)
+    rollups = RollupAggregator(frames) if frames else None
+    engines = {}
+    pool = indicator_pool(cfg, r, engines)
+    live = LivePublisher(cfg)
+    base = {"reconnects": _reconnects(), "malformed": producer.MALFORMED.value,
+            "dlq": consumer.DEAD_LETTERED.value}
+
+    prod = ProducerThread(cfg, syms, make_redis)
+    prod.start()
+    prod.ready.wait(10)
+
+    lag_hist = np.zeros(LAG_BINS + 1, np.int64)
+    interval_lag, samples = [], []
+    consumed = 0
+    dirty = set()
+    t0 = time.monotonic()
+    next_sample = t0 + sample_sec
+    next_checkpoint = t0 + cfg.checkpoint_ms / 1000
+    warm = None  # (t, published, consumed, rss) when the warm-up ended
+    last = (t0, 0, 0)
+    writer = CandleWriter(cfg.sqlite_path, cfg.sqlite_batch_size, cfg.sqlite_flush_ms, wait=pool.wait_values)
+    try:
+        while True:
+            now = time.monotonic()
+            if now >= next_sample:
+                published = prod.pub.stats.published
+                t_prev, pub_prev, con_prev = last
+                dt = now - t_prev
+                rss = rss_mb()
+                samples.append({
+                    "t": round(now - t0, 1),
+                    "published_per_sec": (published - pub_prev) / dt,
+                    "consumed_per_sec": (consumed - con_prev) / dt,
+                    "backlog": published - consumed,
+                    "read_lag_p99_ms": percentiles(interval_lag, (99,))["p99"],
+                    "rss_mb": rss,
+                })
+                last, interval_lag = (now, published, consumed), []
+                next_sample = now + sample_sec
+                if warm is None and now - t0 >= warmup:
+                    warm = (now, published, consumed, rss)
+                    lag_hist[:] = 0
+                if now - t0 >= seconds:
+                    break
+
+            resp = r.xreadgroup(cfg.consumer_group, cfg.consumer_name, streams,
+                                count=cfg.read_count, block=cfg.finalize_interval_ms)
+            if resp:
+                t = now_ms()
+                lags = []
+                for _, msgs in resp:
+                    for _, f in msgs:
+                        try:
+                            lags.append(t - decode_trade(f)[0])
+                        except (ValueError, KeyError):
+                            pass  # dead-lettered by handle_batch
+                consumed += sum(len(msgs) for _, msgs in resp)
+                interval_lag.extend(lags)
+                if lags:
+                    np.add.at(lag_hist, np.clip(lags, 0, LAG_BINS), 1)
+                handle_batch(cfg, r, resp, agg, engines, writer, True, rollups, pool)
+                live.touch(st.split(":")[-1] for st, _ in resp)
+            closed = agg.advance(now_ms())
+            if closed:
+                finalize_candles(cfg, r, engines, writer, closed, rollups, pool)
+                dirty.update(symbol for symbol, _ in closed)
+            writer.maybe_flush()
+            live.maybe_flush(r, agg, rollups)
+            if cfg.checkpoint and dirty and time.monotonic() >= next_checkpoint:
+                checkpoint_now(cfg, r, agg, rollups, engines, writer, dirty)
+                dirty.clear()
+                next_checkpoint = time.monotonic() + cfg.checkpoint_ms / 1000
+    finally:
+        prod.stop()
+        pool.close(timeout=10.0)
+        writer.close()
+
+    t_end, pub_end, con_end = last
+    t_warm, pub_warm, con_warm, rss_warm = warm
+    span = max(t_end - t_warm, 1e-9)
+    after = [s for s in samples if s["t"] >= t_warm - t0]
+    rss = np.array([s["rss_mb"] for s in after])
+    ts = np.array([s["t"] for s in after])
+    return {
+        "symbols": len(syms),
+        "offered_per_sec": len(syms) * rate,
+        "published_per_sec": (pub_end - pub_warm) / span,
+        "consumed_per_sec": (con_end - con_warm) / span,
+        "read_lag_ms": hist_percentiles(lag_hist),
+        "backlog": {"max": max(s["backlog"] for s in after), "end": after[-1]["backlog"]},
+        "rss_mb": {"start": rss_warm, "end": float(rss[-1]), "max": float(rss.max())},
+        "rss_growth_mb": float(rss[-1] - rss_warm),
+        "rss_slope_mb_per_min": float(np.polyfit(ts, rss, 1)[0] * 60) if len(after) > 1 else 0.0,
+        "reconnects": _reconnects() - base["reconnects"],
+        "malformed": producer.MALFORMED.value - base["malformed"],
+        "dlq": consumer.DEAD_LETTERED.value - base["dlq"],
+        "samples": samples,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--symbols", type=int, default=50)
+    ap.add_argument("--rate", type=float, default=20.0, help="trades/sec per symbol")
+    ap.add_argument("--seconds", type=float, default=300.0, help="run length, warm-up included")
+    ap.add_argument("--warmup", type=float, default=30.0)
+    ap.add_argument("--sample-sec", type=float, default=5.0)
+    ap.add_argument("--combined", action="store_true", help="combined-stream sockets instead of one per symbol")
+    ap.add_argument("--connections", type=int, default=1)
+    ap.add_argument("--drop-rate", type=float, default=0.0)
+    ap.add_argument("--stall-rate", type=float, default=0.0)
+    ap.add_argument("--stall-ms", type=int, default=2000)
+    ap.add_argument("--malformed", type=float, default=0.0)
+    ap.add_argument("--redis", action="store_true", help="use the Redis at REDIS_HOST:REDIS_PORT")
+    args = ap.parse_args()
+    faults = Faults(args.drop_rate, args.stall_rate, args.stall_ms, args.malformed)
+    res = run(args.symbols, args.rate, args.seconds, args.warmup, args.sample_sec,
+              args.combined, args.connections, faults, args.redis)
+    res["faults"] = asdict(faults)
+    print(json.dumps(res, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+'''
+SQLite write/read latency.
+
+  python -m benchmarks.bench_storage [--rows 2000]
+
+insert_candle: one connection + commit per candle (legacy path).
+writer_flush: CandleWriter group commit of `batch` candles.
+read_candles: latest-500 read with `history` rows stored per symbol.
+'''
+import os
+import json
+import argparse
+import tempfile
+import time
+
+from benchmarks.harness import percentiles
+from src.storage import init_sqlite, insert_candle, read_candles, CandleWriter
+
+
+def _row(symbol: str, i: int) -> dict:
+    return {"symbol": symbol, "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+            "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10.0}
+
+
+def run(rows: int = 2000, batch: int = 100, history: int = 20_000, reads: int = 200) -> dict:
+    out = {}
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "bench.db")
+        init_sqlite(path)
+
+        lat = []
+        for i in range(rows):
+            t0 = time.perf_counter()
+            insert_candle(path, _row("legacy", i))
+            lat.append((time.perf_counter() - t0) * 1e6)
+        out["insert_candle_us"] = percentiles(lat)
+
+        lat = []
+        with CandleWriter(path, batch_size=10**9, flush_ms=10**9) as w:
+            for b in range(rows // batch):
+                for i in range(batch):
+                    w.add(_row(f"s{i}", b))
+                t0 = time.perf_counter()
+                w.flush()
+                lat.append((time.perf_counter() - t0) * 1e6)
+        out["writer_flush_us"] = percentiles(lat)
+        out["writer_per_candle_us"] = out["writer_flush_us"]["p50"] / batch
+
+        with CandleWriter(path, batch_size=10_000) as w:
+            for i in range(history):
+                w.add(_row("hist", i))
+        lat = []
+        for _ in range(reads):
+            t0 = time.perf_counter()
+            read_candles(path, "hist", limit=500)
+            lat.append((time.perf_counter() - t0) * 1e6)
+        out["read_candles_500_us"] = percentiles(lat)
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--batch", type=int, default=100)
+    args = ap.parse_args()
+    print(json.dumps(run(args.rows, args.batch), indent=2))
+
+
+if __name__ == "__main__":
+    main()
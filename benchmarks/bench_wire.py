@@ -0,0 +1,88 @@
+'''
+Stream entry size and consumer decode throughput: legacy text fields vs the
+packed format (WIRE_FORMAT=packed, src/wire.py).
+
+  python -m benchmarks.bench_wire [--n 100000] [--batch 1000] [--redis]
+
+bytes_per_entry counts field names + values as stored in the stream entry.
+With --redis, MEMORY USAGE of a stream of n entries in each format is also
+measured against the server from REDIS_HOST/REDIS_PORT. Decode runs on what
+a latin-1 decode_responses client returns (see src/consumer.py), batch by
+batch through parse_trades, for both formats.
+'''
+import json
+import time
+import argparse
+
+from benchmarks.bench_aggregation import make_msgs
+from src.consumer import parse_trades
+from src.wire import PACKED_FIELD, pack_trade
+
+
+def packed_msgs(msgs: list) -> list:
+    # same trades in the packed format, as a latin-1 decoding client sees them
+    return [
+        (i, {PACKED_FIELD: pack_trade(int(f["ts_ms"]), float(f["price"]), float(f["qty"]), f["side"]).decode("latin-1")})
+        for i, f in msgs
+    ]
+
+
+def entry_bytes(fields: dict) -> int:
+    return sum(len(k.encode()) + len(v.encode("latin-1")) for k, v in fields.items())
+
+
+def decode_rate(msgs: list, batch: int, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(0, len(msgs), batch):
+            parse_trades(msgs[i:i + batch])
+        best = min(best, time.perf_counter() - t0)
+    return len(msgs) / best
+
+
+def redis_memory(n: int) -> dict:
+    import redis
+    from src.common import Config
+    cfg = Config()
+    r = redis.Redis(host=cfg.redis_host, port=cfg.redis_port, password=cfg.redis_password or None)
+    text, packed = make_msgs(n), packed_msgs(make_msgs(n))
+    out = {}
+    for name, msgs in (("text", text), ("packed", packed)):
+        key = f"bench:wire:{name}"
+        r.delete(key)
+        pipe = r.pipeline(transaction=False)
+        for _, f in msgs:
+            pipe.xadd(key, {k: v.encode("latin-1") for k, v in f.items()})
+        pipe.execute()
+        out[f"{name}_redis_bytes_per_entry"] = r.memory_usage(key, samples=0) / n
+        r.delete(key)
+    return out
+
+
+def run(n: int = 100_000, batch: int = 1000, with_redis: bool = False) -> dict:
+    text = make_msgs(n)
+    packed = packed_msgs(text)
+    out = {
+        "text_bytes_per_entry": sum(entry_bytes(f) for _, f in text) / n,
+        "packed_bytes_per_entry": sum(entry_bytes(f) for _, f in packed) / n,
+        "text_decode_per_sec": decode_rate(text, batch),
+        "packed_decode_per_sec": decode_rate(packed, batch),
+    }
+    out["decode_speedup"] = out["packed_decode_per_sec"] / out["text_decode_per_sec"]
+    if with_redis:
+        out.update(redis_memory(min(n, 20_000)))
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100_000)
+    ap.add_argument("--batch", type=int, default=1000)
+    ap.add_argument("--redis", action="store_true", help="also measure MEMORY USAGE on a real Redis")
+    args = ap.parse_args()
+    print(json.dumps(run(args.n, args.batch, args.redis), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+'''
+Shared pieces for the benchmark suite: an in-process Redis stand-in,
+synthetic trade generators and small timing helpers.
+'''
+import time
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+
+class LocalRedis:
+    '''
+    In-process stand-in for the subset of redis-py the pipeline uses
+    (streams + consumer groups, hashes, pipelines). Thread safe; blocking
+    XREADGROUP waits on a condition variable like the real server would.
+    Returns str everywhere, like a decode_responses=True client.
+    '''
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.streams: dict[str, list] = defaultdict(list)
+        self.groups: dict[tuple, dict] = {}
+        self.hashes: dict[str, dict] = defaultdict(dict)
+        self.kv: dict[str, str] = {}
+        self._seq = 0
+        # optional hook: called as on_hset(key, mapping) after each HSET
+        self.on_hset = None
+
+    # ---- streams ----
+    def xadd(self, name, fields, id="*", maxlen=None, approximate=True):
+        with self.cond:
+            self._seq += 1
+            msg_id = f"{int(time.time() * 1000)}-{self._seq}"
+            s = self.streams[name]
+            s.append((msg_id, dict(fields)))
+            if maxlen is not None and len(s) > maxlen:
+                drop = len(s) - maxlen
+                del s[:drop]
+                for (st, _), g in self.groups.items():
+                    if st == name:
+                        g["next"] = max(0, g["next"] - drop)
+            self.cond.notify_all()
+            return msg_id
+
+    def xgroup_create(self, name, groupname, id="0", mkstream=False):
+        with self.cond:
+            self.streams.setdefault(name, [])
+            self.groups.setdefault((name, groupname), {"next": 0, "pending": {}})
+            return True
+
+    def xreadgroup(self, groupname, consumername, streams, count=None, block=None, noack=False):
+        deadline = time.monotonic() + (block or 0) / 1000
+        with self.cond:
+            while True:
+                out = []
+                for st in streams:
+                    g = self.groups[(st, groupname)]
+                    s = self.streams[st]
+                    end = len(s) if count is None else min(len(s), g["next"] + count)
+                    msgs = s[g["next"]:end]
+                    if msgs:
+                        g["next"] = end
+                        for msg_id, _ in msgs:
+                            g["pending"][msg_id] = consumername
+                        out.append((st, list(msgs)))
+                if out or block is None:
+                    return out
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return []
+                self.cond.wait(left)
+
+    def xack(self, name, groupname, *ids):
+        with self.cond:
+            p = self.groups[(name, groupname)]["pending"]
+            return sum(1 for i in ids if p.pop(i, None) is not None)
+
+    def xlen(self, name):
+        return len(self.streams[name])
+
+    def xpending_count(self, name, groupname):
+        return len(self.groups[(name, groupname)]["pending"])
+
+    # ---- hashes / strings ----
+    def hset(self, key, mapping=None, **kw):
+        with self.cond:
+            self.hashes[key].update(mapping or {})
+        if self.on_hset is not None:
+            self.on_hset(key, mapping)
+        return len(mapping or {})
+
+    def hgetall(self, key):
+        with self.cond:
+            return dict(self.hashes.get(key, {}))
+
+    def set(self, key, value, **kw):
+        self.kv[key] = value
+        return True
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline:
+    def __init__(self, r: LocalRedis):
+        self.r = r
+        self.calls = []
+
+    def __getattr__(self, name):
+        fn = getattr(self.r, name)
+
+        def queue(*a, **kw):
+            self.calls.append((fn, a, kw))
+            return self
+        return queue
+
+    def execute(self, raise_on_error=True):
+        calls, self.calls = self.calls, []
+        out = []
+        for fn, a, kw in calls:
+            try:
+                out.append(fn(*a, **kw))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                out.append(e)
+        return out
+
+
+class AsyncLocalRedis:
+    '''
+    asyncio face of a LocalRedis for the producer's StreamPublisher, which
+    only needs pipeline().xadd(...) and await execute().
+    '''
+    def __init__(self, r: LocalRedis):
+        self.r = r
+
+    def pipeline(self, transaction=True):
+        return AsyncLocalPipeline(self.r)
+
+
+class AsyncLocalPipeline(LocalPipeline):
+    async def execute(self, raise_on_error=True):
+        return LocalPipeline.execute(self, raise_on_error)
+
+
+def synthetic_trades(symbols: list[str], rate_per_symbol: float, seconds: float,
+                     start_ms: int = 1_700_000_000_000, seed: int = 1) -> list[tuple[str, dict]]:
+    '''
+    Poisson-ish trade arrivals per symbol with random-walk prices, merged in
+    time order. Fields match what the producer XADDs.
+    '''
+    rng = np.random.default_rng(seed)
+    out = []
+    for i, s in enumerate(symbols):
+        n = max(1, int(rate_per_symbol * seconds))
+        ts = start_ms + np.sort(rng.integers(0, int(seconds * 1000), n))
+        px = (100.0 + i) * np.exp(np.cumsum(rng.normal(0, 1e-4, n)))
+        qty = rng.exponential(0.1, n)
+        side = rng.random(n) < 0.5
+        out.extend(
+            (s, {"ts_ms": str(t), "symbol": s, "price": f"{p:.10f}", "qty": f"{q:.10f}",
+                 "side": "sell" if m else "buy", "src": "synthetic"})
+            for t, p, q, m in zip(ts.tolist(), px.tolist(), qty.tolist(), side.tolist())
+        )
+    out.sort(key=lambda x: int(x[1]["ts_ms"]))
+    return out
+
+
+def percentiles(samples, ps=(50, 95, 99)) -> dict:
+    if len(samples) == 0:
+        return {f"p{p}": float("nan") for p in ps}
+    a = np.asarray(samples, dtype=np.float64)
+    return {f"p{p}": float(np.percentile(a, p)) for p in ps}
+
+
+def symbols(n: int) -> list[str]:
+    return [f"sym{i}usdt" for i in range(n)]
+
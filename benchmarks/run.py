@@ -0,0 +1,170 @@
+'''
+Run the benchmark suite, write results as JSON and compare with a baseline.
+
+  python -m benchmarks.run                      # quick profile, all suites
+  python -m benchmarks.run --profile full --only consumer,storage
+  python -m benchmarks.run --update-baseline    # accept current numbers
+  python -m benchmarks.run --runs 3             # median of 3 runs per metric
+
+Everything runs locally: Redis is replaced by the in-process stand-in in
+benchmarks/harness.py and trades are synthetic (the soak suite gets them over
+websockets from the local exchange simulator). Metrics are flattened to
+dotted keys; throughput-like keys (*per_sec*, speedup) must not drop and
+latency keys (*_us, *_ms) must not rise by more than --tolerance versus the
+baseline. p99 values are reported but not gated, they are too noisy on a
+shared machine. Exit code 1 on regression. On a noisy machine use --runs N
+(for the baseline too): every metric is then the median of N runs of the suite.
+'''
+import sys
+import json
+import time
+import platform
+import statistics
+import argparse
+
+from benchmarks.harness import symbols
+from benchmarks import (
+    bench_aggregation, bench_consumer, bench_indicators, bench_producer, bench_screener, bench_soak, bench_storage,
+    bench_wire,
+)
+
+DEFAULT_BASELINE = "benchmarks/baseline.json"
+DEFAULT_OUT = "benchmarks/results.json"
+
+PROFILES = {
+    "quick": {
+        "normalize": lambda: bench_producer.bench_cpu(bench_producer.make_trades(50_000, symbols(20))),
+        "aggregation": lambda: bench_aggregation.run(total=100_000, repeat=3),
+        "consumer": lambda: {
+            "loop": bench_consumer.throughput(20, 20.0, 30.0, batch_agg_min=0),
+            "vectorized": bench_consumer.throughput(20, 20.0, 30.0, batch_agg_min=64),
+        },
+        "e2e": lambda: bench_consumer.end_to_end(20, 20.0, 4.0),
+        "storage": lambda: bench_storage.run(rows=500, history=5000, reads=100),
+        "indicators": lambda: bench_indicators.run(candles=500),
+        "wire": lambda: bench_wire.run(n=50_000),
+        "screener": lambda: bench_screener.run(symbols=(500,), repeat=3),
+        "soak": lambda: bench_soak.run(symbols=20, rate=20.0, seconds=15.0, warmup=5.0, sample_sec=1.0),
+    },
+    "full": {
+        "normalize": lambda: bench_producer.run(200_000, 50),
+        "aggregation": lambda: bench_aggregation.run(),
+        "consumer": lambda: {
+            "loop": bench_consumer.throughput(200, 20.0, 60.0, batch_agg_min=0),
+            "vectorized": bench_consumer.throughput(200, 20.0, 60.0, batch_agg_min=64),
+        },
+        "e2e": lambda: bench_consumer.end_to_end(200, 20.0, 15.0),
+        "storage": lambda: bench_storage.run(),
+        "indicators": lambda: bench_indicators.run(),
+        "wire": lambda: bench_wire.run(),
+        "screener": lambda: bench_screener.run(),
+        "soak": lambda: bench_soak.run(symbols=200, rate=20.0, seconds=180.0, warmup=60.0, combined=True, connections=4),
+    },
+}
+
+
+def flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else str(k)
+        if isinstance(v, dict):
+            out.update(flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def direction(key: str) -> int:
+    # +1 higher is better, -1 lower is better, 0 not gated
+    if key.endswith(".p99"):
+        return 0
+    if "per_sec" in key or "speedup" in key:
+        return 1
+    parts = key.split(".")
+    if any(p.endswith("_us") or p.endswith("_ms") for p in parts):
+        return -1
+    return 0
+
+
+def median_metrics(runs: list[dict]) -> dict:
+    # per key, the median over the runs that reported it (results keep the last run)
+    keys = dict.fromkeys(k for run in runs for k in run)
+    return {k: statistics.median(run[k] for run in runs if k in run) for k in keys}
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for key, base in sorted(baseline.items()):
+        d = direction(key)
+        cur = current.get(key)
+        if d == 0 or cur is None or base != base or cur != cur or base == 0:
+            continue
+        change = (cur - base) / abs(base)
+        if d * change < -tolerance:
+            regressions.append(f"{key}: {base:.4g} -> {cur:.4g} ({change:+.0%})")
+    return regressions
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    ap.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    ap.add_argument("--only", default="", help="comma separated suites: " + ",".join(PROFILES["quick"]))
+    ap.add_argument("--out", default=DEFAULT_OUT)
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--tolerance", type=float, default=0.3, help="allowed relative regression")
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--runs", type=int, default=1, help="run each suite N times, report per-metric medians")
+    args = ap.parse_args()
+
+    suites = PROFILES[args.profile]
+    names = [n for n in args.only.split(",") if n] or list(suites)
+
+    results, runs = {}, []
+    for i in range(args.runs):
+        for name in names:
+            t0 = time.perf_counter()
+            results[name] = suites[name]()
+            print(f"{name:12s} done in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+        runs.append(flatten(results))
+
+    metrics = median_metrics(runs)
+    doc = {
+        "profile": args.profile,
+        "runs": args.runs,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+        "metrics": metrics,
+    }
+    with open(args.out, "w") as f:
+        json.dump(doc, f, indent=2)
+    print(f"results -> {args.out}", file=sys.stderr)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"profile": args.profile, "runs": args.runs, "metrics": metrics}, f, indent=2)
+        print(f"baseline updated -> {args.baseline}", file=sys.stderr)
+        return
+
+    try:
+        with open(args.baseline) as f:
+            base = json.load(f)
+    except FileNotFoundError:
+        print(f"no baseline at {args.baseline} (run with --update-baseline)", file=sys.stderr)
+        return
+    if base.get("profile") != args.profile:
+        print(f"baseline is for profile {base.get('profile')!r}, not comparing", file=sys.stderr)
+        return
+
+    ungated = sorted(k for k in metrics if direction(k) and k not in base["metrics"])
+    if ungated:
+        print(f"not in the baseline, not gated ({len(ungated)}):", *ungated, sep="\n  ", file=sys.stderr)
+    regressions = compare(metrics, base["metrics"], args.tolerance)
+    if regressions:
+        print("REGRESSIONS:", *regressions, sep="\n  ", file=sys.stderr)
+        sys.exit(1)
+    print(f"no regressions vs baseline (tolerance {args.tolerance:.0%})", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
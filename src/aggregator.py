@@ -0,0 +1,511 @@
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from typing import Optional
+
+import numpy as np
+
+log = logging.getLogger("aggregator")
+
+@dataclass
+class Candle:
+    t_start_ms: int
+    t_end_ms: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    # order flow, accumulated in the same pass as OHLCV (zero for gap-filled candles)
+    quote_volume: float = 0.0  # sum(price * qty), the VWAP numerator
+    buy_volume: float = 0.0
+    sell_volume: float = 0.0
+    trades: int = 0
+    max_qty: float = 0.0
+
+    @property
+    def vwap(self) -> float:
+        return self.quote_volume / self.volume if self.volume else float("nan")
+
+def merge(cur: Candle, c: Candle) -> None:
+    # fold c (the next candle of the same rollup bucket) into cur, in place
+    cur.high = max(cur.high, c.high)
+    cur.low = min(cur.low, c.low)
+    cur.close = c.close
+    cur.volume += c.volume
+    cur.quote_volume += c.quote_volume
+    cur.buy_volume += c.buy_volume
+    cur.sell_volume += c.sell_volume
+    cur.trades += c.trades
+    cur.max_qty = max(cur.max_qty, c.max_qty)
+
+def _flow(price: np.ndarray, qty: np.ndarray, sell: Optional[np.ndarray]) -> np.ndarray:
+    # per-trade (volume, quote volume, buy volume, sell volume) rows; adding 0.0 for the other side is exact,
+    # and so are qty * 1.0, qty * 0.0 and qty - qty (written in place, no temporaries)
+    f = np.empty((len(qty), 4))
+    f[:, 0] = qty
+    np.multiply(price, qty, out=f[:, 1])
+    if sell is None:
+        f[:, 2], f[:, 3] = qty, 0.0
+    else:
+        np.multiply(qty, sell, out=f[:, 3])
+        np.subtract(qty, f[:, 3], out=f[:, 2])
+    return f
+
+def _sums(start, f: np.ndarray) -> list:
+    # start + f[0] + f[1] + ... per column, added row by row like a `+=` loop (bit-for-bit)
+    acc = np.empty((len(f) + 1, f.shape[1]))
+    acc[0] = start
+    acc[1:] = f
+    return np.add.accumulate(acc, axis=0)[-1].tolist()
+
+def _run_candle(t0: int, t1: int, p: np.ndarray, q: np.ndarray, f: np.ndarray) -> Candle:
+    # a new candle from a run of trades, equal to add() over them one by one
+    volume, quote_volume, buy_volume, sell_volume = _sums((0.0, 0.0, 0.0, 0.0), f)
+    return Candle(
+        t_start_ms=t0, t_end_ms=t1,
+        open=float(p[0]), high=float(p.max()), low=float(p.min()), close=float(p[-1]),
+        volume=volume, quote_volume=quote_volume, buy_volume=buy_volume, sell_volume=sell_volume,
+        trades=len(p), max_qty=float(q.max()),
+    )
+
+def _fold(c: Candle, p: np.ndarray, q: np.ndarray, f: np.ndarray) -> None:
+    # a run of trades into an open candle, equal to add() over them one by one
+    c.high = max(c.high, float(p.max()))
+    c.low = min(c.low, float(p.min()))
+    c.close = float(p[-1])
+    c.volume, c.quote_volume, c.buy_volume, c.sell_volume = _sums(
+        (c.volume, c.quote_volume, c.buy_volume, c.sell_volume), f)
+    c.trades += len(p)
+    c.max_qty = max(c.max_qty, float(q.max()))
+
+def floor_bucket(ts_ms: int, bucket_ms: int) -> int:
+    '''
+    consumer takes trades and buckets them into fixed time windows.
+    This function computes bucket for trades.
+    '''
+    return (ts_ms // bucket_ms) * bucket_ms
+
+class TimingWheel:
+    '''
+    Hashed timing wheel: timers are filed under their deadline tick, and
+    advance(now) pops every timer whose tick has passed. schedule() is O(1);
+    advance() is O(due timers + elapsed ticks), independent of how many
+    timers are pending further out.
+    '''
+    def __init__(self, tick_ms: int = 100):
+        self.tick_ms = tick_ms
+        self.slots: dict[int, list] = defaultdict(list)
+        self.cursor: Optional[int] = None  # last tick already fired
+        self.overdue: list = []
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self.slots.values()) + len(self.overdue)
+
+    def schedule(self, deadline_ms: int, item) -> None:
+        t = -(-deadline_ms // self.tick_ms)  # ceil: never fire before the deadline
+        if self.cursor is not None and t <= self.cursor:
+            self.overdue.append(item)
+        else:
+            self.slots[t].append(item)
+
+    def advance(self, now_ms: int) -> list:
+        now_t = now_ms // self.tick_ms
+        due, self.overdue = self.overdue, []
+        if self.cursor is None:
+            self.cursor = min(self.slots, default=now_t + 1) - 1
+
+        if now_t - self.cursor > len(self.slots):
+            # long idle gap: walk the occupied slots instead of every tick
+            ticks = sorted(t for t in self.slots if t <= now_t)
+        else:
+            ticks = range(self.cursor + 1, now_t + 1)
+        for t in ticks:
+            due.extend(self.slots.pop(t, ()))
+
+        self.cursor = max(self.cursor, now_t)
+        return due
+
+class CandleAggregator:
+    '''
+    Per-symbol open candles with watermark-based finalization.
+
+    A candle is finalized either when a trade for a later bucket arrives, or
+    when wall clock passes t_end_ms + grace_ms (advance(), driven by a timing
+    wheel), whichever comes first. Trades for a bucket that is already
+    finalized are late and dropped (counted in late_trades). With gap_fill,
+    buckets without trades are emitted as forward-filled candles
+    (O=H=L=C=previous close, volume 0) so every symbol gets one candle per bucket.
+
+    Besides OHLCV each candle carries its order flow (quote volume for the
+    VWAP, buy/sell volume by taker side, trade count, largest trade), updated
+    with the same trade, so there is no second pass.
+
+    add()/advance()/flush() return lists of (symbol, Candle) that were finalized.
+    '''
+    def __init__(self, bucket_ms: int, grace_ms: int = 0, gap_fill: bool = False, tick_ms: int = 100):
+        self.bucket_ms = bucket_ms
+        self.grace_ms = grace_ms
+        self.gap_fill = gap_fill
+        self.current: dict[str, Candle] = {}
+        # end of the last finalized candle per symbol (the symbol's watermark)
+        self.closed_until: dict[str, int] = {}
+        self.last_close: dict[str, float] = {}
+        # (ts_ms, price, qty) of the last accepted trade per symbol
+        self.last_trade: dict[str, tuple] = {}
+        self.wheel = TimingWheel(tick_ms)
+        self._deadline: dict[str, int] = {}
+        self.late_trades = 0
+
+    def add(self, symbol: str, ts: int, price: float, qty: float, sell: bool = False) -> list:
+        t0 = floor_bucket(ts, self.bucket_ms)
+
+        c = self.current.get(symbol)
+        if t0 < self.closed_until.get(symbol, t0) or (c is not None and t0 < c.t_start_ms):
+            self.late_trades += 1
+            return []
+        self.last_trade[symbol] = (ts, price, qty)
+
+        if c is not None and c.t_start_ms == t0:
+            # update candle
+            c.high = max(c.high, price)
+            c.low = min(c.low, price)
+            c.close = price
+            c.volume += qty
+            c.quote_volume += price * qty
+            if sell:
+                c.sell_volume += qty
+            else:
+                c.buy_volume += qty
+            c.trades += 1
+            if qty > c.max_qty:
+                c.max_qty = qty
+            return []
+
+        out = []
+        if c is not None:
+            out.extend(self._finalize(symbol, c))
+        if self.gap_fill:
+            out.extend(self._fill(symbol, t0))
+
+        # start new candle
+        self.current[symbol] = Candle(t_start_ms=t0, t_end_ms=t0 + self.bucket_ms, open=price, high=price, low=price, close=price, volume=qty,
+                                      quote_volume=price * qty, buy_volume=0.0 if sell else qty,
+                                      sell_volume=qty if sell else 0.0, trades=1, max_qty=qty)
+        self._schedule(symbol, t0 + self.bucket_ms + self.grace_ms)
+        return out
+
+    def add_batch(self, symbol: str, ts: np.ndarray, price: np.ndarray, qty: np.ndarray,
+                  sell: Optional[np.ndarray] = None) -> list:
+        '''
+        Vectorized equivalent of calling add() for each trade in order: same
+        candles (bit-for-bit, sums are accumulated sequentially like `+=`),
+        same late-trade handling. sell is a bool array (None: all buys).
+        Cost is O(trades) in NumPy plus O(buckets) in Python, and a batch
+        rarely spans more than a couple of buckets.
+        '''
+        if len(ts) == 0:
+            return []
+        b = (ts // self.bucket_ms) * self.bucket_ms
+
+        c = self.current.get(symbol)
+        front = c.t_start_ms if c is not None else self.closed_until.get(symbol, int(b[0]))
+        b0 = int(b[0])
+        if b0 >= front and b0 == b.min() == b.max():
+            # the common case: the whole batch falls into one bucket, nothing late
+            runs = [(0, len(b))]
+        else:
+            # a trade is late if its bucket is behind everything seen before it
+            seen = np.maximum.accumulate(np.concatenate(([front], b)))[:-1]
+            ok = b >= seen
+            if not ok.all():
+                self.late_trades += int(len(ok) - np.count_nonzero(ok))
+                b, ts, price, qty = b[ok], ts[ok], price[ok], qty[ok]
+                if sell is not None:
+                    sell = sell[ok]
+                if len(b) == 0:
+                    return []
+            # remaining buckets are non-decreasing: one run per candle
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(b)) + 1))
+            ends = np.concatenate((starts[1:], [len(b)]))
+            runs = zip(starts.tolist(), ends.tolist())
+        self.last_trade[symbol] = (int(ts[-1]), float(price[-1]), float(qty[-1]))
+
+        flow = _flow(price, qty, sell)
+
+        out = []
+        for i, j in runs:
+            t0 = int(b[i])
+            run = (price[i:j], qty[i:j], flow[i:j])
+
+            c = self.current.get(symbol)
+            if c is not None and c.t_start_ms == t0:
+                _fold(c, *run)
+                continue
+
+            if c is not None:
+                out.extend(self._finalize(symbol, c))
+            if self.gap_fill:
+                out.extend(self._fill(symbol, t0))
+            self.current[symbol] = _run_candle(t0, t0 + self.bucket_ms, *run)
+            self._schedule(symbol, t0 + self.bucket_ms + self.grace_ms)
+        return out
+
+    def advance(self, now_ms: int) -> list:
+        out = []
+        for symbol, deadline in self.wheel.advance(now_ms):
+            if self._deadline.get(symbol) != deadline:
+                continue  # superseded by a later schedule
+            del self._deadline[symbol]
+
+            watermark = now_ms - self.grace_ms
+            c = self.current.get(symbol)
+            if c is not None and c.t_end_ms <= watermark:
+                out.extend(self._finalize(symbol, c))
+            if self.gap_fill and symbol not in self.current and symbol in self.closed_until:
+                out.extend(self._fill(symbol, floor_bucket(watermark, self.bucket_ms)))
+
+            c = self.current.get(symbol)
+            if c is not None:
+                self._schedule(symbol, c.t_end_ms + self.grace_ms)
+            elif self.gap_fill and symbol in self.closed_until:
+                self._schedule(symbol, self.closed_until[symbol] + self.bucket_ms + self.grace_ms)
+        return out
+
+    def flush(self) -> list:
+        # finalize every open candle now (shutdown)
+        out = []
+        for symbol in list(self.current):
+            out.extend(self._finalize(symbol, self.current[symbol]))
+        return out
+
+    def release(self, symbol: str) -> Optional[Candle]:
+        # forget a symbol (another worker takes it over); returns its open candle
+        self.closed_until.pop(symbol, None)
+        self.last_close.pop(symbol, None)
+        self.last_trade.pop(symbol, None)
+        self._deadline.pop(symbol, None)
+        return self.current.pop(symbol, None)
+
+    def restore(self, symbol: str, c: Optional[Candle], closed_until: Optional[int] = None,
+                last_close: Optional[float] = None) -> None:
+        # take over a symbol's state (handoff or checkpoint); c may be None between candles
+        if closed_until is not None:
+            self.closed_until[symbol] = closed_until
+        if last_close is not None:
+            self.last_close[symbol] = last_close
+        if c is not None:
+            self.current[symbol] = c
+            self._schedule(symbol, c.t_end_ms + self.grace_ms)
+        elif self.gap_fill and closed_until is not None and last_close is not None:
+            self._schedule(symbol, closed_until + self.bucket_ms + self.grace_ms)
+
+    def _schedule(self, symbol: str, deadline: int) -> None:
+        self._deadline[symbol] = deadline
+        self.wheel.schedule(deadline, (symbol, deadline))
+
+    def _finalize(self, symbol: str, c: Candle) -> list:
+        del self.current[symbol]
+        self.closed_until[symbol] = c.t_end_ms
+        self.last_close[symbol] = c.close
+        return [(symbol, c)]
+
+    def _fill(self, symbol: str, until_ms: int) -> list:
+        # forward-filled candles for every empty bucket in [closed_until, until_ms)
+        out = []
+        t = self.closed_until.get(symbol)
+        if t is None:
+            return out
+        px = self.last_close[symbol]
+        while t + self.bucket_ms <= until_ms:
+            out.append((symbol, Candle(t_start_ms=t, t_end_ms=t + self.bucket_ms, open=px, high=px, low=px, close=px, volume=0.0)))
+            t += self.bucket_ms
+        self.closed_until[symbol] = t
+        return out
+
+class RollupAggregator:
+    '''
+    Higher-timeframe candles built incrementally from finalized base candles
+    (frames: label -> bucket ms, each a multiple of the base bucket).
+
+    add() merges one base candle into every timeframe in O(timeframes) (order
+    flow included: sums add up, max_qty is the largest of the base candles) and
+    returns (symbol, tf, Candle) for rollups that completed: as soon as a base
+    candle reaches the end of the rollup bucket, or, if that base candle never
+    came (no gap fill), when the first candle of a later bucket arrives.
+    Base candles must come in time order per symbol, as CandleAggregator emits them.
+    '''
+    def __init__(self, frames: dict[str, int]):
+        self.frames = frames
+        self.current: dict[tuple[str, str], Candle] = {}
+        self.closed_until: dict[tuple[str, str], int] = {}
+
+    def add(self, symbol: str, c: Candle) -> list:
+        out = []
+        for tf, ms in self.frames.items():
+            key = (symbol, tf)
+            t0 = floor_bucket(c.t_start_ms, ms)
+            if t0 < self.closed_until.get(key, t0):
+                continue  # rollup already emitted (replayed history)
+
+            cur = self.current.get(key)
+            if cur is not None and cur.t_start_ms == t0:
+                merge(cur, c)
+            elif cur is None or cur.t_start_ms < t0:
+                if cur is not None:
+                    out.append(self._finalize(symbol, tf, cur))
+                cur = self.current[key] = replace(c, t_start_ms=t0, t_end_ms=t0 + ms)
+            else:
+                continue  # older than the open rollup
+
+            if c.t_end_ms >= cur.t_end_ms:
+                out.append(self._finalize(symbol, tf, cur))
+        return out
+
+    def seed(self, symbol: str, tf: str, closed_until: int) -> None:
+        # end of the last stored rollup: base candles before it are already counted
+        self.closed_until[(symbol, tf)] = closed_until
+
+    def restore(self, symbol: str, tf: str, current: Optional[Candle], closed_until: Optional[int]) -> None:
+        if tf not in self.frames:
+            return  # timeframe no longer configured
+        if current is not None:
+            self.current[(symbol, tf)] = current
+        if closed_until is not None:
+            self.closed_until[(symbol, tf)] = closed_until
+
+    def release(self, symbol: str) -> None:
+        for tf in self.frames:
+            self.current.pop((symbol, tf), None)
+            self.closed_until.pop((symbol, tf), None)
+
+    def _finalize(self, symbol: str, tf: str, c: Candle) -> tuple:
+        del self.current[(symbol, tf)]
+        self.closed_until[(symbol, tf)] = c.t_end_ms
+        return (symbol, tf, c)
+
+class BarAggregator:
+    '''
+    Information-driven bars per symbol (specs: label -> (Candle field,
+    threshold), see common.bar_specs), fed the same trades as the time
+    candles. A bar closes on the trade that brings its trade count (t<N>),
+    base volume (v<V>) or quote notional (d<D>) to the threshold; that trade
+    belongs to the closing bar. Busy markets make many bars and quiet ones
+    few, so storage and indicator work follow activity, not the clock.
+
+    Bars have no buckets and no lateness: trades count in arrival order. A
+    bar spans [t_start_ms, t_end_ms) from its first trade to one past its
+    last, and never starts before the previous bar ended, so t_start_ms stays
+    unique and increasing per (symbol, bar) even when several bars close
+    within one millisecond.
+
+    add()/add_batch() return (symbol, label, Candle) for bars that closed.
+    '''
+    def __init__(self, specs: dict[str, tuple[str, float]]):
+        self.specs = specs
+        self.current: dict[tuple[str, str], Candle] = {}
+        self.closed_until: dict[tuple[str, str], int] = {}
+
+    def add(self, symbol: str, ts: int, price: float, qty: float, sell: bool = False) -> list:
+        out = []
+        for label, (field, threshold) in self.specs.items():
+            key = (symbol, label)
+            c = self.current.get(key)
+            if c is None:
+                t0 = max(ts, self.closed_until.get(key, ts))
+                c = self.current[key] = Candle(
+                    t_start_ms=t0, t_end_ms=t0 + 1, open=price, high=price, low=price, close=price, volume=qty,
+                    quote_volume=price * qty, buy_volume=0.0 if sell else qty,
+                    sell_volume=qty if sell else 0.0, trades=1, max_qty=qty,
+                )
+            else:
+                c.high = max(c.high, price)
+                c.low = min(c.low, price)
+                c.close = price
+                c.volume += qty
+                c.quote_volume += price * qty
+                if sell:
+                    c.sell_volume += qty
+                else:
+                    c.buy_volume += qty
+                c.trades += 1
+                c.max_qty = max(c.max_qty, qty)
+                c.t_end_ms = max(c.t_end_ms, ts + 1)
+            if getattr(c, field) >= threshold:
+                out.append(self._finalize(symbol, label, c))
+        return out
+
+    def add_batch(self, symbol: str, ts: np.ndarray, price: np.ndarray, qty: np.ndarray,
+                  sell: Optional[np.ndarray] = None) -> list:
+        '''
+        Vectorized equivalent of add() for each trade in order (same bars, bit
+        for bit; closed bars come grouped by label). O(trades) in NumPy plus
+        O(bars closed) in Python.
+        '''
+        n = len(ts)
+        if n == 0:
+            return []
+        flow = _flow(price, qty, sell)
+        measure = {"trades": np.ones(n), "volume": qty, "quote_volume": flow[:, 1]}
+        out = []
+        for label, (field, threshold) in self.specs.items():
+            key = (symbol, label)
+            w = measure[field]
+            cum = np.cumsum(w)
+            i = 0
+            while i < n:
+                c = self.current.get(key)
+                j = _cut(w, cum, i, getattr(c, field) if c is not None else 0.0, threshold)
+                k = n if j is None else j + 1
+                run = (price[i:k], qty[i:k], flow[i:k])
+                last = int(ts[i:k].max()) + 1
+                if c is None:
+                    t0 = max(int(ts[i]), self.closed_until.get(key, int(ts[i])))
+                    c = self.current[key] = _run_candle(t0, max(t0 + 1, last), *run)
+                else:
+                    _fold(c, *run)
+                    c.t_end_ms = max(c.t_end_ms, last)
+                if j is not None:
+                    out.append(self._finalize(symbol, label, c))
+                i = k
+        return out
+
+    def seed(self, symbol: str, label: str, closed_until: Optional[int]) -> None:
+        # end of the last stored bar: the next one starts after it
+        if closed_until is not None:
+            self.closed_until[(symbol, label)] = closed_until
+
+    def restore(self, symbol: str, label: str, current: Optional[Candle], closed_until: Optional[int]) -> None:
+        if label not in self.specs:
+            return  # bar no longer configured
+        if current is not None:
+            self.current[(symbol, label)] = current
+        self.seed(symbol, label, closed_until)
+
+    def release(self, symbol: str) -> None:
+        for label in self.specs:
+            self.current.pop((symbol, label), None)
+            self.closed_until.pop((symbol, label), None)
+
+    def _finalize(self, symbol: str, label: str, c: Candle) -> tuple:
+        del self.current[(symbol, label)]
+        self.closed_until[(symbol, label)] = c.t_end_ms
+        return (symbol, label, c)
+
+def _cut(w: np.ndarray, cum: np.ndarray, i: int, done: float, threshold: float) -> Optional[int]:
+    '''
+    First j >= i where done + w[i] + ... + w[j], added left to right like
+    add() does, reaches threshold; None if the batch ends first. The cumsum
+    only guesses j; the exact sums are taken over that one bar.
+    '''
+    n = len(w)
+    base = cum[i - 1] if i else 0.0
+    k = int(np.searchsorted(cum, base + threshold - done)) + 2  # slack for rounding
+    while True:
+        k = min(k, n)
+        hit = np.flatnonzero(np.add.accumulate(np.concatenate(([done], w[i:k])))[1:] >= threshold)
+        if len(hit):
+            return i + int(hit[0])
+        if k == n:
+            return None
+        k += k - i
@@ -0,0 +1,302 @@
+'''
+Push API: live candle/indicator updates over WebSocket, plus a REST range endpoint.
+
+  python -m src.api
+
+The consumer appends every closed candle to UPDATES_STREAM (key is the
+symbol for base candles, symbol:tf for rollups and bars). This server tails that stream
+with a single XREAD loop, however many clients are connected, and fans each
+update out to the WebSocket subscribers whose filter matches. Forming candles
+(src/live.py) arrive as <key>:live, e.g. btcusdt:live or btcusdt:1m:live.
+
+  ws://host:8765/ws?keys=btcusdt,ethusdt:1m     (no keys or * = everything)
+      -> {"key": "btcusdt", "t_start_ms": ..., "close": ..., "rsi14": ..., ...} per update
+      <- {"subscribe": ["solusdt"]} / {"unsubscribe": ["btcusdt"]} to change the filter
+  GET /candles?symbol=btcusdt&tf=1m&start=<ms>&end=<ms>&limit=1000    (tf may also be a bar, e.g. t1000)
+      [&indicators=1]  adds the stored indicator values of each candle (null where none were stored)
+  GET /candles?symbol=btcusdt&start=<ms>&end=<ms>&max_points=800[&mode=ohlc|lttb]
+      (downsampled to at most max_points, resolution picked automatically; see src/downsample.py)
+  GET /health
+
+A new subscription first gets the last known update for each of its keys.
+Slow clients never hold up the rest: each one has a per-key mailbox that keeps
+only the newest undelivered frame (older ones are coalesced away), and a client
+whose socket can't take a frame within API_SEND_TIMEOUT_MS is disconnected.
+'''
+import json
+import asyncio
+import logging
+from collections import defaultdict
+from http import HTTPStatus
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+
+import websockets
+import redis.asyncio as aioredis
+
+from src import metrics
+from src.common import Config, setup_logging, now_ms, jdump, rollup_frames
+from src.storage import read_candle_range
+from src.downsample import RangeCache, MODES
+
+log = logging.getLogger("api")
+
+STATS_LOG_SEC = 60.0
+# updates replayed on startup so new subscribers get a snapshot right away
+WARM_UPDATES = 1000
+MAX_RANGE_CANDLES = 10_000
+
+def redis_client(cfg: Config) -> aioredis.Redis:
+    return aioredis.Redis(
+        host=cfg.redis_host,
+        port=cfg.redis_port,
+        password=cfg.redis_password or None,
+        decode_responses=True,
+    )
+
+class Subscriber:
+    '''
+    One WebSocket client. offer() never blocks: it files the frame under its
+    key, replacing an undelivered older frame for the same key. pump() sends
+    whatever is in the mailbox whenever it is woken.
+    '''
+    def __init__(self, ws, send_timeout_sec: float):
+        self.ws = ws
+        self.send_timeout_sec = send_timeout_sec
+        self.keys: set[str] = set()
+        self.everything = False
+        self.mailbox: dict[str, str] = {}
+        self.wake = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+
+    def offer(self, key: str, frame: str) -> None:
+        if key in self.mailbox:
+            self.coalesced += 1
+        self.mailbox[key] = frame
+        self.wake.set()
+
+    async def pump(self) -> None:
+        while True:
+            await self.wake.wait()
+            self.wake.clear()
+            batch, self.mailbox = self.mailbox, {}
+            for frame in batch.values():
+                # timeout() rather than wait_for(): no extra task per frame, and cancelling pump() always works
+                async with asyncio.timeout(self.send_timeout_sec):
+                    await self.ws.send(frame)
+                self.sent += 1
+
+class Hub:
+    '''
+    Fan-out index: key -> subscribers, plus subscribers that want everything.
+    dispatch() is O(matching subscribers) and also keeps the last frame per
+    key for snapshots.
+    '''
+    def __init__(self):
+        self.by_key: dict[str, set] = defaultdict(set)
+        self.everything: set = set()
+        self.subscribers: set = set()
+        self.last: dict[str, str] = {}
+        self.updates = 0
+
+    def subscribe(self, sub: Subscriber, keys: list[str]) -> None:
+        self.subscribers.add(sub)
+        for key in keys:
+            if key == "*":
+                sub.everything = True
+                self.everything.add(sub)
+                for k, frame in self.last.items():
+                    sub.offer(k, frame)
+            else:
+                sub.keys.add(key)
+                self.by_key[key].add(sub)
+                if key in self.last:
+                    sub.offer(key, self.last[key])
+
+    def unsubscribe(self, sub: Subscriber, keys: list[str]) -> None:
+        for key in keys:
+            if key == "*":
+                sub.everything = False
+                self.everything.discard(sub)
+                continue
+            sub.keys.discard(key)
+            subs = self.by_key.get(key)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.by_key[key]
+
+    def remove(self, sub: Subscriber) -> None:
+        self.unsubscribe(sub, [*sub.keys, "*"])
+        self.subscribers.discard(sub)
+
+    def dispatch(self, key: str, frame: str) -> None:
+        self.last[key] = frame
+        self.updates += 1
+        for sub in self.by_key.get(key, ()):
+            sub.offer(key, frame)
+        for sub in self.everything:
+            if key not in sub.keys:
+                sub.offer(key, frame)
+
+def _keys(values: list[str]) -> list[str]:
+    # "btcusdt,ethusdt:1m" (possibly repeated) -> ["btcusdt", "ethusdt:1m"]
+    return [k.strip().lower() for v in values for k in v.split(",") if k.strip()]
+
+def _message_keys(msg: dict, field: str) -> list[str]:
+    # {"subscribe": [...]}: anything but a list of strings is rejected (a bare
+    # string would otherwise be split into one-character keys)
+    values = msg.get(field, [])
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise TypeError(f"{field} must be a list of strings")
+    return _keys(values)
+
+def _json_response(status: HTTPStatus, body) -> tuple:
+    data = jdump(body).encode()
+    return status, [("Content-Type", "application/json"), ("Content-Length", str(len(data)))], data
+
+class ApiServer:
+    def __init__(self, cfg: Config, hub: Optional[Hub] = None):
+        self.cfg = cfg
+        self.hub = hub or Hub()
+        self.frames = rollup_frames(cfg)
+        self.ranges = RangeCache(live_ttl_ms=cfg.candle_sec * 1000)
+
+    async def follow_updates(self, r: aioredis.Redis) -> None:
+        # the one upstream reader: warm the snapshot cache, then tail the stream
+        stream = self.cfg.updates_stream
+        last_id = None
+        backoff = 1.0
+        while True:
+            try:
+                if last_id is None:
+                    recent = await r.xrevrange(stream, count=WARM_UPDATES)
+                    for msg_id, f in reversed(recent):
+                        self._dispatch(msg_id, f)
+                    last_id = recent[0][0] if recent else "0-0"
+                resp = await r.xread({stream: last_id}, count=1000, block=5000)
+                for _, msgs in resp or []:
+                    for msg_id, f in msgs:
+                        last_id = msg_id
+                        self._dispatch(msg_id, f)
+                backoff = 1.0
+            except aioredis.RedisError as e:
+                log.warning("Reading %s failed: %s | retry in %.1fs", stream, e, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2.0, 30.0)
+
+    def _dispatch(self, msg_id: str, fields: dict) -> None:
+        # one bad entry (no key/data, or a failing subscriber) is skipped, not allowed
+        # to end the follower and with it every client's updates
+        try:
+            self.hub.dispatch(fields["key"], fields["data"])
+        except Exception:
+            log.exception("Skipping update %s: %r", msg_id, fields)
+
+    async def handle_client(self, ws) -> None:
+        q = parse_qs(urlsplit(ws.path).query)
+        sub = Subscriber(ws, self.cfg.api_send_timeout_ms / 1000)
+        self.hub.subscribe(sub, _keys(q.get("keys", [])) or ["*"])
+        pump = asyncio.create_task(self._pump(sub))
+        try:
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                    add, drop = _message_keys(msg, "subscribe"), _message_keys(msg, "unsubscribe")
+                    self.hub.subscribe(sub, add)
+                    self.hub.unsubscribe(sub, drop)
+                except (ValueError, AttributeError, TypeError):
+                    await ws.send(jdump({"error": "expected {\"subscribe\": [...]} or {\"unsubscribe\": [...]}"}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.hub.remove(sub)
+            pump.cancel()
+
+    async def _pump(self, sub: Subscriber) -> None:
+        try:
+            await sub.pump()
+        except asyncio.TimeoutError:
+            log.info("Dropping slow client %s", sub.ws.remote_address)
+            await sub.ws.close(code=1013, reason="too slow")
+        except websockets.ConnectionClosed:
+            pass
+
+    async def process_request(self, path: str, headers) -> Optional[tuple]:
+        # plain HTTP requests are answered here; /ws continues to the WebSocket handshake
+        url = urlsplit(path)
+        if url.path == "/ws":
+            return None
+        if url.path == "/health":
+            return _json_response(HTTPStatus.OK, {
+                "subscribers": len(self.hub.subscribers),
+                "keys": len(self.hub.last),
+                "updates": self.hub.updates,
+            })
+        if url.path == "/candles":
+            return await self.candles(parse_qs(url.query))
+        return _json_response(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    async def candles(self, q: dict) -> tuple:
+        try:
+            symbol = q["symbol"][0].lower()
+            tf = q.get("tf", [None])[0] or None
+            end = int(q.get("end", [now_ms()])[0])
+            start = int(q.get("start", [0])[0])
+            limit = min(int(q.get("limit", [1000])[0]), MAX_RANGE_CANDLES)
+            max_points = min(int(q.get("max_points", [0])[0]), MAX_RANGE_CANDLES)
+            mode = q.get("mode", ["ohlc"])[0]
+            indicators = bool(int(q.get("indicators", [0])[0]))
+        except (KeyError, ValueError):
+            return _json_response(HTTPStatus.BAD_REQUEST, {"error": "usage: /candles?symbol=&tf=&start=&end=&limit=&max_points=&mode=&indicators="})
+        if tf is not None and tf not in self.frames and tf not in self.cfg.bars:
+            return _json_response(HTTPStatus.BAD_REQUEST, {"error": f"unknown timeframe {tf}"})
+        if mode not in MODES:
+            return _json_response(HTTPStatus.BAD_REQUEST, {"error": f"mode must be one of {', '.join(MODES)}"})
+        if max_points > 0 and tf is not None:
+            return _json_response(HTTPStatus.BAD_REQUEST, {"error": "max_points picks the timeframe itself, drop tf"})
+        if max_points > 0 and indicators:
+            return _json_response(HTTPStatus.BAD_REQUEST, {"error": "indicators are stored per candle, not per merged point: drop max_points"})
+
+        # SQLite is blocking: keep it off the event loop that feeds the sockets
+        if max_points > 0:
+            df = await asyncio.to_thread(
+                self.ranges.get, self.cfg.sqlite_path, symbol, start, end, max_points,
+                self.cfg.candle_sec * 1000, self.frames, mode,
+            )
+        else:
+            df = await asyncio.to_thread(read_candle_range, self.cfg.sqlite_path, symbol, start, end, tf, limit, indicators)
+            if indicators:
+                # NaN (warming up, none stored) is not JSON
+                df = df.astype(object).where(df.notna(), None)
+        return _json_response(HTTPStatus.OK, {"symbol": symbol, "tf": tf, "candles": df.to_dict("records")})
+
+    async def log_stats(self) -> None:
+        while True:
+            await asyncio.sleep(STATS_LOG_SEC)
+            subs = list(self.hub.subscribers)
+            log.info(
+                "subscribers=%d updates=%d sent=%d coalesced=%d",
+                len(subs), self.hub.updates, sum(s.sent for s in subs), sum(s.coalesced for s in subs),
+            )
+
+async def main() -> None:
+    cfg = Config()
+    setup_logging(cfg)
+    if not cfg.updates_stream:
+        raise SystemExit("UPDATES_STREAM is empty: the consumer publishes no updates to push")
+
+    api = ApiServer(cfg)
+    r = redis_client(cfg)
+    metrics.gauge("api_subscribers", "Connected WebSocket subscribers", fn=lambda: len(api.hub.subscribers))
+    metrics.REGISTRY.add_collector(lambda: metrics.family(
+        "api_updates_total", "counter", "Updates read from UPDATES_STREAM", [({}, api.hub.updates)]))
+    metrics.serve(cfg.metrics_port)
+    async with websockets.serve(api.handle_client, cfg.api_host, cfg.api_port,
+                                process_request=api.process_request, max_queue=16):
+        log.info("Serving on %s:%d", cfg.api_host, cfg.api_port)
+        await asyncio.gather(api.follow_updates(r), api.log_stats())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,267 @@
+'''
+Columnar archive tier for candle history, plus the compaction job.
+
+  python -m src.archive            # compact every ARCHIVE_INTERVAL_SEC
+  python -m src.archive --once [--vacuum]
+
+With RETENTION_DAYS > 0, whole UTC days older than the retention are moved
+out of SQLite into one file per (symbol, series, day) next to the database:
+
+  <SQLITE_PATH>.archive/manifest.json
+  <SQLITE_PATH>.archive/<symbol>/<series>/<YYYY-MM-DD>.npy
+
+series is "base" for the candles table, the timeframe ("1m", "1h", ...) for
+rollups, or the bar label ("t1000", ...) for bars. Each file is a plain structured NumPy array (ARCHIVE_DTYPE) sorted
+by t_start_ms, read memory-mapped; the manifest lists the days with their row
+counts and time bounds so readers only open files that overlap a query.
+
+Compaction writes the day file and the manifest (both atomically, via rename)
+before deleting the rows from SQLite, so a crash can duplicate a day across
+the tiers but never lose it; readers prefer the SQLite copy. Re-compacting a
+day (e.g. after a backfill) merges into the existing file.
+
+Stored indicator values (the indicators table) are archived with their
+candles: each day file carries the indicator columns (NaN where none were
+stored), and compaction moves the day's indicator rows along with it.
+
+Reads go through src.storage (read_candles, read_candle_range), which span
+both tiers transparently.
+'''
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import datetime as dt
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger("archive")
+
+DAY_MS = 86_400_000
+BASE_SERIES = "base"
+MANIFEST = "manifest.json"
+
+# the candle columns of src.storage (minus symbol), order flow included
+ARCHIVE_COLUMNS = ("t_start_ms", "t_end_ms", "open", "high", "low", "close", "volume",
+                   "quote_volume", "buy_volume", "sell_volume", "trades", "max_qty")
+# src.storage.INDICATOR_COLUMNS (that module imports this one, so it is repeated here)
+INDICATOR_COLUMNS = ("sma20", "ema20", "rsi14", "macd", "macd_signal", "macd_hist", "bb_lower", "bb_mid", "bb_upper")
+ARCHIVE_DTYPE = np.dtype([
+    ("t_start_ms", "<i8"), ("t_end_ms", "<i8"),
+    ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<f8"),
+    ("quote_volume", "<f8"), ("buy_volume", "<f8"), ("sell_volume", "<f8"), ("trades", "<i8"), ("max_qty", "<f8"),
+] + [(col, "<f8") for col in INDICATOR_COLUMNS])
+
+def archive_root(sqlite_path: str) -> str:
+    return sqlite_path + ".archive"
+
+def day_name(day_ms: int) -> str:
+    return dt.datetime.fromtimestamp(day_ms / 1000, dt.timezone.utc).strftime("%Y-%m-%d")
+
+def upgrade(arr: np.ndarray) -> np.ndarray:
+    # day files written before order flow or indicators were archived: copy into
+    # ARCHIVE_DTYPE, missing order-flow columns 0 and missing indicators NaN
+    if arr.dtype == ARCHIVE_DTYPE:
+        return arr
+    out = np.zeros(len(arr), ARCHIVE_DTYPE)
+    for col in INDICATOR_COLUMNS:
+        out[col] = np.nan
+    for name in arr.dtype.names:
+        out[name] = arr[name]
+    return out
+
+class Archive:
+    '''
+    One archive directory. The manifest is cached and re-read only when the
+    file changes, so a reader with nothing archived pays one stat() per query.
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self._manifest: dict = {"version": 1, "series": {}}
+        self._mtime: Optional[int] = None
+
+    def manifest(self) -> dict:
+        try:
+            mtime = os.stat(os.path.join(self.root, MANIFEST)).st_mtime_ns
+        except FileNotFoundError:
+            return self._manifest
+        if mtime != self._mtime:
+            with self.lock, open(os.path.join(self.root, MANIFEST)) as f:
+                self._manifest, self._mtime = json.load(f), mtime
+        return self._manifest
+
+    def days(self, symbol: str, series: str) -> dict:
+        return self.manifest()["series"].get(f"{symbol}/{series}", {})
+
+    def _load(self, meta: dict) -> np.ndarray:
+        return upgrade(np.load(os.path.join(self.root, meta["file"]), mmap_mode="r"))
+
+    def read(self, symbol: str, series: str, start_ms: int, end_ms: int) -> np.ndarray:
+        # rows with start_ms <= t_start_ms < end_ms, oldest first
+        parts = []
+        for _, meta in sorted(self.days(symbol, series).items()):
+            if meta["t_max"] < start_ms or meta["t_min"] >= end_ms:
+                continue
+            arr = self._load(meta)
+            t = arr["t_start_ms"]
+            parts.append(arr[np.searchsorted(t, start_ms):np.searchsorted(t, end_ms)])
+        return np.concatenate(parts) if parts else np.empty(0, ARCHIVE_DTYPE)
+
+    def tail(self, symbol: str, series: str, n: int, before_ms: int) -> np.ndarray:
+        # the last n rows with t_start_ms < before_ms, oldest first
+        parts, need = [], n
+        for _, meta in sorted(self.days(symbol, series).items(), reverse=True):
+            if need <= 0:
+                break
+            if meta["t_min"] >= before_ms:
+                continue
+            arr = self._load(meta)
+            arr = arr[:np.searchsorted(arr["t_start_ms"], before_ms)]
+            parts.append(arr[-need:])
+            need -= len(parts[-1])
+        return np.concatenate(parts[::-1]) if parts else np.empty(0, ARCHIVE_DTYPE)
+
+    def write_day(self, symbol: str, series: str, day_ms: int, rows: np.ndarray) -> int:
+        '''
+        Merge rows (ARCHIVE_DTYPE) into the day's file; on equal t_start_ms
+        the new row wins. Returns the number of rows in the file.
+        '''
+        rel = os.path.join(symbol, series, f"{day_name(day_ms)}.npy")
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            old = upgrade(np.load(path))
+            # a re-written candle (e.g. backfilled) with no indicator values keeps the archived ones
+            pos = np.minimum(np.searchsorted(old["t_start_ms"], rows["t_start_ms"]), len(old) - 1)
+            same = old["t_start_ms"][pos] == rows["t_start_ms"]
+            for col in INDICATOR_COLUMNS:
+                keep = same & np.isnan(rows[col])
+                rows[col][keep] = old[col][pos[keep]]
+            rows = np.concatenate([rows, old])
+        # np.unique keeps the first occurrence (the new rows) and sorts by t_start_ms
+        _, idx = np.unique(rows["t_start_ms"], return_index=True)
+        rows = rows[idx]
+
+        tmp = path[:-4] + ".tmp.npy"
+        np.save(tmp, rows)
+        os.replace(tmp, path)
+
+        manifest = self.manifest()
+        manifest["series"].setdefault(f"{symbol}/{series}", {})[day_name(day_ms)] = {
+            "file": rel,
+            "rows": int(len(rows)),
+            "t_min": int(rows["t_start_ms"][0]),
+            "t_max": int(rows["t_start_ms"][-1]),
+        }
+        self._save(manifest)
+        return len(rows)
+
+    def _save(self, manifest: dict) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+        self._manifest, self._mtime = manifest, os.stat(path).st_mtime_ns
+
+_archives: dict[str, Archive] = {}
+
+def get_archive(sqlite_path: str) -> Archive:
+    # one cached Archive per database, shared by every reader in the process
+    root = archive_root(sqlite_path)
+    arc = _archives.get(root)
+    if arc is None:
+        arc = _archives[root] = Archive(root)
+    return arc
+
+def to_frame(symbol: str, rows: np.ndarray) -> pd.DataFrame:
+    df = pd.DataFrame(rows)
+    df.insert(0, "symbol", symbol)
+    return df
+
+def compact(con, sqlite_path: str, retention_days: int, now_ms: int) -> dict:
+    '''
+    Move every whole day before (today - retention_days) from the candles,
+    candles_tf and bars tables into the archive, one (symbol, series, day) at a time,
+    together with the series' stored indicator values.
+    '''
+    arc = get_archive(sqlite_path)
+    cutoff = (now_ms // DAY_MS - retention_days) * DAY_MS
+    cols = ",".join(["c." + col for col in ARCHIVE_COLUMNS] + ["i." + col for col in INDICATOR_COLUMNS])
+    stats = {"days": 0, "rows": 0}
+
+    series = [(BASE_SERIES, "candles", "", ())]
+    for (tf,) in con.execute("SELECT DISTINCT tf FROM candles_tf").fetchall():
+        series.append((tf, "candles_tf", " AND tf=?", (tf,)))
+    for (bar,) in con.execute("SELECT DISTINCT bar FROM bars").fetchall():
+        series.append((bar, "bars", " AND bar=?", (bar,)))
+
+    for name, table, tf_cond, tf_params in series:
+        days = con.execute(
+            f"SELECT DISTINCT symbol, t_start_ms / {DAY_MS} FROM {table} WHERE t_start_ms < ?{tf_cond}",
+            (cutoff, *tf_params)
+        ).fetchall()
+        # the indicators table keys base candles with tf=''
+        ind_tf = "" if name == BASE_SERIES else name
+        for symbol, day in sorted(days):
+            lo, hi = day * DAY_MS, (day + 1) * DAY_MS
+            where = f"symbol=?{tf_cond} AND t_start_ms>=? AND t_start_ms<?"
+            params = (symbol, *tf_params, lo, hi)
+            rows = con.execute(
+                f"SELECT {cols} FROM {table} c LEFT JOIN indicators i"
+                f" ON i.symbol=c.symbol AND i.tf=? AND i.t_start_ms=c.t_start_ms"
+                f" WHERE c.symbol=?{tf_cond.replace(' AND ', ' AND c.')} AND c.t_start_ms>=? AND c.t_start_ms<?"
+                f" ORDER BY c.t_start_ms",
+                (ind_tf, *params)
+            ).fetchall()
+            if not rows:
+                continue
+            arc.write_day(symbol, name, lo, np.array(rows, dtype=ARCHIVE_DTYPE))
+            # only after the day file and manifest are in place; the indicator rows now live in the file too
+            with con:
+                con.execute(f"DELETE FROM {table} WHERE {where}", params)
+                con.execute(
+                    "DELETE FROM indicators WHERE symbol=? AND tf=? AND t_start_ms>=? AND t_start_ms<?",
+                    (symbol, ind_tf, lo, hi)
+                )
+            stats["days"] += 1
+            stats["rows"] += len(rows)
+    return stats
+
+def main() -> None:
+    # imported here, not at the top: src.storage imports this module
+    from src.common import Config, setup_logging, now_ms
+    from src.storage import connect, init_sqlite
+
+    cfg = Config()
+    ap = argparse.ArgumentParser(prog="python -m src.archive", description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--once", action="store_true", help="compact once and exit")
+    ap.add_argument("--retention-days", type=int, default=cfg.retention_days)
+    ap.add_argument("--vacuum", action="store_true", help="VACUUM afterwards to shrink the file (blocks writers while it runs)")
+    args = ap.parse_args()
+    setup_logging(cfg)
+    if args.retention_days <= 0:
+        raise SystemExit("RETENTION_DAYS must be > 0 to archive")
+
+    init_sqlite(cfg.sqlite_path)
+    while True:
+        con = connect(cfg.sqlite_path)
+        try:
+            t0 = time.perf_counter()
+            stats = compact(con, cfg.sqlite_path, args.retention_days, now_ms())
+            log.info("Archived %d days / %d rows in %.1fs", stats["days"], stats["rows"], time.perf_counter() - t0)
+            if args.vacuum and stats["rows"]:
+                con.execute("VACUUM")
+        finally:
+            con.close()
+        if args.once:
+            return
+        time.sleep(cfg.archive_interval_sec)
+
+if __name__ == "__main__":
+    main()
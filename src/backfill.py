@@ -0,0 +1,319 @@
+'''
+Bulk historical backfill / replay into the candles table.
+
+  python -m src.backfill --symbol btcusdt trades-2024-01-*.csv.gz
+  python -m src.backfill --symbol ethusdt --binance ETHUSDT-aggTrades-2024-01.csv
+  python -m src.backfill --symbol solusdt trades.parquet
+
+Files are streamed in chunks (never fully loaded), bucketed into OHLCV with
+the same floor_bucket() semantics as the live consumer, and written with
+INSERT OR REPLACE through a CandleWriter, so re-running over the same or
+overlapping input is idempotent. Pass files in time order; a bucket that
+spans two chunks/files is merged before it is written.
+
+Order flow (quote volume, trade count, max trade size) is bucketed in the
+same pass. Buy/sell volume needs the taker side: --binance takes it from
+is_buyer_maker, other files from --side-col ("buy"/"sell" or a buyer-is-maker
+boolean); without one both stay 0.
+
+After loading, indicators are computed over the stored history in one
+vectorized pass, stored per candle in the indicators table, and the last row
+is published to latest:{symbol}. The configured higher timeframes
+(TIMEFRAMES) are rebuilt from the stored base candles the same way and
+published to latest:{symbol}:{tf}.
+'''
+import os
+import gzip
+import time
+import logging
+import argparse
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import redis
+
+from src.common import Config, setup_logging, timeframe_ms
+from src.storage import init_sqlite, read_candle_range, CandleWriter, write_latest, CANDLE_COLUMNS, INDICATOR_COLUMNS
+from src.indicators import sma, ema, rsi, macd, bollinger
+
+log = logging.getLogger("backfill")
+
+DEFAULT_CHUNK_ROWS = 2_000_000
+
+# column layout of Binance's public aggTrades dumps (data.binance.vision), which have no header
+BINANCE_AGGTRADES_COLUMNS = [
+    "agg_trade_id", "price", "quantity", "first_trade_id", "last_trade_id",
+    "transact_time", "is_buyer_maker", "is_best_match",
+]
+
+# timestamp unit -> (multiply, divide) to get epoch ms
+TS_TO_MS = {"s": (1000, 1), "ms": (1, 1), "us": (1, 1000), "ns": (1, 1_000_000)}
+
+# candle columns written as integers
+INT_COLUMNS = {"t_start_ms", "t_end_ms", "trades"}
+
+def read_chunks(path: str, ts_col: str, price_col: str, qty_col: str,
+                chunk_rows: int = DEFAULT_CHUNK_ROWS, names: Optional[list] = None,
+                side_col: Optional[str] = None) -> Iterator[pd.DataFrame]:
+    '''
+    Yield DataFrames with columns ts, price, qty (and side, with side_col).
+    CSV (optionally .gz, via pandas' C parser) or Parquet (via pyarrow row batches).
+    '''
+    cols = [ts_col, price_col, qty_col] + ([side_col] if side_col else [])
+    rename = {ts_col: "ts", price_col: "price", qty_col: "qty", side_col: "side"}
+    base = path[:-3] if path.endswith(".gz") else path
+
+    if base.endswith(".parquet") or base.endswith(".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit("Parquet input needs pyarrow (pip install pyarrow)") from e
+        src = gzip.open(path, "rb") if path.endswith(".gz") else path
+        pf = pq.ParquetFile(src)
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=cols):
+            yield batch.to_pandas().rename(columns=rename)
+        return
+
+    reader = pd.read_csv(
+        path,
+        usecols=cols,
+        names=names,
+        header=None if names else "infer",
+        dtype={price_col: np.float64, qty_col: np.float64},
+        chunksize=chunk_rows,
+        engine="c",
+        compression="infer",
+    )
+    for chunk in reader:
+        yield chunk.rename(columns=rename)
+
+def sell_flags(side: pd.Series) -> np.ndarray:
+    # "sell"/"buy" strings, or a buyer-is-maker boolean (True: the taker sold)
+    if side.dtype == bool:
+        return side.to_numpy()
+    return side.astype(str).str.lower().isin(("sell", "true", "1")).to_numpy()
+
+def bucket_chunk(ts: np.ndarray, price: np.ndarray, qty: np.ndarray, bucket_ms: int,
+                 sell: Optional[np.ndarray] = None) -> pd.DataFrame:
+    '''
+    OHLCV and order flow per bucket for one chunk of trades, fully vectorized.
+    Trades are put in (stable) time order first, so open/close are the
+    first/last trade of each bucket. sell=None (side unknown) leaves buy and
+    sell volume at 0.
+    '''
+    if len(ts) and np.any(ts[1:] < ts[:-1]):
+        order = np.argsort(ts, kind="stable")
+        ts, price, qty = ts[order], price[order], qty[order]
+        if sell is not None:
+            sell = sell[order]
+
+    b = (ts // bucket_ms) * bucket_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(b)) + 1)) if len(b) else np.array([], dtype=np.int64)
+    ends = np.concatenate((starts[1:], [len(b)])) if len(b) else starts
+
+    def total(x: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(x, starts) if len(b) else x[:0]
+
+    if sell is None:
+        buy_q = sell_q = np.zeros_like(qty)
+    else:
+        buy_q, sell_q = np.where(sell, 0.0, qty), np.where(sell, qty, 0.0)
+
+    return pd.DataFrame({
+        "t_start_ms": b[starts],
+        "t_end_ms": b[starts] + bucket_ms,
+        "open": price[starts],
+        "high": np.maximum.reduceat(price, starts) if len(b) else price[:0],
+        "low": np.minimum.reduceat(price, starts) if len(b) else price[:0],
+        "close": price[ends - 1],
+        "volume": total(qty),
+        "quote_volume": total(price * qty),
+        "buy_volume": total(buy_q),
+        "sell_volume": total(sell_q),
+        "trades": ends - starts,
+        "max_qty": np.maximum.reduceat(qty, starts) if len(b) else qty[:0],
+    })
+
+def merge_candle(a: dict, b: dict) -> dict:
+    # the same bucket seen in two consecutive chunks
+    return {
+        "t_start_ms": a["t_start_ms"],
+        "t_end_ms": a["t_end_ms"],
+        "open": a["open"],
+        "high": max(a["high"], b["high"]),
+        "low": min(a["low"], b["low"]),
+        "close": b["close"],
+        "volume": a["volume"] + b["volume"],
+        "quote_volume": a["quote_volume"] + b["quote_volume"],
+        "buy_volume": a["buy_volume"] + b["buy_volume"],
+        "sell_volume": a["sell_volume"] + b["sell_volume"],
+        "trades": a["trades"] + b["trades"],
+        "max_qty": max(a["max_qty"], b["max_qty"]),
+    }
+
+def _params(symbol: str, df: pd.DataFrame) -> list[tuple]:
+    # rows in CANDLE_COLUMNS order for CandleWriter.add_many
+    return list(zip(
+        [symbol] * len(df),
+        *(df[c].astype(np.int64).tolist() if c in INT_COLUMNS else df[c].tolist() for c in CANDLE_COLUMNS[1:]),
+    ))
+
+def _indicator_params(symbol: str, tf: Optional[str], df: pd.DataFrame) -> list[tuple]:
+    # rows for the indicators table (NaN is stored as NULL)
+    return list(zip(
+        [symbol] * len(df), [tf or ""] * len(df), df["t_start_ms"].astype(np.int64).tolist(),
+        *(df[c].tolist() for c in INDICATOR_COLUMNS),
+    ))
+
+def backfill_files(paths: list[str], symbol: str, writer: CandleWriter, bucket_ms: int,
+                   ts_col: str = "ts_ms", price_col: str = "price", qty_col: str = "qty",
+                   ts_unit: str = "ms", names: Optional[list] = None,
+                   chunk_rows: int = DEFAULT_CHUNK_ROWS, side_col: Optional[str] = None) -> dict:
+    trades = candles = 0
+    carry: Optional[dict] = None  # last (possibly incomplete) bucket of the previous chunk
+    mul, div = TS_TO_MS[ts_unit]
+
+    for path in paths:
+        log.info("Reading %s", path)
+        for chunk in read_chunks(path, ts_col, price_col, qty_col, chunk_rows, names, side_col):
+            if chunk.empty:
+                continue
+            ts = chunk["ts"].to_numpy(dtype=np.int64) * mul // div
+            sell = sell_flags(chunk["side"]) if side_col else None
+            df = bucket_chunk(ts, chunk["price"].to_numpy(np.float64), chunk["qty"].to_numpy(np.float64), bucket_ms, sell)
+            trades += len(chunk)
+
+            if carry is not None:
+                if int(df["t_start_ms"].iat[0]) == int(carry["t_start_ms"]):
+                    carry = merge_candle(carry, df.iloc[0].to_dict())
+                    df = df.iloc[1:]
+                    if df.empty:
+                        continue  # the whole chunk was still the carried bucket
+                writer.add_many(_params(symbol, pd.DataFrame([carry])))
+                candles += 1
+
+            # hold the last bucket back, the next chunk may continue it
+            writer.add_many(_params(symbol, df.iloc[:-1]))
+            candles += len(df) - 1
+            carry = df.iloc[-1].to_dict()
+
+    if carry is not None:
+        writer.add_many(_params(symbol, pd.DataFrame([carry])))
+        candles += 1
+    writer.flush()
+    return {"trades": trades, "candles": candles}
+
+def indicator_history(path: str, symbol: str) -> pd.DataFrame:
+    # whole stored series for a symbol (both storage tiers) with every indicator, one vectorized pass
+    df = read_candle_range(path, symbol, 0, 2**62, limit=2**62)
+    if df.empty:
+        return df
+    return add_indicators(df)
+
+def add_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    close = df["close"]
+    df["sma20"] = sma(close, 20)
+    df["ema20"] = ema(close, 20)
+    df["rsi14"] = rsi(close, 14)
+    df["macd"], df["macd_signal"], df["macd_hist"] = macd(close)
+    df["bb_lower"], df["bb_mid"], df["bb_upper"] = bollinger(close, 20, 2.0)
+    return df
+
+def rollup_history(df: pd.DataFrame, tf_ms: int) -> pd.DataFrame:
+    '''
+    Higher-timeframe candles from a symbol's base candles (sorted by
+    t_start_ms). Only complete buckets are returned; the trailing one is left
+    to the live consumer, which rebuilds it from the base candles on startup.
+    '''
+    b = (df["t_start_ms"].to_numpy(np.int64) // tf_ms) * tf_ms
+    out = df.groupby(b, sort=True).agg(
+        open=("open", "first"), high=("high", "max"), low=("low", "min"),
+        close=("close", "last"), volume=("volume", "sum"),
+        quote_volume=("quote_volume", "sum"), buy_volume=("buy_volume", "sum"),
+        sell_volume=("sell_volume", "sum"), trades=("trades", "sum"), max_qty=("max_qty", "max"),
+    )
+    out.insert(0, "t_start_ms", out.index.to_numpy(np.int64))
+    out.insert(1, "t_end_ms", out["t_start_ms"] + tf_ms)
+    out = out[out["t_end_ms"] <= int(df["t_end_ms"].iat[-1])]
+    return out.reset_index(drop=True)
+
+def publish_latest(r: redis.Redis, symbol: str, df: pd.DataFrame, tf: Optional[str] = None) -> None:
+    last = df.iloc[-1].to_dict()
+    if last["volume"]:
+        last["vwap"] = last["quote_volume"] / last["volume"]
+    key = f"latest:{symbol}" if tf is None else f"latest:{symbol}:{tf}"
+    write_latest(r, key, {k: str(v) for k, v in last.items() if v == v})
+
+def main() -> None:
+    cfg = Config()
+    ap = argparse.ArgumentParser(prog="python -m src.backfill", description=__doc__.strip().splitlines()[0])
+    ap.add_argument("files", nargs="+", help="CSV / CSV.gz / Parquet trade files, in time order")
+    ap.add_argument("--symbol", required=True)
+    ap.add_argument("--sqlite-path", default=cfg.sqlite_path)
+    ap.add_argument("--candle-sec", type=int, default=cfg.candle_sec)
+    ap.add_argument("--ts-col", default="ts_ms")
+    ap.add_argument("--price-col", default="price")
+    ap.add_argument("--qty-col", default="qty")
+    ap.add_argument("--ts-unit", choices=sorted(TS_TO_MS), default="ms")
+    ap.add_argument("--side-col", default=None, help='taker side column: "buy"/"sell" or buyer-is-maker booleans')
+    ap.add_argument("--binance", action="store_true", help="headerless Binance aggTrades dump layout")
+    ap.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    ap.add_argument("--timeframes", default=",".join(cfg.timeframes), help="rollups to rebuild, e.g. 1m,1h (empty: none)")
+    ap.add_argument("--no-publish", action="store_true", help="don't update latest:{symbol} in Redis")
+    args = ap.parse_args()
+    setup_logging(cfg)
+
+    names = None
+    if args.binance:
+        names = BINANCE_AGGTRADES_COLUMNS
+        args.ts_col, args.price_col, args.qty_col = "transact_time", "price", "quantity"
+        args.side_col = "is_buyer_maker"
+
+    symbol = args.symbol.lower()
+    os.makedirs(os.path.dirname(os.path.abspath(args.sqlite_path)), exist_ok=True)
+    init_sqlite(args.sqlite_path)
+
+    t0 = time.perf_counter()
+    with CandleWriter(args.sqlite_path, batch_size=100_000, flush_ms=60_000) as writer:
+        stats = backfill_files(
+            args.files, symbol, writer, args.candle_sec * 1000,
+            ts_col=args.ts_col, price_col=args.price_col, qty_col=args.qty_col,
+            ts_unit=args.ts_unit, names=names, chunk_rows=args.chunk_rows, side_col=args.side_col,
+        )
+    dt = time.perf_counter() - t0
+    log.info("Loaded %d trades -> %d candles in %.1fs (%.0f trades/s)", stats["trades"], stats["candles"], dt, stats["trades"] / dt if dt else 0)
+
+    t0 = time.perf_counter()
+    df = indicator_history(args.sqlite_path, symbol)
+    log.info("Indicators over %d candles in %.2fs", len(df), time.perf_counter() - t0)
+
+    frames = {}
+    if not df.empty:
+        bucket_ms = args.candle_sec * 1000
+        with CandleWriter(args.sqlite_path, batch_size=100_000, flush_ms=60_000) as writer:
+            writer.add_indicators_many(_indicator_params(symbol, None, df))
+            for tf in (s.strip().lower() for s in args.timeframes.split(",") if s.strip()):
+                tf_ms = timeframe_ms(tf)
+                if tf_ms <= bucket_ms or tf_ms % bucket_ms:
+                    log.warning("Skipping timeframe %s: not a multiple of the %ds candle", tf, args.candle_sec)
+                    continue
+                roll = rollup_history(df, tf_ms)
+                for row in roll.assign(symbol=symbol).to_dict("records"):
+                    writer.add_rollup(tf, row)
+                if not roll.empty:
+                    frames[tf] = add_indicators(roll.assign(symbol=symbol))
+                    writer.add_indicators_many(_indicator_params(symbol, tf, frames[tf]))
+        log.info("Rebuilt rollups: %s", ", ".join(f"{tf}={len(v)}" for tf, v in frames.items()) or "none")
+
+    if not df.empty and not args.no_publish:
+        r = redis.Redis(host=cfg.redis_host, port=cfg.redis_port, password=cfg.redis_password or None, decode_responses=True)
+        try:
+            publish_latest(r, symbol, df)
+            for tf, roll in frames.items():
+                publish_latest(r, symbol, roll, tf)
+        except redis.RedisError as e:
+            log.warning("Could not publish latest:%s: %s", symbol, e)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+'''
+Consumer checkpoints in Redis, one hash per symbol:
+
+  checkpoint:<group>:<symbol>
+    candle        open base candle (JSON), "" between candles
+    closed_until  end of the last finalized base candle
+    last_close    its close (for forward fill)
+    rollups       {tf: {"current": candle or null, "closed_until": ms or null}}
+    bars          {bar: {"current": ..., "closed_until": ...}} (BARS)
+    last_id       last acked entry of the symbol's stream (ACK_MODE=batch)
+    engine:<key>  indicator state for <key> (symbol, symbol:tf or symbol:bar)
+
+With ACK_MODE=batch the read loop writes the hash in the same MULTI/EXEC as
+the XACK of the entries it covers, after the closed candles (and their
+indicator values) are committed to SQLite. The checkpoint therefore describes exactly
+the acked trades: whatever is still pending is replayed on top of it after a
+crash, and nothing acked is replayed. Candles closed by the timers between
+batches are checkpointed every CHECKPOINT_MS; if we crash before that, they
+are closed again after the restore (same rows, and engines skip candles they
+have already seen).
+
+With ACK_MODE=message every entry is acked as soon as it is aggregated, so no
+checkpoint is tied to an ack and none carries last_id: checkpoints are only
+the CHECKPOINT_MS (and handoff/shutdown) ones, and a restore replays every
+entry still pending on top of them. Entries acked after the last checkpoint
+are not replayed, so a crash can lose their trades.
+
+Engines are updated on the indicator pool's threads, not on the read loop.
+Every checkpoint is written after a writer flush, and the flush first waits
+on pool.wait_values() for the values of every candle queued so far, so the
+engines are quiescent and have seen exactly the closed candles the rest of the
+checkpoint describes. An engine field is only rewritten when its engine was
+fed since the last checkpoint, and carries the end of the last candle fed
+(until_ms). An engine that still fell behind the candles on disk is caught up
+from SQLite on restore; otherwise a restart costs one pipelined HGETALL for
+all symbols and no SQLite reads.
+
+The hash is per symbol, not per worker, so with SHARDING the next owner of a
+symbol restores from it too.
+'''
+import json
+import logging
+from dataclasses import asdict
+from typing import Optional
+
+import redis
+
+from src.common import Config, jdump, is_bar
+from src.aggregator import Candle, CandleAggregator, RollupAggregator, BarAggregator
+from src.indicators import IndicatorEngine
+from src.storage import read_hashes, read_candle_range
+
+log = logging.getLogger("checkpoint")
+
+ENGINE_PREFIX = "engine:"
+
+def checkpoint_key(cfg: Config, symbol: str) -> str:
+    return f"checkpoint:{cfg.consumer_group}:{symbol}"
+
+def _candle(c: Optional[Candle]) -> Optional[dict]:
+    return asdict(c) if c is not None else None
+
+def _open_series(agg, symbol: str, labels) -> str:
+    # open candle and watermark per label of a RollupAggregator or BarAggregator
+    return jdump({
+        label: {"current": _candle(agg.current.get((symbol, label))),
+                "closed_until": agg.closed_until.get((symbol, label))}
+        for label in labels
+    })
+
+def symbol_fields(agg: CandleAggregator, rollups: Optional[RollupAggregator], symbol: str,
+                  last_id: Optional[str] = None, engines: Optional[dict] = None,
+                  bars: Optional[BarAggregator] = None) -> dict[str, str]:
+    c = agg.current.get(symbol)
+    fields = {
+        "candle": jdump(asdict(c)) if c is not None else "",
+        "closed_until": str(agg.closed_until.get(symbol, "")),
+        "last_close": str(agg.last_close.get(symbol, "")),
+    }
+    labels = []
+    if rollups is not None:
+        fields["rollups"] = _open_series(rollups, symbol, rollups.frames)
+        labels += rollups.frames
+    if bars is not None:
+        fields["bars"] = _open_series(bars, symbol, bars.specs)
+        labels += bars.specs
+    if last_id is not None:
+        fields["last_id"] = last_id
+    if engines:
+        for key in [symbol, *(f"{symbol}:{label}" for label in labels)]:
+            eng = engines.get(key)
+            if eng is not None and eng.until_ms != eng.checkpointed_ms:
+                fields.update(engine_fields(key, eng))
+                eng.checkpointed_ms = eng.until_ms
+    return fields
+
+def engine_fields(key: str, eng: IndicatorEngine) -> dict[str, str]:
+    return {ENGINE_PREFIX + key: jdump(eng.to_dict())}
+
+def write_checkpoints(pipe, cfg: Config, agg: CandleAggregator, rollups: Optional[RollupAggregator],
+                      symbols, last_ids: Optional[dict] = None, engines: Optional[dict] = None,
+                      bars: Optional[BarAggregator] = None) -> None:
+    # queue one HSET per symbol on `pipe` (a MULTI pipeline, usually with the XACKs)
+    last_ids = last_ids or {}
+    for symbol in symbols:
+        fields = symbol_fields(agg, rollups, symbol, last_ids.get(symbol), engines, bars)
+        pipe.hset(checkpoint_key(cfg, symbol), mapping=fields)
+
+def load_checkpoints(r: redis.Redis, cfg: Config, symbols) -> dict[str, dict]:
+    # symbol -> checkpoint fields, for the symbols that have one (one round trip)
+    symbols = list(symbols)
+    return {s: h for s, h in zip(symbols, read_hashes(r, [checkpoint_key(cfg, s) for s in symbols])) if h}
+
+def restore_symbol(agg: CandleAggregator, rollups: Optional[RollupAggregator], engines: dict,
+                   symbol: str, fields: dict, candle: bool = True, bars: Optional[BarAggregator] = None) -> bool:
+    '''
+    Load one symbol's checkpoint into the aggregators and engines. With
+    candle=False the open candle is left alone (a shard handoff passed the
+    live one). Returns False if the rollups could not be restored (no rollup
+    state saved, or timeframes changed) and must be seeded from SQLite. Bars
+    that were not checkpointed are left empty (see seed_bars in the consumer).
+    '''
+    c = fields.get("candle")
+    closed_until, last_close = fields.get("closed_until"), fields.get("last_close")
+    agg.restore(
+        symbol,
+        Candle(**json.loads(c)) if c and candle else None,
+        int(closed_until) if closed_until else None,
+        float(last_close) if last_close else None,
+    )
+    for field, value in fields.items():
+        if field.startswith(ENGINE_PREFIX):
+            eng = engines[field[len(ENGINE_PREFIX):]] = IndicatorEngine.from_dict(json.loads(value))
+            eng.checkpointed_ms = eng.until_ms
+    if bars is not None:
+        for label, state in json.loads(fields.get("bars") or "{}").items():
+            cur = state["current"]
+            bars.restore(symbol, label, Candle(**cur) if cur else None, state["closed_until"])
+
+    if rollups is None:
+        return True
+    saved = json.loads(fields.get("rollups") or "{}")
+    if set(saved) != set(rollups.frames):
+        return False
+    for tf, state in saved.items():
+        cur = state["current"]
+        rollups.restore(symbol, tf, Candle(**cur) if cur else None, state["closed_until"])
+    return True
+
+def catch_up_engines(cfg: Config, engines: dict, agg: CandleAggregator, rollups: Optional[RollupAggregator],
+                     symbol: str, bars: Optional[BarAggregator] = None) -> int:
+    '''
+    Feed restored engines the candles they missed (stored, but the indicator
+    job never ran before the crash). Only engines that are behind touch
+    SQLite. Returns the number of candles fed.
+    '''
+    fed = 0
+    for key, eng in list(engines.items()):
+        sym, _, tf = key.partition(":")
+        if sym != symbol or eng.until_ms is None:
+            continue
+        if tf:
+            series = bars if is_bar(tf) else rollups
+            target = series.closed_until.get((symbol, tf)) if series is not None else None
+        else:
+            target = agg.closed_until.get(symbol)
+        if target is None or eng.until_ms >= target:
+            continue
+        df = read_candle_range(cfg.sqlite_path, symbol, eng.until_ms, target, tf or None, limit=2**62)
+        if not df.empty:
+            eng.warm(df["close"].tolist())
+            eng.until_ms = int(df["t_end_ms"].iat[-1])
+            fed += len(df)
+    return fed
+
+def stream_id(entry_id: str) -> tuple[int, int]:
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
@@ -11,6 +11,9 @@ def _env(key: str, default: str = "") -> str:
     v = os.getenv(key)
     return default if v is None or v == "" else v
 
+def _env_bool(key: str, default: str = "false") -> bool:
+    return _env(key, default).lower() in ("1", "true", "yes", "on")
+
 @dataclass(frozen=True)
 class Config:
     redis_host: str = _env("REDIS_HOST", "localhost")
@@ -19,16 +22,96 @@ class Config:
 
     symbols: tuple[str, ...] = tuple(s.strip().lower() for s in _env("SYMBOLS", "btcusdt").split(",") if s.strip())
     candle_sec: int = int(_env("CANDLE_SEC", "5"))
+    # a candle is finalized once wall clock passes t_end_ms + grace (late trades after that are dropped)
+    finalize_grace_ms: int = int(_env("FINALIZE_GRACE_MS", "1000"))
+    # how often the finalize timers are checked (upper bound on extra close latency)
+    finalize_interval_ms: int = int(_env("FINALIZE_INTERVAL_MS", "250"))
+    # emit forward-filled (volume 0) candles for buckets without trades
+    gap_fill: bool = _env_bool("GAP_FILL", "true")
+    # higher timeframes rolled up from the base candles (multiples of CANDLE_SEC; 1d = UTC days)
+    timeframes: tuple[str, ...] = tuple(s.strip().lower() for s in _env("TIMEFRAMES", "1m,5m,15m,1h,1d").split(",") if s.strip())
+    # information-driven bars built from the trades (see bar_specs): t<N> every N trades,
+    # v<V> every V of base volume, d<D> every D of quote notional, e.g. "t1000,d1000000" (empty = none)
+    bars: tuple[str, ...] = tuple(s.strip().lower() for s in _env("BARS", "").split(",") if s.strip())
 
     sqlite_path: str = _env("SQLITE_PATH", "./data/crypto.db")
+    # group commit: flush buffered candles at this many rows or after this many ms
+    sqlite_batch_size: int = int(_env("SQLITE_BATCH_SIZE", "500"))
+    sqlite_flush_ms: int = int(_env("SQLITE_FLUSH_MS", "1000"))
+
+    # tiered storage: whole days older than this move to the columnar archive (0 = keep all in SQLite)
+    retention_days: int = int(_env("RETENTION_DAYS", "0"))
+    archive_interval_sec: int = int(_env("ARCHIVE_INTERVAL_SEC", "3600"))
 
     stream_prefix: str = _env("STREAM_PREFIX", "trades:")
     consumer_group: str = _env("CONSUMER_GROUP", "cg_analytics")
     consumer_name: str = _env("CONSUMER_NAME", "worker-1")
 
+    # XREADGROUP batch size / block timeout
+    read_count: int = int(_env("READ_COUNT", "100"))
+    read_block_ms: int = int(_env("READ_BLOCK_MS", "2000"))
+    # "batch": one pipelined multi-id XACK per stream per batch, after candles are committed
+    # "message": XACK each message as it is processed
+    ack_mode: str = _env("ACK_MODE", "batch").lower()
+    # streams with at least this many messages in one read are aggregated with NumPy (0 = never)
+    batch_agg_min: int = int(_env("BATCH_AGG_MIN", "64"))
+    # checkpoint open candles, rollups and indicator state to Redis (with the XACKs) for fast, exact restarts
+    checkpoint: bool = _env_bool("CHECKPOINT", "true")
+    # how often candles closed by the timers (between batches) are checkpointed
+    checkpoint_ms: int = int(_env("CHECKPOINT_MS", "1000"))
+    # threads computing/publishing indicators off the read loop (0 = inline, in the read loop)
+    indicator_workers: int = int(_env("INDICATOR_WORKERS", "2"))
+    # publish the forming candle and last trade per symbol at most this often (0 = off)
+    live_interval_ms: int = int(_env("LIVE_INTERVAL_MS", "250"))
+
+    # run several workers in one group: symbols are sharded over live workers
+    sharding: bool = _env_bool("SHARDING")
+    shard_heartbeat_ms: int = int(_env("SHARD_HEARTBEAT_MS", "2000"))
+    # a worker (and its symbol leases) is considered dead after this long without a heartbeat
+    shard_ttl_ms: int = int(_env("SHARD_TTL_MS", "10000"))
+
     stream_maxlen: int = int(_env("STREAM_MAXLEN", "20000"))
     dlq_stream: str = _env("DLQ_STREAM", "trades:DLQ")
 
+    # every latest:* update is also appended here for push subscribers (src/api.py); empty = off
+    updates_stream: str = _env("UPDATES_STREAM", "analytics:updates")
+    updates_maxlen: int = int(_env("UPDATES_MAXLEN", "10000"))
+
+    # push API server (python -m src.api)
+    api_host: str = _env("API_HOST", "0.0.0.0")
+    api_port: int = int(_env("API_PORT", "8765"))
+    # a subscriber whose socket can't take a frame for this long is disconnected
+    api_send_timeout_ms: int = int(_env("API_SEND_TIMEOUT_MS", "5000"))
+
+    # exchange websocket endpoint; point it at `python -m src.simulator` for load/soak tests
+    ws_base_url: str = _env("WS_BASE_URL", "wss://stream.binance.com:9443").rstrip("/")
+    # multiplex symbols over Binance combined-stream sockets (WS_CONNECTIONS of them)
+    ws_combined: bool = _env_bool("WS_COMBINED")
+    ws_connections: int = int(_env("WS_CONNECTIONS", "1"))
+    # pass exchange price/qty strings through instead of float -> 10dp reformat
+    ws_fast_normalize: bool = _env_bool("WS_FAST_NORMALIZE")
+
+    # "text": one string field per value (legacy); "packed": one binary field per trade (src/wire.py).
+    # The consumer reads both, so switch producers over one at a time.
+    wire_format: str = _env("WIRE_FORMAT", "text").lower()
+
+    # producer -> Redis publishing: bounded queue drained into pipelined XADD batches
+    producer_queue_size: int = int(_env("PRODUCER_QUEUE_SIZE", "10000"))
+    producer_batch_size: int = int(_env("PRODUCER_BATCH_SIZE", "500"))
+    producer_linger_ms: int = int(_env("PRODUCER_LINGER_MS", "5"))
+    # what to do when the queue is full: "block" the websocket reader, or "drop" the event
+    producer_queue_policy: str = _env("PRODUCER_QUEUE_POLICY", "block").lower()
+    # tries per event when Redis is unreachable (with backoff up to 5s: ~2 minutes) before it is dropped
+    producer_xadd_attempts: int = int(_env("PRODUCER_XADD_ATTEMPTS", "30"))
+
+    # cross-symbol screener (python -m src.screener): candles kept per symbol, and the timeframe
+    # screened (empty = base candles, else one of TIMEFRAMES)
+    screener_window: int = int(_env("SCREENER_WINDOW", "300"))
+    screener_tf: str = _env("SCREENER_TF", "").lower()
+
+    # Prometheus-format GET /metrics on this port in every process (0 = off)
+    metrics_port: int = int(_env("METRICS_PORT", "9100"))
+
     log_level: str = _env("LOG_LEVEL", "INFO")
 
 def setup_logging(cfg: Config) -> None:
@@ -38,6 +121,46 @@ def setup_logging(cfg: Config) -> None:
         format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
     )
 
+TIMEFRAME_UNITS_MS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+
+def timeframe_ms(tf: str) -> int:
+    # "15m" -> 900000
+    n, unit = tf[:-1], tf[-1:]
+    if unit not in TIMEFRAME_UNITS_MS or not n.isdigit() or int(n) <= 0:
+        raise ValueError(f"bad timeframe {tf!r} (expected e.g. 30s, 1m, 4h, 1d)")
+    return int(n) * TIMEFRAME_UNITS_MS[unit]
+
+def rollup_frames(cfg: Config) -> dict[str, int]:
+    # configured timeframes usable as rollups of the base candle (multiples of it), label -> ms
+    bucket_ms = cfg.candle_sec * 1000
+    frames = {}
+    for tf in cfg.timeframes:
+        ms = timeframe_ms(tf)
+        if ms > bucket_ms and ms % bucket_ms == 0:
+            frames[tf] = ms
+    return frames
+
+# bar label prefix -> the Candle field it counts up to the threshold
+BAR_KINDS = {"t": "trades", "v": "volume", "d": "quote_volume"}
+
+def is_bar(label) -> bool:
+    # bar labels start with their kind ("t1000"), timeframes with a number ("1m")
+    return bool(label) and label[0] in BAR_KINDS and not label[1:2].isalpha()
+
+def bar_spec(label: str) -> tuple[str, float]:
+    # "d1000000" -> ("quote_volume", 1000000.0)
+    try:
+        threshold = float(label[1:])
+    except ValueError:
+        threshold = 0.0
+    if not is_bar(label) or not threshold > 0:
+        raise ValueError(f"bad bar {label!r} (expected e.g. t1000, v50, d1000000)")
+    return BAR_KINDS[label[0]], threshold
+
+def bar_specs(cfg: Config) -> dict[str, tuple[str, float]]:
+    # configured bars, label -> (Candle field, threshold)
+    return {label: bar_spec(label) for label in cfg.bars}
+
 def now_ms() -> int:
     return int(time.time() * 1000)
 
@@ -1,26 +1,47 @@
 import time
+import signal
 import logging
+import threading
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import asdict
+from itertools import repeat
+from operator import eq, itemgetter
+from typing import Optional
 
 import redis
-import pandas as pd
+import numpy as np
 
-from src.common import Config, setup_logging
-from src.storage import init_sqlite, insert_candle, write_latest
-from src.indicators import rsi, macd, bollinger, sma, ema
+from src import metrics
+from src.common import Config, setup_logging, now_ms, rollup_frames, bar_specs
+from src.aggregator import Candle, CandleAggregator, RollupAggregator, BarAggregator, floor_bucket
+from src.storage import init_sqlite, CandleWriter, read_candles, read_candles_since, last_rollup_end, write_latest, publish_update
+from src.indicators import IndicatorEngine
+from src.sharding import ShardCoordinator
+from src.wire import PACKED_FIELD, FLAG_SELL, unpack_trades, decode_trade
+from src.pool import CoalescingPool
+from src.live import LivePublisher
+from src.checkpoint import (
+    write_checkpoints, load_checkpoints, restore_symbol, catch_up_engines, stream_id,
+)
 
 log = logging.getLogger("consumer")
 
-@dataclass
-class Candle:
-    t_start_ms: int
-    t_end_ms: int
-    open: float
-    high: float
-    low: float
-    close: float
-    volume: float
+# Candles replayed into a fresh indicator engine on startup (was the recompute window)
+WARMUP_CANDLES = 300
+# Don't publish indicators until this many candles have been seen
+MIN_CANDLES = 30
+
+STATS_LOG_SEC = 60.0
+
+READ_BATCH = metrics.histogram("consumer_read_batch_size", "Entries per XREADGROUP", metrics.SIZE_BUCKETS)
+READ_LAG = metrics.histogram("consumer_read_lag_seconds", "XADD to consumer read, oldest entry of each stream in a read")
+BATCH_SECONDS = metrics.histogram("consumer_batch_seconds", "Processing one read: aggregate, commit, ack")
+CLOSE_TO_PUBLISH = metrics.histogram("consumer_close_to_publish_seconds", "Candle close to latest:* publish")
+INDICATOR_SECONDS = metrics.histogram("indicator_compute_seconds", "One indicator job: engine update(s) and publish")
+CONSUMED = metrics.counter("consumer_entries_total", "Stream entries processed")
+DEAD_LETTERED = metrics.counter("consumer_dlq_total", "Entries sent to the dead-letter stream")
+CLOSED = metrics.counter("consumer_candles_closed_total", "Base candles finalized")
+BARS_CLOSED = metrics.counter("consumer_bars_closed_total", "Tick, volume and dollar bars finalized")
 
 def redis_client(cfg: Config) -> redis.Redis:
     return redis.Redis(
@@ -28,6 +49,8 @@ def redis_client(cfg: Config) -> redis.Redis:
         port=cfg.redis_port,
         password=cfg.redis_password or None,
         decode_responses=True,
+        # latin-1 maps every byte to one character, so packed trades (src/wire.py) survive decoding
+        encoding="latin-1",
     )
 
 def stream_key(cfg: Config, symbol: str) -> str:
@@ -45,49 +68,425 @@ def ensure_group(r: redis.Redis, stream: str, group: str) -> None:
             return
         raise
 
-def floor_bucket(ts_ms: int, bucket_ms: int) -> int:
+def load_engine(cfg: Config, symbol: str, before_ms: int, tf: Optional[str] = None) -> IndicatorEngine:
     '''
-    consumer takes trades and buckets them into fixed time windows.
-    This function computes bucket for trades.
+    Rebuild indicator state for a symbol (and timeframe) from stored history
+    (candles strictly before `before_ms`). Only needed the first time a symbol
+    closes a candle after startup; after that the engine is updated incrementally.
     '''
-    return (ts_ms // bucket_ms) * bucket_ms
+    eng = IndicatorEngine()
+    df = read_candles(cfg.sqlite_path, symbol, limit=WARMUP_CANDLES, tf=tf)
+    if not df.empty:
+        eng.warm(df.loc[df["t_start_ms"] < before_ms, "close"].tolist())
+    return eng
 
-def compute_and_cache(cfg: Config, r: redis.Redis, symbol: str) -> None:
-    # Read recent candles from SQLite for indicator computation 
-    import sqlite3
-    con = sqlite3.connect(cfg.sqlite_path)
-    try:
-        df = pd.read_sql_query(
-            "SELECT * FROM candles WHERE symbol=? ORDER BY t_start_ms DESC LIMIT 300",
-            con, params=(symbol,)
-        )
-    finally:
-        con.close()
+def indicator_key(symbol: str, tf: Optional[str] = None) -> str:
+    # base candles are keyed by symbol, rollups by symbol:tf (engines and latest:*)
+    return symbol if tf is None else f"{symbol}:{tf}"
+
+def update_engine(cfg: Config, engines: dict, row: dict, tf: Optional[str] = None) -> Optional[dict]:
+    '''
+    Feed one closed candle into its indicator engine (O(1); rebuilt from
+    stored history the first time a symbol closes a candle) and return the
+    values for it. None if the engine has already seen the candle (closed
+    again after restoring an older checkpoint).
+    '''
+    key = indicator_key(row["symbol"], tf)
+    eng = engines.get(key)
+    if eng is None:
+        eng = engines[key] = load_engine(cfg, row["symbol"], row["t_start_ms"], tf)
+    if eng.until_ms is not None and row["t_start_ms"] < eng.until_ms:
+        return None
+    values = eng.update(row["close"])
+    eng.until_ms = row["t_end_ms"]
+    return values
+
+def update_values(cfg: Config, engines: dict, items: list, tf: Optional[str] = None) -> tuple[list, bool]:
+    '''
+    Feed one symbol and timeframe's closed candles (oldest first, each paired
+    with the dict its indicator values go into; the writer commits those with
+    the candles) into the engine. Returns (rows to publish, warm): every fed
+    candle, with its values once the engine is warm, and whether it was warm
+    for the newest. More than one item means the pool coalesced candles that
+    closed while the key's previous job was running.
+    '''
+    fed, eng = [], None
+    for row, values in items:
+        v = update_engine(cfg, engines, row, tf)
+        if v is not None:
+            values.update(v)
+            if eng is None:
+                eng = engines[indicator_key(row["symbol"], tf)]
+            fed.append({**row, **v} if eng.count >= MIN_CANDLES else row)
+    return fed, eng is not None and eng.count >= MIN_CANDLES
+
+def compute_and_cache(cfg: Config, r: redis.Redis, engines: dict, row: dict, tf: Optional[str] = None) -> Optional[dict]:
+    # update + publish in one go, on the calling thread (tools, benchmarks)
+    values = {}
+    fed, warm = update_values(cfg, engines, [(row, values)], tf)
+    if fed:
+        publish_rows(cfg, r, fed, tf, warm)
+    return values or None
+
+def publish_rows(cfg: Config, r: redis.Redis, rows: list, tf: Optional[str] = None, warm: bool = True) -> None:
+    '''
+    Publish one symbol and timeframe's closed candles in one round trip:
+    every one to the push updates (the screener needs each close and volume,
+    warm or not), and the newest, with its indicator values, to latest:{key}
+    once the engine is warm.
+    '''
+    key = indicator_key(rows[-1]["symbol"], tf)
+    published_ms = now_ms()
+    pipe = r.pipeline(transaction=False)
+    for row in rows if cfg.updates_stream else ():
+        update = {k: v for k, v in {**row, "published_ms": published_ms}.items() if v == v}  # v==v skips NaN
+        publish_update(pipe, cfg.updates_stream, key, update, cfg.updates_maxlen)
+    if warm:
+        last = {k: v for k, v in {**rows[-1], "published_ms": published_ms}.items() if v == v}
+        write_latest(pipe, f"latest:{key}", {k: str(v) for k, v in last.items()})
+    pipe.execute()
+
+class IndicatorPool(CoalescingPool):
+    '''
+    INDICATOR_WORKERS threads updating the engines and publishing, coalesced
+    per symbol(:tf); items are (row, values, tf, monotonic close time). The
+    cold-start history read (load_engine) happens here too, so the read loop
+    never waits on it. wait_values() returns once every submitted candle's
+    values dict is filled in (the writer's `wait`); the publishes that follow
+    don't hold it up.
+    '''
+    def __init__(self, cfg: Config, r: redis.Redis, engines: dict):
+        self.cfg, self.r, self.engines = cfg, r, engines
+        self.unfilled = 0
+        super().__init__(self._job, cfg.indicator_workers, name="indicators")
+
+    def submit(self, key, item) -> None:
+        super().submit(key, item)
+        with self.cond:
+            # after the submit: a closed pool raises and nothing is left to fill
+            self.unfilled += 1
+
+    def _job(self, key: str, items: list) -> None:
+        tf = items[0][2]
+        with INDICATOR_SECONDS.time():
+            try:
+                fed, warm = update_values(self.cfg, self.engines, [(row, values) for row, values, _, _ in items], tf)
+            finally:
+                self._filled(len(items))
+            if fed:
+                publish_rows(self.cfg, self.r, fed, tf, warm)
+        if fed:
+            CLOSE_TO_PUBLISH.observe(time.monotonic() - items[-1][3])
+
+    def _filled(self, n: int) -> None:
+        with self.cond:
+            self.unfilled -= n
+            self.cond.notify_all()
+
+    def discard(self, match) -> int:
+        dropped = super().discard(match)
+        self._filled(dropped)
+        return dropped
+
+    def wait_values(self, timeout: float = None) -> bool:
+        # <= 0: inline (workers=0) and fast jobs finish before submit() counts them
+        with self.cond:
+            return self.cond.wait_for(lambda: self.unfilled <= 0, timeout)
+
+def indicator_pool(cfg: Config, r: redis.Redis, engines: dict) -> IndicatorPool:
+    return IndicatorPool(cfg, r, engines)
+
+def queue_indicators(cfg: Config, r: redis.Redis, engines: dict, row: dict,
+                     tf: Optional[str] = None, pool: Optional[IndicatorPool] = None) -> dict:
+    '''
+    Start the indicator update for a closed candle and return the dict its
+    values land in, for the writer: filled in by the pool before the writer's
+    next commit (its `wait` is pool.wait_values), or right here without one.
+    '''
+    values = {}
+    if pool is None:
+        t0 = time.monotonic()
+        fed, warm = update_values(cfg, engines, [(row, values)], tf)
+        if fed:
+            publish_rows(cfg, r, fed, tf, warm)
+            CLOSE_TO_PUBLISH.observe(time.monotonic() - t0)
+    else:
+        pool.submit(indicator_key(row["symbol"], tf), (row, values, tf, time.monotonic()))
+    return values
+
+def candle_row(symbol: str, c: Candle) -> dict:
+    return {
+        "symbol": symbol,
+        "t_start_ms": c.t_start_ms,
+        "t_end_ms": c.t_end_ms,
+        "open": c.open,
+        "high": c.high,
+        "low": c.low,
+        "close": c.close,
+        "volume": c.volume,
+        "quote_volume": c.quote_volume,
+        "buy_volume": c.buy_volume,
+        "sell_volume": c.sell_volume,
+        "trades": c.trades,
+        "max_qty": c.max_qty,
+        "vwap": c.vwap,  # published, not stored (quote_volume / volume); NaN for an empty candle
+    }
+
+def finalize_candles(cfg: Config, r: redis.Redis, engines: dict, writer: CandleWriter, closed: list,
+                     rollups: Optional[RollupAggregator] = None, pool: Optional[IndicatorPool] = None) -> None:
+    # persist candles the aggregator just finalized, with their indicators (computed on the pool if there is one)
+    CLOSED.inc(len(closed))
+    for symbol, c in closed:
+        row = candle_row(symbol, c)
+        writer.add(row, queue_indicators(cfg, r, engines, row, pool=pool))
+        if rollups is not None:
+            finalize_rollups(cfg, r, engines, writer, rollups.add(symbol, c), pool)
+
+def finalize_rollups(cfg: Config, r: redis.Redis, engines: dict, writer: CandleWriter, closed: list,
+                     pool: Optional[IndicatorPool] = None) -> None:
+    for symbol, tf, c in closed:
+        row = candle_row(symbol, c)
+        writer.add_rollup(tf, row, queue_indicators(cfg, r, engines, row, tf, pool))
+
+def finalize_bars(cfg: Config, r: redis.Redis, engines: dict, writer: CandleWriter, closed: list,
+                  pool: Optional[IndicatorPool] = None) -> None:
+    # bars go through the same indicator engines and publish path as rollups (key symbol:bar)
+    BARS_CLOSED.inc(len(closed))
+    for symbol, bar, c in closed:
+        row = candle_row(symbol, c)
+        writer.add_bar(bar, row, queue_indicators(cfg, r, engines, row, bar, pool))
+
+def seed_bars(cfg: Config, bars: BarAggregator, symbol: str) -> None:
+    # bars without checkpointed state start after the last stored bar
+    for bar in bars.specs:
+        key = (symbol, bar)
+        if key not in bars.current and key not in bars.closed_until:
+            bars.seed(symbol, bar, last_rollup_end(cfg.sqlite_path, symbol, bar))
+
+def seed_rollups(cfg: Config, r: redis.Redis, engines: dict, writer: CandleWriter,
+                 rollups: RollupAggregator, symbol: str, pool: Optional[IndicatorPool] = None) -> None:
+    '''
+    Rebuild a symbol's open rollups after a restart or handoff by replaying the
+    stored base candles that came after the last stored rollup of each
+    timeframe (from the current bucket if none is stored yet). Rollups that
+    completed while we were away are written now.
+    '''
+    writer.flush()
+    t = now_ms()
+    since = None
+    for tf, ms in rollups.frames.items():
+        end = last_rollup_end(cfg.sqlite_path, symbol, tf)
+        if end is None:
+            end = floor_bucket(t, ms)
+        rollups.seed(symbol, tf, end)
+        since = end if since is None else min(since, end)
+    if since is None:
+        return
+
+    df = read_candles_since(cfg.sqlite_path, symbol, since)
+    for row in df.to_dict("records"):
+        c = Candle(**{k: v for k, v in row.items() if k != "symbol"})
+        finalize_rollups(cfg, r, engines, writer, rollups.add(symbol, c), pool)
+
+def parse_trades(msgs: list) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # whole-batch parse; raises on any malformed entry (caller falls back to per-message).
+    fields = [f for _, f in msgs]
+    n = len(fields)
+    if PACKED_FIELD in fields[0]:
+        # packed: one frombuffer for the whole batch (a legacy entry in the batch raises KeyError)
+        arr = unpack_trades(list(map(itemgetter(PACKED_FIELD), fields)))
+        return arr["ts_ms"], arr["price"], arr["qty"], (arr["flags"] & FLAG_SELL).astype(bool)
+    # fromiter(map(float, ...)) runs the same float() as the per-message path, in C.
+    ts = np.fromiter(map(int, map(itemgetter("ts_ms"), fields)), np.int64, n)
+    price = np.fromiter(map(float, map(itemgetter("price"), fields)), np.float64, n)
+    qty = np.fromiter(map(float, map(itemgetter("qty"), fields)), np.float64, n)
+    # dict.get mapped over (fields, "side") pairs: no per-entry bound method like methodcaller("get")
+    sell = np.fromiter(map(eq, map(dict.get, fields, repeat("side")), repeat("sell")), bool, n)
+    return ts, price, qty, sell
+
+def process_batch(cfg: Config, r: redis.Redis, resp: list, agg: CandleAggregator,
+                  engines: dict, writer: CandleWriter, ack_each: bool = False,
+                  rollups: Optional[RollupAggregator] = None,
+                  pool: Optional[IndicatorPool] = None,
+                  bars: Optional[BarAggregator] = None) -> tuple[dict, list]:
+    '''
+    Aggregate one XREADGROUP response.
+    Returns (message ids to ack per stream, DLQ entries). With ack_each=True
+    every message is acked / dead-lettered immediately instead (one round trip each).
+    '''
+    acks = defaultdict(list)
+    dlq = []
+    now = now_ms()
+
+    for st, msgs in resp:
+        # stream name is trades:<symbol>
+        symbol = st.split(":")[-1]
+        if msgs:
+            # entry ids start with the XADD time (Redis clock)
+            READ_LAG.observe(max(0, now - int(msgs[0][0].split("-", 1)[0])) / 1000)
+            CONSUMED.inc(len(msgs))
+
+        if cfg.batch_agg_min and len(msgs) >= cfg.batch_agg_min:
+            try:
+                ts, price, qty, sell = parse_trades(msgs)
+            except (KeyError, ValueError, TypeError):
+                pass  # some entry is bad: the per-message path below dead-letters it
+            else:
+                closed = agg.add_batch(symbol, ts, price, qty, sell)
+                if closed:
+                    finalize_candles(cfg, r, engines, writer, closed, rollups, pool)
+                if bars is not None:
+                    finalize_bars(cfg, r, engines, writer, bars.add_batch(symbol, ts, price, qty, sell), pool)
+                ids = [msg_id for msg_id, _ in msgs]
+                if ack_each:
+                    r.xack(st, cfg.consumer_group, *ids)
+                else:
+                    acks[st].extend(ids)
+                continue
 
-    if df.empty or len(df) < 30:
+        for msg_id, fields in msgs:
+            try:
+                ts, price, qty, sell = decode_trade(fields)
+
+                closed = agg.add(symbol, ts, price, qty, sell)
+                if closed:
+                    finalize_candles(cfg, r, engines, writer, closed, rollups, pool)
+                if bars is not None:
+                    finalize_bars(cfg, r, engines, writer, bars.add(symbol, ts, price, qty, sell), pool)
+            except Exception as e:
+                log.exception("Bad message %s %s: %s", st, msg_id, e)
+                entry = {"stream": st, "id": msg_id, "err": str(e), "fields": str(fields)}
+                DEAD_LETTERED.inc()
+                if ack_each:
+                    # send to dead letter queue
+                    r.xadd(cfg.dlq_stream, entry)
+                else:
+                    dlq.append(entry)
+
+            if ack_each:
+                r.xack(st, cfg.consumer_group, msg_id)
+            else:
+                acks[st].append(msg_id)
+
+    return acks, dlq
+
+def ack_batch(cfg: Config, r: redis.Redis, acks: dict, dlq: list, checkpoint=None) -> None:
+    '''
+    One pipeline per batch: DLQ XADDs first (so a bad message is never acked
+    without being dead-lettered), then one multi-id XACK per stream.
+    checkpoint(pipe) queues the state those acks lead to; the pipeline then
+    runs as MULTI/EXEC so acks and checkpoint land together or not at all.
+    '''
+    if not acks and not dlq:
         return
+    pipe = r.pipeline(transaction=checkpoint is not None)
+    for entry in dlq:
+        pipe.xadd(cfg.dlq_stream, entry)
+    for st, ids in acks.items():
+        pipe.xack(st, cfg.consumer_group, *ids)
+    if checkpoint is not None:
+        checkpoint(pipe)
+    pipe.execute()
+
+def handle_batch(cfg: Config, r: redis.Redis, resp: list, agg: CandleAggregator,
+                 engines: dict, writer: CandleWriter, batch_ack: bool,
+                 rollups: Optional[RollupAggregator] = None, pool: Optional[IndicatorPool] = None,
+                 bars: Optional[BarAggregator] = None) -> None:
+    t0 = time.perf_counter()
+    READ_BATCH.observe(sum(len(msgs) for _, msgs in resp))
+    acks, dlq = process_batch(cfg, r, resp, agg, engines, writer, ack_each=not batch_ack, rollups=rollups,
+                              pool=pool, bars=bars)
 
-    df = df.sort_values("t_start_ms")
-    close = df["close"]
+    if batch_ack:
+        # closed candles covering these messages must be committed before we ack them
+        writer.flush()
+        checkpoint = None
+        if cfg.checkpoint:
+            last_ids = {st.split(":")[-1]: msgs[-1][0] for st, msgs in resp if msgs}
 
-    df["sma20"] = sma(close, 20)
-    df["ema20"] = ema(close, 20)
-    df["rsi14"] = rsi(close, 14)
+            def checkpoint(pipe):
+                write_checkpoints(pipe, cfg, agg, rollups, last_ids, last_ids, engines, bars)
+        ack_batch(cfg, r, acks, dlq, checkpoint)
+    else:
+        writer.maybe_flush()
+    BATCH_SECONDS.observe(time.perf_counter() - t0)
 
-    m, s, h = macd(close)
-    df["macd"] = m
-    df["macd_signal"] = s
-    df["macd_hist"] = h
+def checkpoint_now(cfg: Config, r: redis.Redis, agg: CandleAggregator, rollups: Optional[RollupAggregator],
+                   engines: dict, writer: CandleWriter, symbols, bars: Optional[BarAggregator] = None) -> None:
+    # checkpoint state outside of an ack (timer closes, shutdown, handoff); candles first
+    writer.flush()
+    pipe = r.pipeline(transaction=True)
+    write_checkpoints(pipe, cfg, agg, rollups, symbols, engines=engines, bars=bars)
+    pipe.execute()
 
-    lo, mid, up = bollinger(close, 20, 2.0)
-    df["bb_lower"] = lo
-    df["bb_mid"] = mid
-    df["bb_upper"] = up
+def replay_pending(cfg: Config, r: redis.Redis, streams: list, last_ids: dict, handle) -> int:
+    '''
+    Re-read this consumer's own pending entries (delivered before a crash, never
+    acked) and hand them to handle(resp) in order. Entries at or before the
+    checkpointed last_id, and entries already trimmed away, are only acked.
+    '''
+    n = 0
+    while True:
+        resp = r.xreadgroup(cfg.consumer_group, cfg.consumer_name, {st: "0" for st in streams}, count=cfg.read_count)
+        batch, done = [], []
+        for st, msgs in resp or []:
+            last = last_ids.get(st.split(":")[-1])
+            keep = []
+            for msg_id, fields in msgs:
+                if not fields or (last is not None and stream_id(msg_id) <= stream_id(last)):
+                    done.append((st, msg_id))
+                else:
+                    keep.append((msg_id, fields))
+            if keep:
+                batch.append((st, keep))
+        if not batch and not done:
+            return n
+        if done:
+            pipe = r.pipeline(transaction=False)
+            for st, msg_id in done:
+                pipe.xack(st, cfg.consumer_group, msg_id)
+            pipe.execute()
+        if batch:
+            handle(batch)
+            n += sum(len(msgs) for _, msgs in batch)
 
-    last = df.iloc[-1].to_dict()
+def claim_pending(cfg: Config, r: redis.Redis, st: str, min_idle_ms: int) -> list:
+    '''
+    XAUTOCLAIM everything pending on `st` for longer than min_idle_ms (left behind
+    by a worker that died) so this worker processes it. Entries already trimmed
+    from the stream come back without fields; those are just acked.
+    '''
+    out, gone = [], []
+    start = "0-0"
+    while True:
+        res = r.xautoclaim(st, cfg.consumer_group, cfg.consumer_name, min_idle_ms, start_id=start, count=cfg.read_count)
+        start, msgs = res[0], res[1]
+        for msg_id, fields in msgs:
+            (out if fields else gone).append((msg_id, fields))
+        if start in ("0-0", b"0-0") or not msgs:
+            break
+    if gone:
+        r.xack(st, cfg.consumer_group, *[i for i, _ in gone])
+    if out:
+        log.info("Claimed %d pending entries on %s", len(out), st)
+    return out
 
-    latest_key = f"latest:{symbol}"
-    write_latest(r, latest_key, {k: str(v) for k, v in last.items() if v == v})  # v==v skips NaN
+def group_metrics(cfg: Config, r: redis.Redis, streams: list) -> list[str]:
+    # XINFO GROUPS for our consumer group on each stream (scrape time, one pipeline)
+    pipe = r.pipeline(transaction=False)
+    for st in streams:
+        pipe.xinfo_groups(st)
+    pending, lag = [], []
+    for st, groups in zip(streams, pipe.execute(raise_on_error=False)):
+        if isinstance(groups, Exception):
+            continue
+        for g in groups:
+            if g.get("name") == cfg.consumer_group:
+                pending.append(({"stream": st}, g.get("pending") or 0))
+                if g.get("lag") is not None:  # Redis >= 7
+                    lag.append(({"stream": st}, g["lag"]))
+    return (metrics.family("consumer_group_pending", "gauge", "Entries delivered but not acked (XINFO GROUPS)", pending)
+            + metrics.family("consumer_group_lag", "gauge", "Entries not yet delivered to the group (XINFO GROUPS)", lag))
 
 def main() -> None:
     cfg = Config()
@@ -96,76 +495,205 @@ def main() -> None:
     init_sqlite(cfg.sqlite_path)
 
     bucket_ms = cfg.candle_sec * 1000
-    streams = [stream_key(cfg, s) for s in cfg.symbols]
+    streams = tuple(stream_key(cfg, s) for s in cfg.symbols)
 
     # Ensure consumer groups exist
     for st in streams:
         ensure_group(r, st, cfg.consumer_group)
 
-    # Per-symbol in-progress candle
-    current = {}
+    # Per-symbol in-progress candles, finalized by watermark timers
+    agg = CandleAggregator(bucket_ms, grace_ms=cfg.finalize_grace_ms, gap_fill=cfg.gap_fill)
+    # Per-symbol (and symbol:tf) incremental indicator state, updated by the pool's workers;
+    # the writer waits for them before each commit so candles and indicators land together
+    engines = {}
+    pool = indicator_pool(cfg, r, engines)
+    live = LivePublisher(cfg)
+    # Higher-timeframe candles rolled up from the finalized base candles
+    frames = rollup_frames(cfg)
+    for tf in set(cfg.timeframes) - set(frames):
+        log.warning("Ignoring timeframe %s: not a multiple of CANDLE_SEC=%d", tf, cfg.candle_sec)
+    rollups = RollupAggregator(frames) if frames else None
+    # tick / volume / dollar bars from the same trades, in their own table
+    bars = BarAggregator(bar_specs(cfg)) if cfg.bars else None
 
-    while True:
-        try:
-            resp = r.xreadgroup(
-                groupname=cfg.consumer_group,
-                consumername=cfg.consumer_name,
-                streams={st: ">" for st in streams},
-                count=100,
-                block=2000,
-            )
-            if not resp:
-                continue
+    batch_ack = cfg.ack_mode == "batch"
+    writer = CandleWriter(cfg.sqlite_path, cfg.sqlite_batch_size, cfg.sqlite_flush_ms, wait=pool.wait_values)
+
+    coord = None
+    if cfg.sharding:
+        coord = ShardCoordinator(r, cfg.consumer_group, cfg.consumer_name, cfg.symbols, cfg.shard_ttl_ms)
+        streams = ()
+    next_beat = 0.0
+    # blocking reads must wake up often enough to run the finalize timers
+    # (and, when sharded, to heartbeat before our leases lapse)
+    block_ms = min(cfg.read_block_ms, cfg.finalize_interval_ms)
+    if coord is not None:
+        block_ms = min(block_ms, cfg.shard_heartbeat_ms)
+    next_stats = time.monotonic() + STATS_LOG_SEC
+    # symbols whose candles closed on a timer since the last checkpoint
+    dirty = set()
+    next_checkpoint = time.monotonic() + cfg.checkpoint_ms / 1000
+
+    def restore(symbol: str, fields: Optional[dict], state=None) -> None:
+        # checkpointed state (open candle from the handoff `state` if there is one), then rollups
+        restored = False
+        if fields:
+            restored = restore_symbol(agg, rollups, engines, symbol, fields, candle=state is None, bars=bars)
+        if state is not None:
+            agg.restore(symbol, Candle(**state))
+        if bars is not None:
+            seed_bars(cfg, bars, symbol)
+        if fields:
+            fed = catch_up_engines(cfg, engines, agg, rollups, symbol, bars)
+            if fed:
+                log.info("Caught up %s indicators with %d stored candles", symbol, fed)
+        if rollups is not None and not restored:
+            seed_rollups(cfg, r, engines, writer, rollups, symbol, pool)
+
+    def collect() -> list[str]:
+        # runs on the metrics server thread: read `streams`, a tuple the main loop only
+        # ever reassigns, never coord.owned, which rebalance mutates while we iterate
+        ps = pool.snapshot()
+        return (
+            group_metrics(cfg, r, list(streams))
+            + metrics.family("consumer_open_candles", "gauge", "Candles currently open", [({}, len(agg.current))])
+            + metrics.family("consumer_late_trades_total", "counter", "Trades dropped as late", [({}, agg.late_trades)])
+            + metrics.family("indicator_queue_depth", "gauge", "Symbols with indicator work waiting", [({}, ps["depth"])])
+            + metrics.family("indicator_jobs_total", "counter", "Indicator jobs run", [({}, ps["jobs"])])
+            + metrics.family("indicator_coalesced_total", "counter", "Closes merged into an already queued job", [({}, ps["coalesced"])])
+            + metrics.family("indicator_errors_total", "counter", "Indicator jobs that raised", [({}, ps["errors"])])
+        )
+    metrics.REGISTRY.add_collector(collect)
+    metrics.serve(cfg.metrics_port)
+
+    def forget(symbol: str) -> Optional[Candle]:
+        # drop a symbol's local state; returns its open candle
+        # (list() first: pool workers may be adding other symbols' engines)
+        for key in [k for k in list(engines) if k == symbol or k.startswith(f"{symbol}:")]:
+            del engines[key]
+        if rollups is not None:
+            rollups.release(symbol)
+        if bars is not None:
+            bars.release(symbol)
+        return agg.release(symbol)
+
+    def on_release(symbol: str):
+        # hand the open candle to the next owner; its indicator state is restored there.
+        # The flush (or the checkpoint's) waits for the values of queued indicator jobs,
+        # discard() then for any publish still running
+        if cfg.checkpoint:
+            checkpoint_now(cfg, r, agg, rollups, engines, writer, [symbol], bars)
+            dirty.discard(symbol)
+        else:
+            writer.flush()
+        pool.discard(lambda k: k == symbol or k.startswith(f"{symbol}:"))
+        c = forget(symbol)
+        return asdict(c) if c is not None else None
+
+    def on_lost(symbol: str) -> None:
+        # our lease lapsed: the new owner restores from the last checkpoint, so don't write one
+        pool.discard(lambda k: k == symbol or k.startswith(f"{symbol}:"))
+        dirty.discard(symbol)
+        forget(symbol)
+
+    def on_acquire(symbol: str, state, claimed: list) -> None:
+        fields = load_checkpoints(r, cfg, [symbol]).get(symbol) if cfg.checkpoint else None
+        restore(symbol, fields, state)
+        st = stream_key(cfg, symbol)
+        msgs = claim_pending(cfg, r, st, cfg.shard_ttl_ms // 2)
+        if msgs:
+            claimed.append((st, msgs))
+
+    stop = threading.Event()
+    def _on_signal(signum, frame):
+        log.info("Signal %s received, shutting down", signum)
+        stop.set()
+    signal.signal(signal.SIGTERM, _on_signal)
+    signal.signal(signal.SIGINT, _on_signal)
 
-            for st, msgs in resp:
-                # stream name is trades:<symbol>
-                symbol = st.split(":")[-1]
-                for msg_id, fields in msgs:
-                    try:
-                        ts = int(fields["ts_ms"])
-                        price = float(fields["price"])
-                        qty = float(fields["qty"])
-
-                        t0 = floor_bucket(ts, bucket_ms)
-                        t1 = t0 + bucket_ms
-
-                        c = current.get(symbol)
-                        if c is None or c.t_start_ms != t0:
-                            # flush previous candle if exists
-                            if c is not None:
-                                insert_candle(cfg.sqlite_path, {
-                                    "symbol": symbol,
-                                    "t_start_ms": c.t_start_ms,
-                                    "t_end_ms": c.t_end_ms,
-                                    "open": c.open,
-                                    "high": c.high,
-                                    "low": c.low,
-                                    "close": c.close,
-                                    "volume": c.volume,
-                                })
-                                compute_and_cache(cfg, r, symbol)
-
-                            # start new candle
-                            c = Candle(t_start_ms=t0, t_end_ms=t1, open=price, high=price, low=price, close=price, volume=qty)
-                            current[symbol] = c
-                        else:
-                            # update candle
-                            c.high = max(c.high, price)
-                            c.low = min(c.low, price)
-                            c.close = price
-                            c.volume += qty
-                            current[symbol] = c
-
-                        r.xack(st, cfg.consumer_group, msg_id)
-                    except Exception as e:
-                        log.exception("Bad message %s %s: %s", st, msg_id, e)
-                        # send to dead letter queue
-                        r.xadd(cfg.dlq_stream, {"stream": st, "id": msg_id, "err": str(e), "fields": str(fields)})
-                        r.xack(st, cfg.consumer_group, msg_id)
-
-        except Exception as e:
-            log.exception("Consumer loop error: %s", e)
-            time.sleep(1.0)
+    if coord is None:
+        t0 = time.perf_counter()
+        saved = load_checkpoints(r, cfg, cfg.symbols) if cfg.checkpoint else {}
+        for symbol in cfg.symbols:
+            restore(symbol, saved.get(symbol))
+        if saved:
+            log.info("Restored %d/%d symbols from checkpoints in %.1fms",
+                     len(saved), len(cfg.symbols), (time.perf_counter() - t0) * 1000)
+        # entries delivered to us before a restart but never acked
+        last_ids = {s: f["last_id"] for s, f in saved.items() if f.get("last_id")}
+        n = replay_pending(cfg, r, streams, last_ids,
+                           lambda resp: handle_batch(cfg, r, resp, agg, engines, writer, batch_ack, rollups, pool, bars))
+        if n:
+            log.info("Replayed %d pending entries", n)
+
+    try:
+        while not stop.is_set():
+            try:
+                if coord is not None and time.monotonic() >= next_beat:
+                    claimed = []
+                    coord.rebalance(on_release, lambda s, state: on_acquire(s, state, claimed), on_lost)
+                    streams = tuple(stream_key(cfg, s) for s in sorted(coord.owned))
+                    next_beat = time.monotonic() + cfg.shard_heartbeat_ms / 1000
+                    if claimed:
+                        handle_batch(cfg, r, claimed, agg, engines, writer, batch_ack, rollups, pool, bars)
+
+                if not streams:
+                    # sharded and currently assigned nothing
+                    stop.wait(block_ms / 1000)
+                    continue
+
+                resp = r.xreadgroup(
+                    groupname=cfg.consumer_group,
+                    consumername=cfg.consumer_name,
+                    streams={st: ">" for st in streams},
+                    count=cfg.read_count,
+                    block=block_ms,
+                )
+                if resp:
+                    handle_batch(cfg, r, resp, agg, engines, writer, batch_ack, rollups, pool, bars)
+                    if not batch_ack:
+                        dirty.update(st.split(":")[-1] for st, _ in resp)
+                    live.touch(st.split(":")[-1] for st, _ in resp)
+
+                # watermark passed t_end_ms + grace: finalize without waiting for the next trade
+                closed = agg.advance(now_ms())
+                if closed:
+                    finalize_candles(cfg, r, engines, writer, closed, rollups, pool)
+                    dirty.update(symbol for symbol, _ in closed)
+                writer.maybe_flush()
+                live.maybe_flush(r, agg, rollups)
+
+                if cfg.checkpoint and dirty and time.monotonic() >= next_checkpoint:
+                    checkpoint_now(cfg, r, agg, rollups, engines, writer, dirty, bars)
+                    dirty.clear()
+                    next_checkpoint = time.monotonic() + cfg.checkpoint_ms / 1000
+
+                if time.monotonic() >= next_stats:
+                    next_stats = time.monotonic() + STATS_LOG_SEC
+                    log.info("open candles=%d timers=%d late trades=%d", len(agg.current), len(agg.wheel), agg.late_trades)
+                    ps = pool.snapshot()
+                    log.info("indicators: depth=%d max_depth=%d jobs=%d coalesced=%d errors=%d wait p99=%.1fms run p99=%.1fms",
+                             ps["depth"], ps["max_depth"], ps["jobs"], ps["coalesced"], ps["errors"],
+                             ps.get("wait_p99_ms", 0.0), ps.get("run_p99_ms", 0.0))
+
+            except Exception as e:
+                log.exception("Consumer loop error: %s", e)
+                time.sleep(1.0)
+    finally:
+        if coord is None and not cfg.checkpoint:
+            # nobody takes these over: write the open candles as they are
+            # (open rollups are not written; they are rebuilt from these on restart;
+            # open bars are dropped, they are only kept through checkpoints)
+            finalize_candles(cfg, r, engines, writer, agg.flush(), rollups, pool)
+        pool.close(timeout=10.0)
+        n = len(writer.pending) + len(writer.pending_tf) + len(writer.pending_bar)
+        if coord is not None:
+            coord.leave(on_release, on_lost)
+        elif cfg.checkpoint:
+            # open candles stay open: the next start resumes them
+            checkpoint_now(cfg, r, agg, rollups, engines, writer, cfg.symbols, bars)
+        writer.close()
+        log.info("Flushed %d buffered candles on shutdown", n)
 
 if __name__ == "__main__":
     main()
@@ -1,20 +1,55 @@
+import json
+
 import redis
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
-from src.common import Config
-from src.storage import read_candles, read_latest
+from src.common import Config, now_ms, rollup_frames, is_bar
+from src.storage import CandleCache, read_hashes
+from src.downsample import RangeCache
+from src.screener import screener_key
 from streamlit_autorefresh import st_autorefresh
 
 st.set_page_config(page_title="Crypto Stream Analytics", layout="wide")
 
 cfg = Config()
-r = redis.Redis(host=cfg.redis_host, port=cfg.redis_port, password=cfg.redis_password or None, decode_responses=True)
+
+# Streamlit re-runs this script on every refresh of every tab; these are built
+# once per server process and shared by all sessions.
+@st.cache_resource
+def redis_client() -> redis.Redis:
+    pool = redis.ConnectionPool(host=cfg.redis_host, port=cfg.redis_port, password=cfg.redis_password or None, decode_responses=True)
+    return redis.Redis(connection_pool=pool)
+
+@st.cache_resource
+def candle_cache() -> CandleCache:
+    # stored per-candle indicators come with the candles (one joined query), nothing is recomputed
+    return CandleCache(cfg.sqlite_path, limit=500, indicators=True)
+
+@st.cache_resource
+def range_cache() -> RangeCache:
+    return RangeCache(live_ttl_ms=cfg.candle_sec * 1000)
+
+r = redis_client()
+cache = candle_cache()
+ranges = range_cache()
+
+# chart windows; anything longer than the latest candles is downsampled server-side
+WINDOWS = {"Latest candles": None, "1h": 3_600_000, "6h": 21_600_000, "24h": 86_400_000, "7d": 604_800_000, "30d": 2_592_000_000}
+MAX_POINTS = 600
 
 st.title("📈 Crypto Real-Time Analytics (Redis Streams + SQLite)")
 
 symbol = st.selectbox("Symbol", list(cfg.symbols), index=0)
+# base candles plus the rollups and bars the consumer maintains; each is a precomputed series
+# (only the timeframes it actually rolls up: multiples of the base candle)
+base_tf = f"{cfg.candle_sec}s"
+frames = rollup_frames(cfg)
+tf = st.selectbox("Timeframe", [base_tf, *frames, *cfg.bars], index=0)
+series_tf = None if tf == base_tf else tf
+window = st.selectbox("Chart window", list(WINDOWS), index=0)
 refresh = st.slider("Auto-refresh (seconds)", 1, 10, 2)
 
 # ---- Tooltip metric cards (hover) ----
@@ -41,10 +76,12 @@ def metric_card(title: str, value: str, tooltip: str, sub: str = ""):
         unsafe_allow_html=True
     )
 
-latest = read_latest(r, f"latest:{symbol}")
-
-# Optional: show live last-trade price if you added last_trade in consumer
-last_trade = r.hgetall(f"last_trade:{symbol}")  # harmless even if missing
+# latest indicators, live last-trade price, forming candle and screener (harmless even if missing), one round trip
+key = symbol if series_tf is None else f"{symbol}:{series_tf}"
+latest, last_trade, live, screener = read_hashes(
+    r, [f"latest:{key}", f"last_trade:{symbol}", f"live:{key}", screener_key(cfg.screener_tf)]
+)
+latest = latest or None
 
 st.markdown('<div class="metric-grid">', unsafe_allow_html=True)
 cols = st.columns(4)
@@ -54,7 +91,7 @@ with cols[0]:
         metric_card(
             "Live Price",
             f"{float(last_trade['price']):.2f}",
-            "Most recent trade price from the live Binance stream. Updates on every incoming trade."
+            "Most recent trade price from the live Binance stream, published by the consumer every LIVE_INTERVAL_MS."
         )
     elif latest:
         metric_card(
@@ -100,15 +137,34 @@ with cols[3]:
         metric_card("BB Mid", "—", "Bollinger Bands need enough candles (usually 20+).")
 
 # ---- Chart ----
-df = read_candles(cfg.sqlite_path, symbol, limit=500)
+if WINDOWS[window] is None or is_bar(series_tf):
+    # bars have no time resolution to downsample to: always the latest ones
+    df = cache.get(symbol, series_tf)
+else:
+    # at most MAX_POINTS OHLC buckets, read from the coarsest stored timeframe that fits
+    end = now_ms()
+    df = ranges.get(cfg.sqlite_path, symbol, end - WINDOWS[window], end, MAX_POINTS, cfg.candle_sec * 1000, frames)
+# the forming candle, if it is newer than the last stored one (the live hash outlives its candle until the next trade)
+if WINDOWS[window] is None and live and (df.empty or int(live["t_start_ms"]) > int(df["t_start_ms"].iat[-1])):
+    bar = {c: float(live[c]) for c in ("open", "high", "low", "close", "volume")}
+    bar.update(symbol=symbol, t_start_ms=int(live["t_start_ms"]), t_end_ms=int(live["t_end_ms"]))
+    df = pd.concat([df, pd.DataFrame([bar])], ignore_index=True) if not df.empty else pd.DataFrame([bar])
 if not df.empty:
-    fig = go.Figure(
-        data=[go.Candlestick(
-            x=pd.to_datetime(df["t_start_ms"], unit="ms"),
-            open=df["open"], high=df["high"], low=df["low"], close=df["close"]
-        )]
-    )
-    fig.update_layout(height=520, xaxis_title="Time", yaxis_title="Price")
+    x = pd.to_datetime(df["t_start_ms"], unit="ms")
+    candles = go.Candlestick(x=x, open=df["open"], high=df["high"], low=df["low"], close=df["close"], name="OHLC")
+    if "bb_mid" in df.columns:
+        # latest candles carry their stored indicators: Bollinger Bands on the price, MACD below
+        fig = make_subplots(rows=2, cols=1, shared_xaxes=True, row_heights=[0.75, 0.25], vertical_spacing=0.03)
+        fig.add_trace(candles, row=1, col=1)
+        for col, dash in (("bb_upper", "dot"), ("bb_mid", "solid"), ("bb_lower", "dot")):
+            fig.add_trace(go.Scatter(x=x, y=df[col], name=col, mode="lines", line=dict(width=1, dash=dash)), row=1, col=1)
+        fig.add_trace(go.Bar(x=x, y=df["macd_hist"], name="macd_hist"), row=2, col=1)
+        fig.add_trace(go.Scatter(x=x, y=df["macd"], name="macd", mode="lines", line=dict(width=1)), row=2, col=1)
+        fig.add_trace(go.Scatter(x=x, y=df["macd_signal"], name="macd_signal", mode="lines", line=dict(width=1)), row=2, col=1)
+        fig.update_layout(height=640, xaxis_rangeslider_visible=False, yaxis_title="Price", yaxis2_title="MACD")
+    else:
+        fig = go.Figure(data=[candles])
+        fig.update_layout(height=520, xaxis_title="Time", yaxis_title="Price")
     st.plotly_chart(fig, use_container_width=True)
 
     with st.expander("What do these indicators mean?"):
@@ -125,4 +181,18 @@ else:
     st.warning("No candle data yet (producer/consumer still warming up).")
 
 st.caption("Hover the cards above to see what each metric means.")
+st.caption("Candle cache: {hits} hits, {misses} incremental fetches, {loads} cold loads, {rows} rows read".format(**cache.stats)
+           + " · Range cache: {hits} hits, {misses} misses".format(**ranges.stats))
 st_autorefresh(interval=refresh * 1000, key="refresh")
+
+# ---- Screener (all symbols, one vectorized pass per candle; python -m src.screener) ----
+if screener and screener.get("rows"):
+    st.subheader(f"Screener ({cfg.screener_tf or base_tf})")
+    sdf = pd.DataFrame(json.loads(screener["rows"])).set_index("symbol")
+    sort = st.selectbox("Sort by", ["ret_1", "ret_12", "rsi14", "vol_z", "bb_pos", "macd_hist"], index=0)
+    st.dataframe(sdf.sort_values(sort, ascending=False), use_container_width=True)
+    st.caption(
+        f"{screener['symbols']} symbols screened in {float(screener['compute_ms']):.1f} ms. "
+        "macd_cross / bb_break: +1 bullish cross / close above the upper band, -1 the opposite; "
+        "vol_z: last volume in standard deviations from the previous 20 candles; stale: no candle in the last bucket."
+    )
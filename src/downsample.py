@@ -0,0 +1,165 @@
+'''
+Time-range candle queries with a bounded number of points, for charts.
+
+read_series() picks the coarsest stored series (base candles or a rollup
+timeframe) that is still at least as fine as the resolution the range needs
+for `max_points`, reads only that range through the primary-key index, and
+then either
+  - "ohlc": merges candles into equal-width buckets (open of the first, max
+    high, min low, close of the last, summed volume and order flow, largest
+    max_qty), so highs/lows survive, or
+  - "lttb": picks at most max_points candles with Largest-Triangle-Three-Buckets
+    on the close, which keeps the visual shape of a line overlay.
+Either way the payload is bounded by max_points no matter how much history is
+in view. RangeCache keeps results per (symbol, range, resolution).
+'''
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.storage import read_candle_range
+
+MODES = ("ohlc", "lttb")
+# order-flow columns that add up when candles are merged
+SUMMED = ("quote_volume", "buy_volume", "sell_volume", "trades")
+
+def pick_source(span_ms: int, max_points: int, base_ms: int, frames: dict[str, int]) -> tuple[Optional[str], int]:
+    # coarsest series whose candles are no wider than the resolution we need (None = base candles)
+    width = -(-span_ms // max(max_points, 1))
+    tf, tf_ms = None, base_ms
+    for label, ms in sorted(frames.items(), key=lambda kv: kv[1]):
+        if ms <= width:
+            tf, tf_ms = label, ms
+    return tf, tf_ms
+
+def merge_candles(df: pd.DataFrame, width_ms: int) -> pd.DataFrame:
+    '''
+    Bucket-merge candles (sorted by t_start_ms) into width_ms buckets aligned
+    to multiples of width_ms. The last bucket may be partial: its t_end_ms is
+    that of the last candle in it.
+    '''
+    if df.empty:
+        return df
+    t = df["t_start_ms"].to_numpy(np.int64)
+    b = (t // width_ms) * width_ms
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(b)) + 1))
+    ends = np.concatenate((starts[1:], [len(b)]))
+    out = pd.DataFrame({
+        "t_start_ms": b[starts],
+        "t_end_ms": np.maximum.reduceat(df["t_end_ms"].to_numpy(np.int64), starts),
+        "open": df["open"].to_numpy()[starts],
+        "high": np.maximum.reduceat(df["high"].to_numpy(np.float64), starts),
+        "low": np.minimum.reduceat(df["low"].to_numpy(np.float64), starts),
+        "close": df["close"].to_numpy()[ends - 1],
+        "volume": np.add.reduceat(df["volume"].to_numpy(np.float64), starts),
+        **{c: np.add.reduceat(df[c].to_numpy(), starts) for c in SUMMED},
+        "max_qty": np.maximum.reduceat(df["max_qty"].to_numpy(np.float64), starts),
+    })
+    out.insert(0, "symbol", df["symbol"].iat[0])
+    return out
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    '''
+    Largest-Triangle-Three-Buckets: indices of n points (first and last always
+    kept) that best preserve the shape of the line y(x).
+    '''
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        return np.array([0, size - 1], dtype=np.int64)[:n]
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # n-2 buckets over the interior points
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # average of the next bucket (or the last point for the final bucket)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else size
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+def lttb(df: pd.DataFrame, n: int, col: str = "close") -> pd.DataFrame:
+    idx = lttb_indices(df["t_start_ms"].to_numpy(), df[col].to_numpy(), n)
+    return df.iloc[idx].reset_index(drop=True)
+
+def read_series(path: str, symbol: str, start_ms: int, end_ms: int, max_points: int,
+                base_ms: int, frames: dict[str, int], mode: str = "ohlc") -> pd.DataFrame:
+    '''
+    At most max_points candles covering [start_ms, end_ms), from the coarsest
+    stored series that is fine enough. Rollups only exist for completed
+    buckets, so the tail after the last stored rollup is filled from the base
+    candles.
+    '''
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    tf, tf_ms = pick_source(end_ms - start_ms, max_points, base_ms, frames)
+    limit = (end_ms - start_ms) // tf_ms + 1
+    df = read_candle_range(path, symbol, start_ms, end_ms, tf=tf, limit=limit)
+    if tf is not None:
+        tail_from = int(df["t_end_ms"].iat[-1]) if not df.empty else start_ms
+        if tail_from < end_ms:
+            tail = read_candle_range(path, symbol, tail_from, end_ms, limit=(end_ms - tail_from) // base_ms + 1)
+            if not tail.empty:
+                df = pd.concat([df, merge_candles(tail, tf_ms)], ignore_index=True) if not df.empty else merge_candles(tail, tf_ms)
+
+    if len(df) <= max_points:
+        return df
+    if mode == "lttb":
+        return lttb(df, max_points)
+    # round the width up to whole source candles so no candle is split
+    width = -(-(end_ms - start_ms) // max_points)
+    width = -(-width // tf_ms) * tf_ms
+    return merge_candles(df, width)
+
+class RangeCache:
+    '''
+    LRU of read_series() results keyed by (symbol, range, resolution, mode).
+    Ranges are snapped to the output bucket width, so a window that slides
+    with wall clock keeps hitting the same entry until it crosses a bucket.
+    Entries whose range reaches into the last `live_ms` of wall clock are
+    refreshed after live_ttl_ms; older ranges don't change and stay until evicted.
+    Thread safe.
+    '''
+    def __init__(self, maxsize: int = 256, live_ttl_ms: int = 5000, live_ms: int = 60_000):
+        self.maxsize = maxsize
+        self.live_ttl_ms = live_ttl_ms
+        self.live_ms = live_ms
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, path: str, symbol: str, start_ms: int, end_ms: int, max_points: int,
+            base_ms: int, frames: dict[str, int], mode: str = "ohlc") -> pd.DataFrame:
+        width = max(-(-(end_ms - start_ms) // max(max_points, 1)), base_ms)
+        start_ms = (start_ms // width) * width
+        end_ms = -(-end_ms // width) * width
+        key = (path, symbol, start_ms, end_ms, max_points, mode)
+        now = time.time() * 1000
+
+        with self.lock:
+            hit = self.entries.get(key)
+            if hit is not None and (hit[1] is None or hit[1] > now):
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return hit[0]
+            self.stats["misses"] += 1
+
+        df = read_series(path, symbol, start_ms, end_ms, max_points, base_ms, frames, mode)
+        expires = now + self.live_ttl_ms if end_ms > now - self.live_ms else None
+        with self.lock:
+            self.entries[key] = (df, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return df
@@ -1,3 +1,7 @@
+import math
+from collections import deque
+from typing import Optional
+
 import numpy as np
 import pandas as pd
 
@@ -37,3 +41,198 @@ def bollinger(close: pd.Series, n: int = 20, k: float = 2.0):
     upper = mid + k * std
     lower = mid - k * std
     return lower, mid, upper
+
+
+# ---- Incremental (streaming) versions ----
+# Same math as the pandas functions above, but updated one close at a time in O(1)
+# so the consumer does not have to re-read and recompute the whole window per candle.
+
+class RollingStats:
+    '''
+    Fixed window mean + sample std (ddof=1), like rolling(n).mean()/.std().
+    Uses add/evict Welford updates over a ring buffer, and resyncs from the
+    buffer every so often so float error cannot build up on long runs.
+    '''
+    RESYNC_EVERY = 1000
+
+    def __init__(self, n: int):
+        self.n = n
+        self.buf = deque(maxlen=n)
+        self.mean = 0.0
+        self.m2 = 0.0
+        self._since_resync = 0
+
+    def update(self, x: float) -> None:
+        if len(self.buf) < self.n:
+            self.buf.append(x)
+            d = x - self.mean
+            self.mean += d / len(self.buf)
+            self.m2 += d * (x - self.mean)
+            return
+
+        old = self.buf[0]
+        self.buf.append(x)  # deque(maxlen) evicts `old`
+        old_mean = self.mean
+        self.mean += (x - old) / self.n
+        self.m2 += (x - old) * (x - self.mean + old - old_mean)
+        if self.m2 < 0:
+            self.m2 = 0.0
+
+        self._since_resync += 1
+        if self._since_resync >= self.RESYNC_EVERY:
+            self._resync()
+
+    def _resync(self) -> None:
+        self._since_resync = 0
+        self.mean = sum(self.buf) / len(self.buf)
+        self.m2 = sum((v - self.mean) ** 2 for v in self.buf)
+
+    @property
+    def ready(self) -> bool:
+        return len(self.buf) == self.n
+
+    def std(self) -> float:
+        if not self.ready or self.n < 2:
+            return math.nan
+        return math.sqrt(self.m2 / (self.n - 1))
+
+
+class EMAState:
+    '''
+    Recursive EMA matching ewm(adjust=False): seeded with the first value.
+    Pass either span `n` (alpha = 2/(n+1)) or `alpha` directly (Wilder uses 1/n).
+    '''
+    def __init__(self, n: Optional[int] = None, alpha: Optional[float] = None):
+        self.alpha = alpha if alpha is not None else 2.0 / (n + 1)
+        self.value = math.nan
+
+    def update(self, x: float) -> float:
+        if self.value != self.value:
+            self.value = x
+        else:
+            self.value = (1.0 - self.alpha) * self.value + self.alpha * x
+        return self.value
+
+
+class RSIState:
+    # Wilder RSI, same edge cases as rsi() above (no losses -> 100, no gains -> 0)
+    def __init__(self, n: int = 14):
+        self.prev = math.nan
+        self.avg_gain = EMAState(alpha=1.0 / n)
+        self.avg_loss = EMAState(alpha=1.0 / n)
+
+    def update(self, x: float) -> float:
+        prev, self.prev = self.prev, x
+        if prev != prev:
+            return math.nan
+
+        delta = x - prev
+        g = self.avg_gain.update(max(delta, 0.0))
+        l = self.avg_loss.update(max(-delta, 0.0))
+
+        if g == 0:
+            return 0.0
+        if l == 0:
+            return 100.0
+        return 100.0 - (100.0 / (1.0 + g / l))
+
+
+class MACDState:
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMAState(fast)
+        self.slow = EMAState(slow)
+        self.signal = EMAState(signal)
+
+    def update(self, x: float) -> tuple[float, float, float]:
+        m = self.fast.update(x) - self.slow.update(x)
+        s = self.signal.update(m)
+        return m, s, m - s
+
+
+class IndicatorEngine:
+    '''
+    Per-symbol indicator state. Feed it each closed candle's close with update()
+    and it returns the same columns compute_and_cache used to take from df.iloc[-1]
+    (NaN where the indicator is still warming up).
+    '''
+    def __init__(self, sma_n: int = 20, ema_n: int = 20, rsi_n: int = 14, bb_n: int = 20, bb_k: float = 2.0):
+        self.sma = RollingStats(sma_n)
+        self.bb = self.sma if bb_n == sma_n else RollingStats(bb_n)
+        self.bb_k = bb_k
+        self.ema = EMAState(ema_n)
+        self.rsi = RSIState(rsi_n)
+        self.macd = MACDState()
+        self.count = 0
+        # t_end_ms of the last candle fed, and of the last one checkpointed (kept by the consumer)
+        self.until_ms: Optional[int] = None
+        self.checkpointed_ms: Optional[int] = None
+
+    def update(self, close: float) -> dict[str, float]:
+        close = float(close)
+        self.count += 1
+
+        self.sma.update(close)
+        if self.bb is not self.sma:
+            self.bb.update(close)
+
+        m, s, h = self.macd.update(close)
+
+        mid = self.bb.mean if self.bb.ready else math.nan
+        std = self.bb.std()
+
+        return {
+            "sma20": self.sma.mean if self.sma.ready else math.nan,
+            "ema20": self.ema.update(close),
+            "rsi14": self.rsi.update(close),
+            "macd": m,
+            "macd_signal": s,
+            "macd_hist": h,
+            "bb_lower": mid - self.bb_k * std,
+            "bb_mid": mid,
+            "bb_upper": mid + self.bb_k * std,
+        }
+
+    def warm(self, closes) -> Optional[dict[str, float]]:
+        # replay history (oldest first); returns the values for the last close
+        out = None
+        for c in closes:
+            out = self.update(c)
+        return out
+
+    def to_dict(self) -> dict:
+        # complete state (JSON-safe apart from NaN, which json round-trips); see from_dict()
+        def stats(rs: RollingStats) -> dict:
+            return {"n": rs.n, "buf": list(rs.buf), "mean": rs.mean, "m2": rs.m2, "since": rs._since_resync}
+        return {
+            "count": self.count,
+            "until_ms": self.until_ms,
+            "sma": stats(self.sma),
+            "bb": None if self.bb is self.sma else stats(self.bb),
+            "bb_k": self.bb_k,
+            "ema": [self.ema.alpha, self.ema.value],
+            "rsi": [self.rsi.prev, self.rsi.avg_gain.alpha, self.rsi.avg_gain.value, self.rsi.avg_loss.value],
+            "macd": [[e.alpha, e.value] for e in (self.macd.fast, self.macd.slow, self.macd.signal)],
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "IndicatorEngine":
+        def stats(s: dict) -> RollingStats:
+            rs = RollingStats(s["n"])
+            rs.buf.extend(s["buf"])
+            rs.mean, rs.m2, rs._since_resync = s["mean"], s["m2"], s["since"]
+            return rs
+
+        def ema(alpha: float, value: float) -> EMAState:
+            e = EMAState(alpha=alpha)
+            e.value = value
+            return e
+
+        eng = cls()
+        eng.count, eng.until_ms, eng.bb_k = d["count"], d["until_ms"], d["bb_k"]
+        eng.sma = stats(d["sma"])
+        eng.bb = eng.sma if d["bb"] is None else stats(d["bb"])
+        eng.ema = ema(*d["ema"])
+        prev, alpha, gain, loss = d["rsi"]
+        eng.rsi.prev, eng.rsi.avg_gain, eng.rsi.avg_loss = prev, ema(alpha, gain), ema(alpha, loss)
+        eng.macd.fast, eng.macd.slow, eng.macd.signal = (ema(*e) for e in d["macd"])
+        return eng
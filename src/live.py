@@ -0,0 +1,87 @@
+'''
+Forming candle and last trade per symbol, published while the candle is open.
+
+  live:{symbol}          the open base candle
+  live:{symbol}:{tf}     the open rollup, including the open base candle
+  last_trade:{symbol}    ts_ms, price, qty of the last accepted trade
+
+The read loop only marks symbols as touched. Every LIVE_INTERVAL_MS all touched
+symbols are written in one pipeline (and pushed to UPDATES_STREAM as
+"<key>:live"), so each symbol costs at most one write per interval however
+many trades arrive, and Redis load stays flat under bursts.
+
+A live hash can lag behind the stored candles (its candle closed and no trade
+has come in since). Readers should only use it when its t_start_ms is after
+the last stored candle.
+'''
+from dataclasses import asdict, replace
+from typing import Optional
+
+import redis
+
+from src import metrics
+from src.common import Config, now_ms
+from src.aggregator import Candle, CandleAggregator, RollupAggregator, floor_bucket, merge
+from src.storage import publish_update
+
+LIVE_WRITES = metrics.counter("consumer_live_writes_total", "Symbols written by the live candle publisher")
+
+def forming_rollup(cur: Optional[Candle], c: Candle, ms: int) -> Candle:
+    # the open rollup bucket so far: closed base candles in it (cur) plus the open one (c)
+    t0 = floor_bucket(c.t_start_ms, ms)
+    if cur is None or cur.t_start_ms != t0:
+        return replace(c, t_start_ms=t0, t_end_ms=t0 + ms)
+    out = replace(cur)
+    merge(out, c)
+    return out
+
+def live_candles(agg: CandleAggregator, rollups: Optional[RollupAggregator], symbol: str) -> list[tuple[str, Candle]]:
+    # (key, forming candle) for the base timeframe and every rollup; empty between candles
+    c = agg.current.get(symbol)
+    if c is None:
+        return []
+    out = [(symbol, c)]
+    if rollups is not None:
+        for tf, ms in rollups.frames.items():
+            out.append((f"{symbol}:{tf}", forming_rollup(rollups.current.get((symbol, tf)), c, ms)))
+    return out
+
+class LivePublisher:
+    def __init__(self, cfg: Config):
+        self.cfg = cfg
+        self.interval_ms = cfg.live_interval_ms
+        self.dirty: set[str] = set()
+        self.next_ms = 0
+
+    def touch(self, symbols) -> None:
+        if self.interval_ms > 0:
+            self.dirty.update(symbols)
+
+    def maybe_flush(self, r: redis.Redis, agg: CandleAggregator, rollups: Optional[RollupAggregator],
+                    now: Optional[int] = None) -> int:
+        '''
+        Write every touched symbol if the interval has passed, in one round
+        trip. Returns the number of symbols written.
+        '''
+        now = now_ms() if now is None else now
+        if not self.dirty or now < self.next_ms:
+            return 0
+        pipe = r.pipeline(transaction=False)
+        for symbol in self.dirty:
+            trade = agg.last_trade.get(symbol)
+            if trade is not None:
+                ts, price, qty = trade
+                pipe.hset(f"last_trade:{symbol}", mapping={"ts_ms": ts, "price": price, "qty": qty})
+            for key, c in live_candles(agg, rollups, symbol):
+                mapping = {"symbol": symbol, **asdict(c), "updated_ms": now}
+                if c.volume:
+                    mapping["vwap"] = c.vwap
+                pipe.hset(f"live:{key}", mapping=mapping)
+                if self.cfg.updates_stream:
+                    publish_update(pipe, self.cfg.updates_stream, f"{key}:live", mapping, self.cfg.updates_maxlen)
+        pipe.execute()
+        n = len(self.dirty)
+        LIVE_WRITES.inc(n)
+        self.dirty.clear()
+        self.next_ms = now + self.interval_ms
+        return n
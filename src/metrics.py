@@ -0,0 +1,249 @@
+'''
+Process-local metrics in the Prometheus text format.
+
+  from src import metrics
+  BATCH = metrics.histogram("consumer_read_batch_size", "entries per XREADGROUP", metrics.SIZE_BUCKETS)
+  BATCH.observe(len(msgs))
+  metrics.serve(cfg.metrics_port)   # GET /metrics
+
+Counters, gauges and histograms live in one module-level registry and are
+plain Python objects: an observe() is a bisect and two additions under an
+uncontended lock (well under a microsecond), so they can sit on the hot
+loop. Gauges can also be callbacks (and collectors can emit whole families)
+evaluated at scrape time, on the HTTP server's thread; use them for anything
+that needs a Redis round trip. No client library needed.
+'''
+import math
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+log = logging.getLogger("metrics")
+
+# seconds, 100us .. 60s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# counts per batch
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children: dict[tuple, "_Metric"] = {}
+
+    def labels(self, *values) -> "_Metric":
+        # child for one label combination; keep a reference to it on hot paths
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def _child(self) -> "_Metric":
+        return type(self)(self.name, self.doc)
+
+    def _series(self):
+        # (label values, child) for every series of the family
+        if self.labelnames:
+            return list(self.children.items())
+        return [((), self)]
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in self._series():
+            out.extend(child._lines(self.name, self.labelnames, values))
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = ()):
+        super().__init__(name, doc, labelnames)
+        self.value = 0
+
+    def inc(self, n: float = 1) -> None:
+        with self.lock:
+            self.value += n
+
+    def _lines(self, name, names, values) -> list[str]:
+        return [f"{name}{_labels(names, values)} {_num(self.value)}"]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labelnames: tuple = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, doc, labelnames)
+        self.value = 0.0
+        self.fn = fn
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def _lines(self, name, names, values) -> list[str]:
+        v = self.fn() if self.fn is not None else self.value
+        return [f"{name}{_labels(names, values)} {_num(v)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()):
+        super().__init__(name, doc, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot: > every bound
+        self.sum = 0.0
+
+    def _child(self) -> "Histogram":
+        return Histogram(self.name, self.doc, self.bounds)
+
+    def observe(self, v: float) -> None:
+        i = bisect.bisect_left(self.bounds, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def observe_many(self, values) -> None:
+        # one lock round for a batch of observations
+        idx = [bisect.bisect_left(self.bounds, v) for v in values]
+        total = sum(values)
+        with self.lock:
+            for i in idx:
+                self.counts[i] += 1
+            self.sum += total
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def _lines(self, name, names, values) -> list[str]:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        out, cum = [], 0
+        for bound, n in zip(self.bounds + (math.inf,), counts):
+            cum += n
+            le = 'le="%s"' % _num(bound)
+            out.append(f"{name}_bucket{_labels(names, values, le)} {cum}")
+        out.append(f"{name}_sum{_labels(names, values)} {_num(total)}")
+        out.append(f"{name}_count{_labels(names, values)} {cum}")
+        return out
+
+class _Timer:
+    # with HIST.time(): ...  observes the block's duration in seconds
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.hist.observe(time.perf_counter() - self.t0)
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: dict[str, _Metric] = {}
+        self.collectors: list[Callable[[], list[str]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        # same name twice returns the first one (module reloads, tests)
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def add_collector(self, fn: Callable[[], list[str]]) -> None:
+        # fn() -> exposition lines, called on every scrape
+        with self.lock:
+            self.collectors.append(fn)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics, collectors = list(self.metrics.values()), list(self.collectors)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        for fn in collectors:
+            try:
+                lines.extend(fn())
+            except Exception as e:
+                log.warning("metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, doc: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, doc, labelnames))
+
+def gauge(name: str, doc: str, labelnames: tuple = (), fn: Optional[Callable[[], float]] = None) -> Gauge:
+    return REGISTRY.register(Gauge(name, doc, labelnames, fn))
+
+def histogram(name: str, doc: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()) -> Histogram:
+    return REGISTRY.register(Histogram(name, doc, buckets, labelnames))
+
+def family(name: str, kind: str, doc: str, samples: list[tuple[dict, float]]) -> list[str]:
+    # exposition lines for a collector: samples are (labels, value)
+    out = [f"# HELP {name} {doc}", f"# TYPE {name} {kind}"]
+    for labels, v in samples:
+        out.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(v)}")
+    return out
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass  # scrapes are not worth a log line
+
+def serve(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> Optional[ThreadingHTTPServer]:
+    '''
+    Serve GET /metrics on a daemon thread. port=0 disables it; a port that is
+    taken (several processes on one host) only logs a warning.
+    '''
+    if not port:
+        return None
+    handler = type("Handler", (_Handler,), {"registry": registry})
+    try:
+        srv = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        log.warning("Metrics endpoint on port %d not started: %s", port, e)
+        return None
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    log.info("Metrics on http://%s:%d/metrics", host, srv.server_address[1])
+    return srv
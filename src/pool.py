@@ -0,0 +1,141 @@
+'''
+Keyed worker pool with per-key coalescing.
+
+submit(key, item) queues work for a key. A key is never run on two threads at
+once, and everything submitted for it while it waits (or runs) is handed to
+its next run as one list, in order. The callback decides what to do with a
+backlog; the consumer publishes only the newest close of a symbol. A burst of closes for one symbol therefore costs
+one run, not one per candle, and one slow symbol can't hold up the others.
+'''
+import time
+import logging
+import threading
+from collections import deque
+from typing import Callable, Hashable
+
+import numpy as np
+
+log = logging.getLogger("pool")
+
+# latency samples kept for the percentiles in snapshot()
+LATENCY_SAMPLES = 1000
+
+class CoalescingPool:
+    def __init__(self, fn: Callable[[Hashable, list], None], workers: int = 2, name: str = "pool"):
+        '''
+        fn(key, items) runs on a worker thread; workers=0 runs it inline in
+        submit() (no threads, same results, used by tests and tools).
+        '''
+        self.fn = fn
+        self.cond = threading.Condition()
+        self.pending: dict = {}  # key -> [items] not yet handed to fn
+        self.since: dict = {}  # key -> perf_counter() of its oldest pending item
+        self.ready: deque = deque()  # pending keys not currently running, FIFO
+        self.running: set = set()
+        self.closed = False
+        # jobs: fn calls; items: submitted; coalesced: items that joined an already pending key
+        self.stats = {"jobs": 0, "items": 0, "coalesced": 0, "errors": 0, "max_depth": 0}
+        self.wait_ms: deque = deque(maxlen=LATENCY_SAMPLES)  # oldest item queued -> job start
+        self.run_ms: deque = deque(maxlen=LATENCY_SAMPLES)  # fn() duration
+        self.threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True) for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, key: Hashable, item) -> None:
+        if not self.threads:
+            self.stats["items"] += 1
+            self._run(key, [item], time.perf_counter())
+            return
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("pool is closed")
+            self.stats["items"] += 1
+            items = self.pending.get(key)
+            if items is not None:
+                items.append(item)
+                self.stats["coalesced"] += 1
+                return
+            self.pending[key] = [item]
+            self.since[key] = time.perf_counter()
+            if key not in self.running:
+                # a running key is re-queued when its current job finishes
+                self.ready.append(key)
+                self.cond.notify_all()
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.pending))
+
+    def _run(self, key: Hashable, items: list, since: float) -> None:
+        t0 = time.perf_counter()
+        try:
+            self.fn(key, items)
+        except Exception:
+            log.exception("Job for %s failed", key)
+            with self.cond:
+                self.stats["errors"] += 1
+        t1 = time.perf_counter()
+        with self.cond:
+            self.stats["jobs"] += 1
+            self.wait_ms.append((t0 - since) * 1000)
+            self.run_ms.append((t1 - t0) * 1000)
+
+    def _work(self) -> None:
+        while True:
+            with self.cond:
+                while not self.ready and not self.closed:
+                    self.cond.wait()
+                if not self.ready:
+                    return  # closed and nothing left
+                key = self.ready.popleft()
+                items, since = self.pending.pop(key), self.since.pop(key)
+                self.running.add(key)
+            self._run(key, items, since)
+            with self.cond:
+                self.running.discard(key)
+                if key in self.pending:
+                    self.ready.append(key)
+                self.cond.notify_all()
+
+    def depth(self) -> int:
+        # keys with work waiting (at most one entry per key, however many items)
+        with self.cond:
+            return len(self.pending)
+
+    def discard(self, match: Callable[[Hashable], bool]) -> int:
+        '''
+        Drop pending work for keys where match(key) is true and wait for their
+        running jobs to finish. Returns the number of items dropped.
+        '''
+        with self.cond:
+            dropped = 0
+            for key in [k for k in self.pending if match(k)]:
+                dropped += len(self.pending.pop(key))
+                del self.since[key]
+            self.ready = deque(k for k in self.ready if k in self.pending)
+            while any(match(k) for k in self.running):
+                self.cond.wait()
+            return dropped
+
+    def drain(self, timeout: float = None) -> bool:
+        # wait until every submitted item has been processed
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and not self.running, timeout)
+
+    def close(self, timeout: float = None) -> None:
+        self.drain(timeout)
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join(timeout)
+
+    def snapshot(self) -> dict:
+        # stats plus current queue depth and wait/run latency percentiles (ms)
+        with self.cond:
+            out = {**self.stats, "depth": len(self.pending), "running": len(self.running)}
+            wait, run = np.array(self.wait_ms), np.array(self.run_ms)
+        for name, arr in (("wait", wait), ("run", run)):
+            if len(arr):
+                out[f"{name}_p50_ms"] = float(np.percentile(arr, 50))
+                out[f"{name}_p99_ms"] = float(np.percentile(arr, 99))
+        return out
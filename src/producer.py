@@ -1,17 +1,45 @@
+import time
 import asyncio
 import json
 import logging
-from typing import Any
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import websockets
-import redis
+import redis.asyncio as aioredis
 
+from src import metrics
 from src.common import Config, setup_logging, now_ms
+from src.wire import PACKED_FIELD, pack_trade
+
+try:
+    # optional, noticeably faster decode on the hot path
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
 
 log = logging.getLogger("producer")
 
-def redis_client(cfg: Config) -> redis.Redis:
-    return redis.Redis(
+STATS_LOG_SEC = 30.0
+
+EVENT_TO_XADD = metrics.histogram("producer_event_to_xadd_seconds", "Exchange event time to XADD acknowledged by Redis")
+XADD_BATCH = metrics.histogram("producer_xadd_batch_size", "Events per pipelined XADD batch", metrics.SIZE_BUCKETS)
+XADD_SECONDS = metrics.histogram("producer_xadd_batch_seconds", "Round trip of one XADD batch")
+PUBLISHED = metrics.counter("producer_events_published_total", "Events written to the trade streams")
+DROPPED = metrics.counter("producer_events_dropped_total", "Events dropped because the queue was full (QUEUE_POLICY=drop)")
+XADD_ERRORS = metrics.counter("producer_xadd_errors_total", "XADD batches with failed entries")
+XADD_FAILED = metrics.counter("producer_xadd_failed_total", "Events dropped after a permanent XADD error or PRODUCER_XADD_ATTEMPTS tries")
+WS_RECONNECTS = metrics.counter("producer_ws_reconnects_total", "Websocket reconnects after an error", ("conn",))
+MALFORMED = metrics.counter("producer_ws_malformed_total", "Websocket messages skipped because they could not be decoded")
+
+# what a bad frame raises from json_loads / normalize (orjson's decode error is a ValueError too)
+MALFORMED_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+# XADD errors worth another try; anything else (WRONGTYPE, OOM, ...) would fail again
+TRANSIENT_ERRORS = (aioredis.ConnectionError, aioredis.TimeoutError)
+
+def redis_client(cfg: Config) -> aioredis.Redis:
+    return aioredis.Redis(
         host=cfg.redis_host,
         port=cfg.redis_port,
         password=cfg.redis_password or None,
@@ -37,10 +65,191 @@ def normalize_binance_trade(msg: dict[str, Any], symbol: str) -> dict[str, str]:
         "src": "binance",
     }
 
-async def run_symbol(cfg: Config, r: redis.Redis, symbol: str) -> None:
-    url = f"wss://stream.binance.com:9443/ws/{symbol}@aggTrade"
-    skey = stream_key(cfg, symbol)
+def normalize_binance_trade_fast(msg: dict[str, Any], symbol: str) -> dict[str, str]:
+    '''
+    Zero-reformat variant: passes Binance's decimal strings through as-is instead
+    of float() -> f"{:.10f}". Price and qty are not validated here; a malformed
+    one is dead-lettered by the consumer like any other bad message. The event
+    time is (int() raises on a non-numeric one, so the frame is skipped as
+    malformed): the publisher also does arithmetic on it.
+    '''
+    return {
+        "ts_ms": str(int(msg.get("E") or now_ms())),
+        "symbol": symbol,
+        "price": msg["p"],
+        "qty": msg["q"],
+        "side": "sell" if msg.get("m") else "buy",
+        "src": "binance",
+    }
+
+def normalize_binance_trade_packed(msg: dict[str, Any], symbol: str) -> dict[str, bytes]:
+    # WIRE_FORMAT=packed: one binary field (src/wire.py), no symbol/src (the stream key has the symbol)
+    return {PACKED_FIELD: pack_trade(int(msg.get("E") or now_ms()), float(msg["p"]), float(msg["q"]), "sell" if msg.get("m") else "buy")}
+
+def normalizer(cfg: Config):
+    if cfg.wire_format == "packed":
+        return normalize_binance_trade_packed
+    if cfg.ws_fast_normalize:
+        return normalize_binance_trade_fast
+    return normalize_binance_trade
+
+def symbol_url(base: str, symbol: str) -> str:
+    return f"{base}/ws/{symbol}@aggTrade"
+
+def combined_url(base: str, symbols: list[str]) -> str:
+    return f"{base}/stream?streams=" + "/".join(f"{s}@aggTrade" for s in symbols)
+
+def split_symbols(symbols, n: int) -> list[list[str]]:
+    # round-robin symbols over n combined-stream connections
+    n = max(1, min(n, len(symbols)))
+    return [list(symbols[i::n]) for i in range(n)]
+
+@dataclass
+class PublisherStats:
+    enqueued: int = 0
+    published: int = 0
+    # events lost because the queue was full (QUEUE_POLICY=drop)
+    dropped: int = 0
+    # times a websocket reader had to wait for queue space (QUEUE_POLICY=block)
+    backpressured: int = 0
+    batches: int = 0
+    last_batch: int = 0
+    max_batch: int = 0
+    errors: int = 0
+    # events given up on (permanent XADD error, or out of attempts)
+    failed: int = 0
+
+class StreamPublisher:
+    '''
+    Decouples websocket readers from Redis: readers put events on a bounded
+    queue, one writer task drains it into pipelined XADD batches (flushed at
+    `batch_size` events or after `linger_ms`), so a slow Redis round trip
+    never stalls the event loop for other symbols.
+
+    Only the entries of a batch that failed are sent again, so an XADD that
+    Redis applied is never repeated (except when the connection drops before
+    the replies are read: then nothing is known and the whole rest is resent).
+    Connection errors and timeouts are retried up to `max_attempts` times;
+    any other error (WRONGTYPE on one stream key, ...) drops that entry at once.
+    '''
+    def __init__(self, r: aioredis.Redis, maxlen: int, queue_size: int = 10000,
+                 batch_size: int = 500, linger_ms: int = 5, drop_when_full: bool = False,
+                 max_attempts: int = 30):
+        self.r = r
+        self.maxlen = maxlen
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.drop_when_full = drop_when_full
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = PublisherStats()
+
+    async def publish(self, skey: str, event: dict[str, str], event_ms: Optional[int] = None) -> None:
+        # event_ms: exchange event time, for the event -> XADD latency histogram
+        item = (skey, event, event_ms)
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.drop_when_full:
+                self.stats.dropped += 1
+                DROPPED.inc()
+                return
+            self.stats.backpressured += 1
+            await self.queue.put(item)
+        self.stats.enqueued += 1
+
+    def _drain(self, batch: list) -> None:
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                return
 
+    async def run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            self._drain(batch)
+            if len(batch) < self.batch_size and self.linger > 0:
+                # give a burst a few ms to fill the batch
+                await asyncio.sleep(self.linger)
+                self._drain(batch)
+            await self._write(batch)
+
+    async def _write(self, batch: list) -> None:
+        backoff = 0.1
+        pending, written, attempt = batch, [], 0
+        while pending:
+            attempt += 1
+            t0 = time.perf_counter()
+            pipe = self.r.pipeline(transaction=False)
+            for skey, event, _ in pending:
+                # XADD with approximate trimming
+                pipe.xadd(skey, event, maxlen=self.maxlen, approximate=True)
+            try:
+                results = await pipe.execute(raise_on_error=False)
+                XADD_SECONDS.observe(time.perf_counter() - t0)
+            except aioredis.RedisError as e:
+                # no replies (connection lost mid-batch): every entry counts as failed
+                results = [e] * len(pending)
+
+            retry, failed = [], []
+            for item, res in zip(pending, results):
+                if not isinstance(res, Exception):
+                    written.append(item)
+                elif isinstance(res, TRANSIENT_ERRORS) and attempt < self.max_attempts:
+                    retry.append(item)
+                    err = res
+                else:
+                    failed.append((item, res))
+            if retry or failed:
+                self.stats.errors += 1
+                XADD_ERRORS.inc()
+            if failed:
+                self.stats.failed += len(failed)
+                XADD_FAILED.inc(len(failed))
+                (skey, _, _), e = failed[0]
+                log.error("Dropping %d of %d events after %d tries, e.g. %s: %s", len(failed), len(pending), attempt, skey, e)
+            pending = retry
+            if pending:
+                # keep the failed entries and retry; readers back up into the queue meanwhile
+                log.warning("XADD of %d/%d events failed: %s | retry in %.1fs", len(pending), len(batch), err, backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2.0, 5.0)
+
+        if not written:
+            return
+        now = now_ms()
+        try:
+            EVENT_TO_XADD.observe_many([(now - int(ms)) / 1000 for _, _, ms in written if ms])
+        except (TypeError, ValueError) as e:
+            # a bad event time from a caller must not end the writer task
+            log.warning("Skipping event latency for a batch of %d: %s", len(written), e)
+        XADD_BATCH.observe(len(written))
+        PUBLISHED.inc(len(written))
+        st = self.stats
+        st.published += len(written)
+        st.batches += 1
+        st.last_batch = len(written)
+        st.max_batch = max(st.max_batch, len(written))
+
+    async def log_stats(self, every_sec: float = STATS_LOG_SEC) -> None:
+        while True:
+            await asyncio.sleep(every_sec)
+            st = self.stats
+            log.info(
+                "publisher queue=%d/%d published=%d batches=%d avg_batch=%.1f max_batch=%d dropped=%d backpressured=%d errors=%d failed=%d",
+                self.queue.qsize(), self.queue.maxsize, st.published, st.batches,
+                st.published / st.batches if st.batches else 0.0, st.max_batch,
+                st.dropped, st.backpressured, st.errors, st.failed,
+            )
+
+def skip_malformed(raw, e: Exception) -> None:
+    # one bad frame must not cost the connection (and every trade behind it)
+    MALFORMED.inc()
+    log.debug("Skipping malformed message %r: %r", raw[:200], e)
+
+async def run_ws(url: str, label: str, on_message) -> None:
+    # connect/reconnect loop shared by the per-symbol and combined-stream modes
     backoff = 1.0
     while True:
         try:
@@ -48,24 +257,78 @@ async def run_symbol(cfg: Config, r: redis.Redis, symbol: str) -> None:
             async with websockets.connect(url, ping_interval=20, ping_timeout=20) as ws:
                 backoff = 1.0
                 async for raw in ws:
-                    msg = json.loads(raw)
-                    event = normalize_binance_trade(msg, symbol)
-                    # XADD with approximate trimming
-                    r.xadd(skey, event, maxlen=cfg.stream_maxlen, approximate=True)
+                    await on_message(raw)
         except Exception as e:
-            log.warning("WS error (%s): %s | reconnect in %.1fs", symbol, e, backoff)
+            log.warning("WS error (%s): %s | reconnect in %.1fs", label, e, backoff)
+            WS_RECONNECTS.labels(label).inc()
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2.0, 30.0)
 
+async def run_symbol(cfg: Config, pub: StreamPublisher, symbol: str, normalize=normalize_binance_trade) -> None:
+    skey = stream_key(cfg, symbol)
+
+    async def on_message(raw) -> None:
+        try:
+            msg = json_loads(raw)
+            event = normalize(msg, symbol)
+        except MALFORMED_ERRORS as e:
+            skip_malformed(raw, e)
+            return
+        await pub.publish(skey, event, msg.get("E"))
+
+    await run_ws(symbol_url(cfg.ws_base_url, symbol), symbol, on_message)
+
+async def run_combined(cfg: Config, pub: StreamPublisher, symbols: list[str], normalize=normalize_binance_trade,
+                       conn: int = 0) -> None:
+    '''
+    One websocket for many symbols via Binance's combined stream endpoint.
+    Messages arrive wrapped as {"stream": "<symbol>@aggTrade", "data": {...}}.
+    `conn` is the connection's index in split_symbols(), its label in logs and metrics.
+    '''
+    skeys = {s: stream_key(cfg, s) for s in symbols}
+
+    async def on_message(raw) -> None:
+        try:
+            env = json_loads(raw)
+            symbol = env["stream"].split("@", 1)[0]
+            skey = skeys[symbol]
+            event = normalize(env["data"], symbol)
+        except MALFORMED_ERRORS as e:
+            skip_malformed(raw, e)
+            return
+        await pub.publish(skey, event, env["data"].get("E"))
+
+    await run_ws(combined_url(cfg.ws_base_url, symbols), str(conn), on_message)
+
 async def main() -> None:
     cfg = Config()
     setup_logging(cfg)
     r = redis_client(cfg)
 
-    tasks = [
-        asyncio.create_task(
-            run_symbol(cfg, r, s)) for s in cfg.symbols
-            ]
+    pub = StreamPublisher(
+        r, cfg.stream_maxlen,
+        queue_size=cfg.producer_queue_size,
+        batch_size=cfg.producer_batch_size,
+        linger_ms=cfg.producer_linger_ms,
+        drop_when_full=cfg.producer_queue_policy == "drop",
+        max_attempts=cfg.producer_xadd_attempts,
+    )
+    normalize = normalizer(cfg)
+
+    metrics.gauge("producer_queue_depth", "Events waiting for the XADD writer", fn=pub.queue.qsize)
+    metrics.serve(cfg.metrics_port)
+
+    tasks = [asyncio.create_task(pub.run()), asyncio.create_task(pub.log_stats())]
+    if cfg.ws_combined:
+        tasks += [
+            asyncio.create_task(run_combined(cfg, pub, group, normalize, conn))
+            for conn, group in enumerate(split_symbols(cfg.symbols, cfg.ws_connections))
+        ]
+    else:
+        tasks += [
+            asyncio.create_task(
+                run_symbol(cfg, pub, s, normalize)) for s in cfg.symbols
+                ]
     await asyncio.gather(*tasks)
 
 if __name__ == "__main__":
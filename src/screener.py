@@ -0,0 +1,273 @@
+'''
+Cross-symbol market screener.
+
+  python -m src.screener
+
+Keeps the last SCREENER_WINDOW closes and volumes of every configured symbol
+in two aligned symbol x bucket NumPy matrices, and on every bucket boundary
+computes indicators and flags for all symbols at once:
+
+  ret_1, ret_12          returns over the last 1 and 12 candles
+  rsi14                  Wilder RSI (same math as src/indicators.py)
+  macd_hist, macd_cross  +1 / -1 when the MACD histogram changed sign on the last candle
+  bb_pos, bb_break       position in the Bollinger band (0 lower .. 1 upper), +1 / -1 outside it
+  vol_z                  last volume as a z-score against the previous VOLUME_BARS candles
+
+The recursive indicators (EMA, RSI) loop over the window's columns, not over
+symbols, so a pass grows slowly with the symbol count: about 25ms on one
+core for 500 symbols x 300 candles, 0.5% of a 5s candle and ~60x faster than
+the pandas functions symbol by symbol (benchmarks/bench_screener.py). With a 300-candle window the truncated EMA
+history is below float precision, so values match the consumer's engines.
+
+Candles come from UPDATES_STREAM (one XREAD loop for all symbols; it works
+unchanged with SHARDING), where the consumer pushes every closed candle, also
+before its indicators are warm and when several close in one coalesced job;
+seeded from SQLite on startup with one query. A
+symbol without a candle in a bucket is forward-filled and marked stale.
+The result is one hash, screener (screener:{tf} with SCREENER_TF):
+
+  t_start_ms, updated_ms, compute_ms, symbols
+  rows     JSON list, one object per symbol
+  ranks    JSON {gainers, losers, volume, oversold, overbought}: top symbols of each
+'''
+import json
+import time
+import logging
+from typing import Optional
+
+import numpy as np
+import redis
+
+from src import metrics
+from src.common import Config, setup_logging, now_ms, jdump, rollup_frames
+from src.storage import connect
+
+log = logging.getLogger("screener")
+
+RETURN_BARS = (1, 12)
+VOLUME_BARS = 20
+RSI_N, BB_N, BB_K = 14, 20, 2.0
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+TOP_N = 10
+# wait this long after a bucket's finalize deadline for its candles to come in
+SETTLE_MS = 1000
+
+COMPUTE_SECONDS = metrics.histogram("screener_compute_seconds", "One screener pass over all symbols")
+
+def _ffill(x: np.ndarray) -> np.ndarray:
+    # forward-fill NaNs along the time axis; leading NaNs stay
+    idx = np.where(np.isnan(x), 0, np.arange(x.shape[1]))
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return x[np.arange(x.shape[0])[:, None], idx]
+
+def _ema_step(v: np.ndarray, x: np.ndarray, alpha: float) -> np.ndarray:
+    # one ewm(adjust=False) step per row, seeded with the first non-NaN value
+    return np.where(np.isnan(v), x, np.where(np.isnan(x), v, v + alpha * (x - v)))
+
+class Screener:
+    def __init__(self, symbols, bucket_ms: int, window: int = 300):
+        self.symbols = list(symbols)
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.bucket_ms = bucket_ms
+        self.window = window
+        self.close = np.full((len(self.symbols), window), np.nan)
+        self.volume = np.full((len(self.symbols), window), np.nan)
+        self.last_start: Optional[int] = None  # t_start_ms of the newest column
+
+    def _shift(self, t_start_ms: int) -> None:
+        # slide the window so the newest column is t_start_ms
+        k = (t_start_ms - self.last_start) // self.bucket_ms if self.last_start is not None else self.window
+        k = min(k, self.window)
+        if k > 0:
+            for m in (self.close, self.volume):
+                m[:, :-k] = m[:, k:]
+                m[:, -k:] = np.nan
+        self.last_start = t_start_ms
+
+    def add(self, symbol: str, t_start_ms: int, close: float, volume: float) -> bool:
+        # file one closed candle; False if the symbol is unknown or older than the window
+        i = self.index.get(symbol)
+        if i is None:
+            return False
+        if self.last_start is None or t_start_ms > self.last_start:
+            self._shift(t_start_ms)
+        col = self.window - 1 - (self.last_start - t_start_ms) // self.bucket_ms
+        if col < 0:
+            return False
+        self.close[i, col], self.volume[i, col] = close, volume
+        return True
+
+    def compute(self, t_start_ms: Optional[int] = None) -> dict:
+        '''
+        One vectorized pass over all symbols, as of the bucket starting at
+        t_start_ms (default: the newest column). Returns column -> array.
+        '''
+        if t_start_ms is not None and (self.last_start is None or t_start_ms > self.last_start):
+            self._shift(t_start_ms)
+        stale = np.isnan(self.close[:, -1])
+        c = _ffill(self.close)
+        n = len(self.symbols)
+        out = {"close": c[:, -1], "stale": stale}
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for bars in RETURN_BARS:
+                out[f"ret_{bars}"] = c[:, -1] / c[:, -1 - bars] - 1.0 if bars < self.window else np.full(n, np.nan)
+
+            # RSI and MACD: recursive, so step through the columns with all symbols at once
+            gain = loss = fast = slow = signal = np.full(n, np.nan)
+            hist_prev = hist = np.full(n, np.nan)
+            for t in range(self.window):
+                x = c[:, t]
+                if t:
+                    delta = x - c[:, t - 1]
+                    gain = _ema_step(gain, np.maximum(delta, 0.0), 1.0 / RSI_N)
+                    loss = _ema_step(loss, np.maximum(-delta, 0.0), 1.0 / RSI_N)
+                fast = _ema_step(fast, x, 2.0 / (MACD_FAST + 1))
+                slow = _ema_step(slow, x, 2.0 / (MACD_SLOW + 1))
+                m = fast - slow
+                signal = _ema_step(signal, m, 2.0 / (MACD_SIGNAL + 1))
+                hist_prev, hist = hist, m - signal
+            rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+            rsi = np.where(loss == 0, 100.0, rsi)
+            out["rsi14"] = np.where(gain == 0, 0.0, rsi)
+            out["macd_hist"] = hist
+            out["macd_cross"] = np.where((hist_prev <= 0) & (hist > 0), 1, np.where((hist_prev >= 0) & (hist < 0), -1, 0))
+
+            # Bollinger over the last BB_N closes (NaN until the window is full, like rolling())
+            w = c[:, -BB_N:]
+            mid, std = w.mean(axis=1), w.std(axis=1, ddof=1)
+            lower, upper = mid - BB_K * std, mid + BB_K * std
+            out["bb_pos"] = (c[:, -1] - lower) / (upper - lower)
+            out["bb_break"] = np.where(c[:, -1] > upper, 1, np.where(c[:, -1] < lower, -1, 0))
+
+            # buckets without a candle had no volume
+            v = np.nan_to_num(self.volume[:, -VOLUME_BARS - 1:])
+            prior = v[:, :-1]
+            sd = prior.std(axis=1, ddof=1)
+            out["vol_z"] = np.where(sd > 0, (v[:, -1] - prior.mean(axis=1)) / sd, np.nan)
+        return out
+
+    def ranks(self, res: dict, top: int = TOP_N) -> dict[str, list[str]]:
+        # NaNs sort last in both directions
+        def order(x: np.ndarray, desc: bool) -> list[str]:
+            idx = np.argsort(-x if desc else x, kind="stable")[:top]
+            return [self.symbols[i] for i in idx if not np.isnan(x[i])]
+        return {
+            "gainers": order(res["ret_1"], True),
+            "losers": order(res["ret_1"], False),
+            "volume": order(res["vol_z"], True),
+            "oversold": order(res["rsi14"], False),
+            "overbought": order(res["rsi14"], True),
+        }
+
+    def rows(self, res: dict) -> list[dict]:
+        # one JSON-safe dict per symbol (NaN -> None)
+        cols = {k: v.tolist() for k, v in res.items()}
+        out = []
+        for i, s in enumerate(self.symbols):
+            row = {"symbol": s}
+            for k, v in cols.items():
+                row[k] = None if isinstance(v[i], float) and v[i] != v[i] else v[i]
+            out.append(row)
+        return out
+
+def screener_key(tf: str = "") -> str:
+    return f"screener:{tf}" if tf else "screener"
+
+def run_once(r: redis.Redis, scr: Screener, key: str, t_start_ms: int) -> dict:
+    t0 = time.perf_counter()
+    res = scr.compute(t_start_ms)
+    rows, ranks = scr.rows(res), scr.ranks(res)
+    compute_ms = (time.perf_counter() - t0) * 1000
+    COMPUTE_SECONDS.observe(compute_ms / 1000)
+    r.hset(key, mapping={
+        "t_start_ms": t_start_ms,
+        "updated_ms": now_ms(),
+        "compute_ms": round(compute_ms, 3),
+        "symbols": len(rows),
+        "rows": jdump(rows),
+        "ranks": jdump(ranks),
+    })
+    return {"compute_ms": compute_ms, "ranks": ranks}
+
+def seed(cfg: Config, scr: Screener, tf: str = "", before_ms: Optional[int] = None) -> int:
+    # the window's candles for every symbol from SQLite, one query
+    before_ms = now_ms() if before_ms is None else before_ms
+    since = before_ms - scr.window * scr.bucket_ms
+    marks = ",".join("?" * len(scr.symbols))
+    if tf:
+        sql = f"SELECT symbol, t_start_ms, close, volume FROM candles_tf WHERE symbol IN ({marks}) AND tf=? AND t_start_ms>=? ORDER BY t_start_ms"
+        params = (*scr.symbols, tf, since)
+    else:
+        sql = f"SELECT symbol, t_start_ms, close, volume FROM candles WHERE symbol IN ({marks}) AND t_start_ms>=? ORDER BY t_start_ms"
+        params = (*scr.symbols, since)
+    con = connect(cfg.sqlite_path)
+    try:
+        rows = con.execute(sql, params).fetchall()
+    finally:
+        con.close()
+    for symbol, t, close, volume in rows:
+        scr.add(symbol, t, close, volume)
+    return len(rows)
+
+def wanted(key: str, tf: str) -> Optional[str]:
+    # update key -> symbol if it is a closed candle of the screened timeframe
+    symbol, _, rest = key.partition(":")
+    return symbol if rest == tf else None
+
+def ingest(scr: Screener, tf: str, msg_id: str, fields: dict) -> bool:
+    # file one updates entry; a bad one (no key/data, bad JSON, no close/volume) is
+    # skipped, not allowed to end the loop and with it the screener
+    try:
+        symbol = wanted(fields["key"], tf)
+        if symbol is None:
+            return False
+        d = json.loads(fields["data"])
+        return scr.add(symbol, int(d["t_start_ms"]), float(d["close"]), float(d["volume"]))
+    except Exception:
+        log.exception("Skipping update %s: %r", msg_id, fields)
+        return False
+
+def main() -> None:
+    cfg = Config()
+    setup_logging(cfg)
+    if not cfg.updates_stream:
+        raise SystemExit("UPDATES_STREAM must be set: the screener reads closed candles from it")
+    tf = cfg.screener_tf
+    frames = rollup_frames(cfg)
+    if tf and tf not in frames:
+        raise SystemExit(f"SCREENER_TF={tf} is not one of the rolled-up TIMEFRAMES ({', '.join(frames)})")
+    bucket_ms = frames[tf] if tf else cfg.candle_sec * 1000
+    r = redis.Redis(host=cfg.redis_host, port=cfg.redis_port, password=cfg.redis_password or None, decode_responses=True)
+    scr = Screener(cfg.symbols, bucket_ms, cfg.screener_window)
+    key = screener_key(tf)
+    metrics.serve(cfg.metrics_port)
+
+    # tail from here on; anything closed while seeding is read again (same column, same value)
+    last = r.xrevrange(cfg.updates_stream, count=1)
+    last_id = last[0][0] if last else "0-0"
+    n = seed(cfg, scr, tf)
+    log.info("Screening %d symbols on %s candles, seeded with %d stored candles", len(scr.symbols), tf or f"{cfg.candle_sec}s", n)
+
+    # a bucket is screened once its candles are final (end + grace) and have had time to arrive
+    delay = cfg.finalize_grace_ms + SETTLE_MS
+    next_bucket = (now_ms() - delay) // bucket_ms * bucket_ms
+    while True:
+        try:
+            wait = next_bucket + bucket_ms + delay - now_ms()
+            if wait <= 0:
+                res = run_once(r, scr, key, next_bucket)
+                log.debug("Screened bucket %d in %.1fms", next_bucket, res["compute_ms"])
+                next_bucket = max(next_bucket + bucket_ms, (now_ms() - delay) // bucket_ms * bucket_ms - bucket_ms)
+                continue
+            resp = r.xread({cfg.updates_stream: last_id}, count=1000, block=max(1, min(wait, 5000)))
+            for _, msgs in resp or []:
+                for msg_id, f in msgs:
+                    last_id = msg_id
+                    ingest(scr, tf, msg_id, f)
+        except redis.RedisError as e:
+            log.warning("Screener loop error: %s", e)
+            time.sleep(1.0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+'''
+Symbol -> worker assignment for running several consumers in one group.
+
+Every worker heartbeats into a registry (sorted set, score = last beat ms).
+Each symbol is owned by the live worker with the highest rendezvous hash
+for it (consistent hashing: a join/leave only moves that worker's share).
+On top of the computed assignment, a worker must hold a per-symbol lease
+(SET NX PX) before reading that symbol's stream, so two workers never read
+the same stream even while their registry views briefly disagree. Leases
+are renewed and released with compare-and-set scripts: a worker that
+stalled past its TTL finds its lease gone (or someone else's) and drops the
+symbol instead of extending or deleting the new owner's lease.
+'''
+import json
+import hashlib
+import logging
+from typing import Callable, Iterable, Optional
+
+import redis
+
+from src.common import now_ms, jdump
+
+log = logging.getLogger("sharding")
+
+# KEYS[1] lease, ARGV[1] worker, ARGV[2] ttl ms: extend the lease only if it is still ours
+RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1] lease, KEYS[2] handoff, ARGV[1] worker, ARGV[2] state ('' for none), ARGV[3] handoff ttl ms:
+# write the handoff and drop the lease only if it is still ours, in one step
+RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] ~= '' then
+    redis.call('set', KEYS[2], ARGV[2], 'PX', ARGV[3])
+end
+return redis.call('del', KEYS[1])
+"""
+
+def _score(worker: str, symbol: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{worker}|{symbol}".encode(), digest_size=8).digest(), "big")
+
+def owner(symbol: str, workers: Iterable[str]) -> Optional[str]:
+    # rendezvous (highest random weight) hashing
+    return max(workers, key=lambda w: _score(w, symbol), default=None)
+
+def assign(symbols: Iterable[str], workers: Iterable[str]) -> dict[str, list[str]]:
+    workers = list(workers)
+    out = {w: [] for w in workers}
+    for s in symbols:
+        w = owner(s, workers)
+        if w is not None:
+            out[w].append(s)
+    return out
+
+class ShardCoordinator:
+    def __init__(self, r: redis.Redis, namespace: str, worker: str, symbols: Iterable[str], ttl_ms: int):
+        self.r = r
+        self.worker = worker
+        self.symbols = list(symbols)
+        self.ttl_ms = ttl_ms
+        self.registry_key = f"{namespace}:workers"
+        self.ns = namespace
+        self.owned: set[str] = set()
+        self._renew = r.register_script(RENEW_LEASE)
+        self._release_lease = r.register_script(RELEASE_LEASE)
+
+    def lease_key(self, symbol: str) -> str:
+        return f"{self.ns}:owner:{symbol}"
+
+    def handoff_key(self, symbol: str) -> str:
+        return f"{self.ns}:handoff:{symbol}"
+
+    def live_workers(self, now: int) -> list[str]:
+        self.r.zremrangebyscore(self.registry_key, "-inf", now - self.ttl_ms)
+        return list(self.r.zrange(self.registry_key, 0, -1))
+
+    def rebalance(self, on_release: Callable[[str], Optional[dict]], on_acquire: Callable[[str, Optional[dict]], None],
+                  on_lost: Optional[Callable[[str], None]] = None) -> bool:
+        '''
+        Heartbeat, renew our leases, recompute the assignment, and move leases.
+        on_release(symbol) may return state (e.g. the open candle) to hand to the
+        next owner; on_acquire(symbol, state) receives it. A symbol whose lease
+        could not be renewed (it expired, maybe already taken over) is dropped
+        with on_lost(symbol): no handoff, its state belongs to the new owner.
+        Returns True if the owned set changed.
+        '''
+        now = now_ms()
+        self.r.zadd(self.registry_key, {self.worker: now})
+        changed = self._drop_lost(on_lost)
+        workers = self.live_workers(now)
+        desired = {s for s in self.symbols if owner(s, workers) == self.worker}
+
+        for s in sorted(self.owned - desired):
+            self._release(s, on_release(s))
+            self.owned.discard(s)
+            changed = True
+
+        for s in sorted(desired - self.owned):
+            if self.r.set(self.lease_key(s), self.worker, nx=True, px=self.ttl_ms):
+                state = self._take_handoff(s)
+                self.owned.add(s)
+                on_acquire(s, state)
+                changed = True
+
+        if changed:
+            log.info("Worker %s owns %d/%d symbols (%d live workers)", self.worker, len(self.owned), len(self.symbols), len(workers))
+        return changed
+
+    def leave(self, on_release: Callable[[str], Optional[dict]], on_lost: Optional[Callable[[str], None]] = None) -> None:
+        # clean shutdown: hand everything still ours off and drop out of the registry
+        self._drop_lost(on_lost)
+        for s in sorted(self.owned):
+            self._release(s, on_release(s))
+        self.owned.clear()
+        self.r.zrem(self.registry_key, self.worker)
+
+    def _drop_lost(self, on_lost: Optional[Callable[[str], None]]) -> bool:
+        lost = [s for s in sorted(self.owned) if not self._renew(keys=[self.lease_key(s)], args=[self.worker, self.ttl_ms])]
+        for s in lost:
+            log.warning("Worker %s lost the lease on %s, dropping it", self.worker, s)
+            self.owned.discard(s)
+            if on_lost is not None:
+                on_lost(s)
+        return bool(lost)
+
+    def _release(self, symbol: str, state: Optional[dict]) -> None:
+        # handoff and lease delete in one script: the handoff is visible before the lease is free,
+        # and neither happens if the lease is no longer ours
+        self._release_lease(keys=[self.lease_key(symbol), self.handoff_key(symbol)],
+                            args=[self.worker, jdump(state) if state is not None else "", self.ttl_ms * 6])
+
+    def _take_handoff(self, symbol: str) -> Optional[dict]:
+        raw = self.r.get(self.handoff_key(symbol))
+        if raw is None:
+            return None
+        self.r.delete(self.handoff_key(symbol))
+        return json.loads(raw)
@@ -0,0 +1,316 @@
+'''
+Local Binance-compatible aggTrade websocket server, for load and soak tests.
+
+  python -m src.simulator --port 9443 --rate 50
+  python -m src.simulator --replay btcusdt=BTCUSDT-aggTrades-2024-01.csv --binance --speed 10
+  python -m src.simulator --rate 200 --drop-rate 0.01 --stall-rate 0.02 --malformed 0.001
+
+Point the producer at it with WS_BASE_URL=ws://localhost:9443. It serves the
+two endpoints the producer uses, /ws/<symbol>@aggTrade and
+/stream?streams=<a>@aggTrade/<b>@aggTrade (messages wrapped as
+{"stream": ..., "data": ...}), with the exchange's aggTrade fields.
+
+Any symbol can be subscribed. Its trades come from a random walk (Poisson
+arrivals, --rate per symbol and second) or, for symbols given with --replay,
+from recorded trade files (any layout backfill reads) played back at
+--speed x and looped. Event times are rebased onto the wall clock, so
+candles close live downstream.
+
+Each connection generates its trades on a TICK_MS timer and sends all that
+fell due since the last tick, so a connection that stalled or could not
+keep up catches up in a burst with the original event times, as a real feed
+does after a hiccup. Faults, per connection:
+
+  --drop-rate    abrupt disconnects per second (transport aborted, no close frame)
+  --stall-rate   stalls per second, each --stall-ms long
+  --malformed    fraction of frames replaced by a broken one (cut JSON, missing price, non-numeric price)
+'''
+import json
+import zlib
+import random
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import websockets
+
+from src import metrics
+from src.common import Config, setup_logging, now_ms
+from src.backfill import read_chunks, sell_flags, BINANCE_AGGTRADES_COLUMNS, TS_TO_MS, DEFAULT_CHUNK_ROWS
+
+log = logging.getLogger("simulator")
+
+TICK_MS = 10
+
+SENT = metrics.counter("simulator_messages_sent_total", "aggTrade messages sent, malformed ones included")
+CONNECTIONS = metrics.counter("simulator_connections_total", "Websocket connections accepted")
+FAULTS = metrics.counter("simulator_faults_total", "Injected faults", ("fault",))
+
+@dataclass
+class Faults:
+    drop_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall_ms: int = 2000
+    malformed: float = 0.0
+
+def parse_path(path: str) -> tuple[list[str], bool]:
+    # request path -> (symbols, combined); ValueError for anything but aggTrade streams
+    url = urlsplit(path)
+    if url.path.startswith("/ws/"):
+        names, combined = [url.path[len("/ws/"):]], False
+    elif url.path.rstrip("/") == "/stream":
+        names, combined = parse_qs(url.query).get("streams", [""])[0].split("/"), True
+    else:
+        raise ValueError(f"unknown endpoint {url.path!r}")
+    symbols = []
+    for name in names:
+        symbol, _, kind = name.partition("@")
+        if not symbol or kind != "aggTrade":
+            raise ValueError(f"unsupported stream {name!r}")
+        symbols.append(symbol.lower())
+    return symbols, combined
+
+def agg_trade(symbol: str, trade_id: int, ts: int, price: float, qty: float, sell: bool) -> dict:
+    return {
+        "e": "aggTrade", "E": ts, "s": symbol.upper(), "a": trade_id,
+        "p": f"{price:.8f}", "q": f"{qty:.8f}", "f": trade_id, "l": trade_id,
+        "T": ts, "m": sell, "M": True,
+    }
+
+class RandomWalk:
+    '''
+    Poisson trade arrivals at `rate` per second with a log-normal random-walk
+    price. due(now) returns the trades in (last call, now] as
+    (ts, price, qty, sell) tuples, in time order.
+    '''
+    def __init__(self, rate: float, start_ms: int, price: float = 100.0, vol: float = 1e-4,
+                 seed: Optional[int] = None):
+        self.rate = rate
+        self.until = start_ms
+        self.price = price
+        self.vol = vol
+        self.rng = np.random.default_rng(seed)
+
+    def due(self, now: int) -> list[tuple]:
+        span = now - self.until
+        if span <= 0:
+            return []
+        n = self.rng.poisson(self.rate * span / 1000)
+        ts = np.sort(self.rng.integers(self.until + 1, now + 1, n))
+        px = self.price * np.exp(np.cumsum(self.rng.normal(0.0, self.vol, n)))
+        qty = self.rng.exponential(0.1, n)
+        sell = self.rng.random(n) < 0.5
+        self.until = now
+        if n:
+            self.price = float(px[-1])
+        return list(zip(ts.tolist(), px.tolist(), qty.tolist(), sell.tolist()))
+
+class Replay:
+    '''
+    Recorded trades played back at `speed` x from start_ms on. chunks() yields
+    (ts_ms, price, qty, sell) arrays in time order; it is called again for
+    every pass, which starts where the previous one ended.
+    '''
+    def __init__(self, chunks: Callable[[], Iterator[tuple]], start_ms: int, speed: float = 1.0):
+        self.chunks = chunks
+        self.speed = speed
+        self.start = start_ms
+        self.it = iter(chunks())
+        self.t0 = None  # recorded time of the pass's first trade
+        self.end = start_ms
+        self.buf = None
+        self.i = 0
+
+    def _next_chunk(self) -> None:
+        for _ in range(2):
+            for ts, price, qty, sell in self.it:
+                if len(ts):
+                    if self.t0 is None:
+                        self.t0 = int(ts[0])
+                    at = self.start + (np.asarray(ts, np.int64) - self.t0) / self.speed
+                    self.buf, self.i = (at.astype(np.int64), np.asarray(price, np.float64),
+                                        np.asarray(qty, np.float64), np.asarray(sell, bool)), 0
+                    return
+            # end of the recording: loop, one ms after the last trade of this pass
+            self.it, self.t0, self.start = iter(self.chunks()), None, self.end + 1
+        raise ValueError("replay has no trades")
+
+    def due(self, now: int) -> list[tuple]:
+        out = []
+        while True:
+            if self.buf is None or self.i == len(self.buf[0]):
+                self._next_chunk()
+            at, price, qty, sell = self.buf
+            j = int(np.searchsorted(at, now, side="right"))
+            if j > self.i:
+                out.extend(zip(at[self.i:j].tolist(), price[self.i:j].tolist(),
+                               qty[self.i:j].tolist(), sell[self.i:j].tolist()))
+                self.end = int(at[j - 1])
+                self.i = j
+            if j < len(at):
+                return out
+
+def replay_chunks(paths: list[str], ts_col: str = "ts_ms", price_col: str = "price", qty_col: str = "qty",
+                  side_col: Optional[str] = None, ts_unit: str = "ms", names: Optional[list] = None,
+                  chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Iterator[tuple]:
+    # trade files (backfill's readers) -> (ts_ms, price, qty, sell) arrays
+    mul, div = TS_TO_MS[ts_unit]
+    for path in paths:
+        for df in read_chunks(path, ts_col, price_col, qty_col, chunk_rows, names, side_col):
+            ts = df["ts"].to_numpy(np.int64) * mul // div
+            sell = sell_flags(df["side"]) if side_col else np.zeros(len(df), bool)
+            yield ts, df["price"].to_numpy(np.float64), df["qty"].to_numpy(np.float64), sell
+
+def start_price(symbol: str) -> float:
+    # stable per symbol, so restarts and parallel connections quote similar prices
+    return 10.0 + zlib.crc32(symbol.encode()) % 1000
+
+class Simulator:
+    '''
+    Serves one generator per subscribed symbol and connection. `source(symbol,
+    start_ms)` makes the generator (anything with due(now)); the default is a
+    RandomWalk at `rate`.
+    '''
+    def __init__(self, rate: float = 10.0, faults: Optional[Faults] = None, tick_ms: int = TICK_MS,
+                 source: Optional[Callable[[str, int], object]] = None, seed: Optional[int] = None):
+        self.rate = rate
+        self.faults = faults or Faults()
+        self.tick_ms = tick_ms
+        self.source = source or self.random_walk
+        self.rng = random.Random(seed)
+        self.open = 0
+        self.stats = {"connections": 0, "sent": 0, "drops": 0, "stalls": 0, "malformed": 0}
+
+    def random_walk(self, symbol: str, start_ms: int) -> RandomWalk:
+        return RandomWalk(self.rate, start_ms, start_price(symbol), seed=self.rng.getrandbits(32))
+
+    def _malformed(self, frame: str, msg: dict, wrap) -> str:
+        kind = self.rng.randrange(3)
+        if kind == 0:
+            return frame[: len(frame) // 2]
+        bad = dict(msg)
+        if kind == 1:
+            del bad["p"]
+        else:
+            bad["p"] = "n/a"
+        return json.dumps(wrap(bad))
+
+    async def handler(self, ws) -> None:
+        path = getattr(ws, "path", None) or ws.request.path
+        try:
+            symbols, combined = parse_path(path)
+        except ValueError as e:
+            await ws.close(1008, str(e))
+            return
+        start = now_ms()
+        sources = {s: self.source(s, start) for s in symbols}
+        ids = dict.fromkeys(symbols, 0)
+        faults, dt = self.faults, self.tick_ms / 1000
+        self.open += 1
+        self.stats["connections"] += 1
+        CONNECTIONS.inc()
+        log.info("Client %s subscribed to %d symbols", ws.remote_address, len(symbols))
+        try:
+            while True:
+                await asyncio.sleep(dt)
+                if faults.drop_rate and self.rng.random() < faults.drop_rate * dt:
+                    self.stats["drops"] += 1
+                    FAULTS.labels("drop").inc()
+                    ws.transport.abort()
+                    await ws.wait_closed()
+                    return
+                if faults.stall_rate and self.rng.random() < faults.stall_rate * dt:
+                    self.stats["stalls"] += 1
+                    FAULTS.labels("stall").inc()
+                    await asyncio.sleep(faults.stall_ms / 1000)
+                now = now_ms()
+                for symbol, src in sources.items():
+                    if combined:
+                        stream = f"{symbol}@aggTrade"
+                        wrap = lambda m, stream=stream: {"stream": stream, "data": m}
+                    else:
+                        wrap = lambda m: m
+                    for ts, price, qty, sell in src.due(now):
+                        ids[symbol] += 1
+                        msg = agg_trade(symbol, ids[symbol], ts, price, qty, sell)
+                        frame = json.dumps(wrap(msg))
+                        if faults.malformed and self.rng.random() < faults.malformed:
+                            frame = self._malformed(frame, msg, wrap)
+                            self.stats["malformed"] += 1
+                            FAULTS.labels("malformed").inc()
+                        await ws.send(frame)
+                        self.stats["sent"] += 1
+                        SENT.inc()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.open -= 1
+
+async def serve(sim: Simulator, host: str = "0.0.0.0", port: int = 9443,
+                ready: Optional[Callable[[int], None]] = None) -> None:
+    # run until cancelled; ready(port) once listening (port=0 picks a free one)
+    async with websockets.serve(sim.handler, host, port, compression=None, max_queue=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        log.info("Simulator on ws://%s:%d (WS_BASE_URL)", host, port)
+        if ready is not None:
+            ready(port)
+        await asyncio.Future()
+
+def main() -> None:
+    cfg = Config()
+    ap = argparse.ArgumentParser(prog="python -m src.simulator", description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--host", default="0.0.0.0")
+    ap.add_argument("--port", type=int, default=9443)
+    ap.add_argument("--rate", type=float, default=10.0, help="random-walk trades per second and symbol")
+    ap.add_argument("--tick-ms", type=int, default=TICK_MS)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--replay", action="append", default=[], metavar="SYMBOL=PATH",
+                    help="replay a trade file for SYMBOL (repeat, in time order, for more files or symbols)")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    ap.add_argument("--ts-col", default="ts_ms")
+    ap.add_argument("--price-col", default="price")
+    ap.add_argument("--qty-col", default="qty")
+    ap.add_argument("--ts-unit", choices=sorted(TS_TO_MS), default="ms")
+    ap.add_argument("--side-col", default=None, help='taker side column: "buy"/"sell" or buyer-is-maker booleans')
+    ap.add_argument("--binance", action="store_true", help="headerless Binance aggTrades dump layout")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="abrupt disconnects per connection and second")
+    ap.add_argument("--stall-rate", type=float, default=0.0, help="stalls per connection and second")
+    ap.add_argument("--stall-ms", type=int, default=2000)
+    ap.add_argument("--malformed", type=float, default=0.0, help="fraction of frames sent broken")
+    args = ap.parse_args()
+    setup_logging(cfg)
+
+    names = None
+    if args.binance:
+        names = BINANCE_AGGTRADES_COLUMNS
+        args.ts_col, args.price_col, args.qty_col = "transact_time", "price", "quantity"
+        args.side_col = "is_buyer_maker"
+
+    files: dict[str, list[str]] = {}
+    for spec in args.replay:
+        symbol, sep, path = spec.partition("=")
+        if not sep or not path:
+            raise SystemExit(f"--replay expects SYMBOL=PATH, got {spec!r}")
+        files.setdefault(symbol.strip().lower(), []).append(path)
+
+    faults = Faults(args.drop_rate, args.stall_rate, args.stall_ms, args.malformed)
+    sim = Simulator(args.rate, faults, args.tick_ms, seed=args.seed)
+
+    def source(symbol: str, start_ms: int):
+        paths = files.get(symbol)
+        if paths is None:
+            return sim.random_walk(symbol, start_ms)
+        return Replay(lambda: replay_chunks(paths, args.ts_col, args.price_col, args.qty_col,
+                                            args.side_col, args.ts_unit, names), start_ms, args.speed)
+    sim.source = source
+
+    metrics.gauge("simulator_open_connections", "Websocket connections currently open", fn=lambda: sim.open)
+    metrics.serve(cfg.metrics_port)
+    asyncio.run(serve(sim, args.host, args.port))
+
+if __name__ == "__main__":
+    main()
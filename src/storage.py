@@ -1,16 +1,102 @@
+import time
 import sqlite3
 import logging
-from typing import Optional
+import threading
+from typing import Callable, Optional
 
 import redis
 import pandas as pd
 
+from src import metrics
+from src.common import jdump, is_bar
+from src.archive import get_archive, to_frame, BASE_SERIES
+
 log = logging.getLogger("storage")
 
+CLOSE_TO_COMMIT = metrics.histogram("storage_close_to_commit_seconds", "Candle handed to the writer to its SQLite commit")
+COMMIT_SECONDS = metrics.histogram("storage_commit_seconds", "Duration of one group commit")
+ROWS_COMMITTED = metrics.counter("storage_rows_committed_total", "Candle, rollup and bar rows committed to SQLite")
+
+# WAL lets dashboard readers run while the consumer writes; NORMAL sync is
+# durable across app crashes (only an OS crash can lose the last commits).
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+)
+BUSY_TIMEOUT_SEC = 5.0
+
+OHLCV_COLUMNS = ("symbol", "t_start_ms", "t_end_ms", "open", "high", "low", "close", "volume")
+# order flow per candle (see Candle); added to existing databases by init_sqlite
+ORDER_FLOW_COLUMNS = {
+    "quote_volume": "REAL", "buy_volume": "REAL", "sell_volume": "REAL", "trades": "INTEGER", "max_qty": "REAL",
+}
+CANDLE_COLUMNS = OHLCV_COLUMNS + tuple(ORDER_FLOW_COLUMNS)
+
+INSERT_CANDLE_SQL = f"""
+INSERT OR REPLACE INTO candles({','.join(CANDLE_COLUMNS)})
+VALUES({','.join('?' * len(CANDLE_COLUMNS))})
+"""
+
+# higher-timeframe rollups: one table keyed by (symbol, tf, t_start_ms), so a
+# timeframe's series is a single index range scan like the base candles
+ROLLUP_COLUMNS = ("symbol", "tf") + CANDLE_COLUMNS[1:]
+
+INSERT_ROLLUP_SQL = f"""
+INSERT OR REPLACE INTO candles_tf({','.join(ROLLUP_COLUMNS)})
+VALUES({','.join('?' * len(ROLLUP_COLUMNS))})
+"""
+
+# information-driven bars (BARS: tick, volume, dollar), keyed by (symbol, bar, t_start_ms)
+# like the rollups; read through the same functions with tf=<bar label>
+BAR_COLUMNS = ("symbol", "bar") + CANDLE_COLUMNS[1:]
+
+INSERT_BAR_SQL = f"""
+INSERT OR REPLACE INTO bars({','.join(BAR_COLUMNS)})
+VALUES({','.join('?' * len(BAR_COLUMNS))})
+"""
+
+# per-candle indicator values, keyed like the candles (tf "" = base candles, else the timeframe or bar) and
+# written in the same transaction as the candle they belong to; readers join
+# them on the primary key (read_candles(..., indicators=True))
+INDICATOR_COLUMNS = ("sma20", "ema20", "rsi14", "macd", "macd_signal", "macd_hist", "bb_lower", "bb_mid", "bb_upper")
+
+INSERT_INDICATORS_SQL = f"""
+INSERT OR REPLACE INTO indicators(symbol,tf,t_start_ms,{','.join(INDICATOR_COLUMNS)})
+VALUES(?,?,?,{','.join('?' * len(INDICATOR_COLUMNS))})
+"""
+
+def connect(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    return sqlite3.connect(path, timeout=BUSY_TIMEOUT_SEC, check_same_thread=check_same_thread)
+
+def candle_params(row: dict) -> tuple:
+    # rows without order flow (older tools, tests) store zeros
+    return tuple(row[c] for c in OHLCV_COLUMNS) + tuple(row.get(c, 0) for c in ORDER_FLOW_COLUMNS)
+
+def rollup_params(tf: str, row: dict) -> tuple:
+    p = candle_params(row)
+    return (p[0], tf) + p[1:]
+
+def indicator_params(symbol: str, tf: Optional[str], t_start_ms: int, values: dict) -> tuple:
+    # NaN (still warming up) is stored as NULL
+    return (symbol, tf or "", t_start_ms) + tuple(values.get(c) for c in INDICATOR_COLUMNS)
+
+def _order_flow_ddl() -> str:
+    return ",\n            ".join(f"{c} {t} NOT NULL DEFAULT 0" for c, t in ORDER_FLOW_COLUMNS.items())
+
+def _add_order_flow(con: sqlite3.Connection, table: str) -> None:
+    # databases created before order flow: ADD COLUMN only touches the schema, old rows read as 0
+    have = {row[1] for row in con.execute(f"PRAGMA table_info({table})")}
+    for c, t in ORDER_FLOW_COLUMNS.items():
+        if c not in have:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {c} {t} NOT NULL DEFAULT 0")
+
 def init_sqlite(path: str) -> None:
-    con = sqlite3.connect(path)
+    con = connect(path)
     try:
-        con.execute("""
+        # journal_mode is persistent, so readers opened elsewhere get WAL too
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute(f"""
         CREATE TABLE IF NOT EXISTS candles (
             symbol TEXT NOT NULL,
             t_start_ms INTEGER NOT NULL,
@@ -20,44 +106,356 @@ def init_sqlite(path: str) -> None:
             low REAL NOT NULL,
             close REAL NOT NULL,
             volume REAL NOT NULL,
+            {_order_flow_ddl()},
             PRIMARY KEY(symbol, t_start_ms)
         );
         """)
+        con.execute(f"""
+        CREATE TABLE IF NOT EXISTS candles_tf (
+            symbol TEXT NOT NULL,
+            tf TEXT NOT NULL,
+            t_start_ms INTEGER NOT NULL,
+            t_end_ms INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            {_order_flow_ddl()},
+            PRIMARY KEY(symbol, tf, t_start_ms)
+        );
+        """)
+        con.execute(f"""
+        CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL,
+            bar TEXT NOT NULL,
+            t_start_ms INTEGER NOT NULL,
+            t_end_ms INTEGER NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            {_order_flow_ddl()},
+            PRIMARY KEY(symbol, bar, t_start_ms)
+        );
+        """)
+        con.execute(f"""
+        CREATE TABLE IF NOT EXISTS indicators (
+            symbol TEXT NOT NULL,
+            tf TEXT NOT NULL,
+            t_start_ms INTEGER NOT NULL,
+            {",".join(f"{c} REAL" for c in INDICATOR_COLUMNS)},
+            PRIMARY KEY(symbol, tf, t_start_ms)
+        );
+        """)
+        for table in ("candles", "candles_tf"):
+            _add_order_flow(con, table)
         con.commit()
     finally:
         con.close()
 
 def insert_candle(path: str, row: dict) -> None:
-    con = sqlite3.connect(path)
+    con = connect(path)
     try:
-        con.execute("""
-        INSERT OR REPLACE INTO candles(symbol,t_start_ms,t_end_ms,open,high,low,close,volume)
-        VALUES(?,?,?,?,?,?,?,?)
-        """, (
-            row["symbol"], row["t_start_ms"], row["t_end_ms"],
-            row["open"], row["high"], row["low"], row["close"], row["volume"]
-        ))
+        con.execute(INSERT_CANDLE_SQL, candle_params(row))
         con.commit()
     finally:
         con.close()
 
-def read_candles(path: str, symbol: str, limit: int = 500) -> pd.DataFrame:
-    con = sqlite3.connect(path)
+class CandleWriter:
+    '''
+    Long-lived candle writer: one connection, WAL, and group commit.
+    Finalized candles (and rollups and bars), with their indicator values, are buffered and
+    written with a single executemany transaction once `batch_size` rows are pending
+    or `flush_ms` has passed, so N symbols closing on the same bucket boundary cost
+    one commit, and a candle is never visible without its indicators.
+    The indicator dicts passed to add*() may still be empty when they are added:
+    the consumer's pool fills them in, and `wait` (its drain) runs before each
+    commit. A dict that stays empty (the engine had already seen the candle)
+    writes no indicator row.
+    Call close() (or use it as a context manager) to flush on shutdown.
+    '''
+    def __init__(self, path: str, batch_size: int = 500, flush_ms: int = 1000,
+                 wait: Optional[Callable[[], object]] = None):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self.wait = wait
+        self.con = connect(path)
+        for pragma in SQLITE_PRAGMAS:
+            self.con.execute(pragma)
+        self.pending: list[tuple] = []
+        self.pending_tf: list[tuple] = []
+        self.pending_bar: list[tuple] = []
+        self.pending_ind: list[tuple] = []
+        # (symbol, tf, t_start_ms, values) from add*(), made into rows at commit time
+        self.pending_vals: list[tuple] = []
+        # monotonic time each live row was added (not add_many), for CLOSE_TO_COMMIT
+        self.added_at: list[float] = []
+        self._last_flush = time.monotonic()
+
+    def add(self, row: dict, indicators: Optional[dict] = None) -> None:
+        self.pending.append(candle_params(row))
+        if indicators is not None:
+            self.pending_vals.append((row["symbol"], None, row["t_start_ms"], indicators))
+        self.added_at.append(time.monotonic())
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, params: list[tuple]) -> None:
+        # bulk path: rows already as tuples in CANDLE_COLUMNS order
+        self.pending.extend(params)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def add_rollup(self, tf: str, row: dict, indicators: Optional[dict] = None) -> None:
+        self.pending_tf.append(rollup_params(tf, row))
+        if indicators is not None:
+            self.pending_vals.append((row["symbol"], tf, row["t_start_ms"], indicators))
+        self.added_at.append(time.monotonic())
+        if len(self.pending) + len(self.pending_tf) + len(self.pending_bar) >= self.batch_size:
+            self.flush()
+
+    def add_bar(self, bar: str, row: dict, indicators: Optional[dict] = None) -> None:
+        self.pending_bar.append(rollup_params(bar, row))
+        if indicators is not None:
+            self.pending_vals.append((row["symbol"], bar, row["t_start_ms"], indicators))
+        self.added_at.append(time.monotonic())
+        if len(self.pending) + len(self.pending_tf) + len(self.pending_bar) >= self.batch_size:
+            self.flush()
+
+    def add_indicators_many(self, params: list[tuple]) -> None:
+        # bulk path: rows already as indicator_params() tuples
+        self.pending_ind.extend(params)
+        if len(self.pending_ind) >= self.batch_size:
+            self.flush()
+
+    def maybe_flush(self) -> int:
+        # time-based flush; call this from the consumer loop even when idle
+        if (self.pending or self.pending_tf or self.pending_bar or self.pending_ind) and (time.monotonic() - self._last_flush) * 1000 >= self.flush_ms:
+            return self.flush()
+        return 0
+
+    def flush(self) -> int:
+        n = len(self.pending) + len(self.pending_tf) + len(self.pending_bar)
+        if self.pending_vals:
+            if self.wait is not None:
+                self.wait()
+            self.pending_ind.extend(indicator_params(*p) for p in self.pending_vals if p[3])
+            self.pending_vals = []
+        if n or self.pending_ind:
+            t0 = time.monotonic()
+            with self.con:  # one transaction -> one fsync
+                self.con.executemany(INSERT_CANDLE_SQL, self.pending)
+                self.con.executemany(INSERT_ROLLUP_SQL, self.pending_tf)
+                self.con.executemany(INSERT_BAR_SQL, self.pending_bar)
+                self.con.executemany(INSERT_INDICATORS_SQL, self.pending_ind)
+            t1 = time.monotonic()
+            COMMIT_SECONDS.observe(t1 - t0)
+            ROWS_COMMITTED.inc(n)
+            CLOSE_TO_COMMIT.observe_many([t1 - t for t in self.added_at])
+            self.pending = []
+            self.pending_tf = []
+            self.pending_bar = []
+            self.pending_ind = []
+            self.added_at = []
+        self._last_flush = time.monotonic()
+        return n
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.con.close()
+
+    def __enter__(self) -> "CandleWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _series_table(tf: str) -> tuple[str, str]:
+    # (table, label column) holding a rollup timeframe or a bar series
+    return ("bars", "bar") if is_bar(tf) else ("candles_tf", "tf")
+
+def _select(tf: Optional[str], indicators: bool) -> tuple[str, str, list]:
+    # (SELECT ... FROM, WHERE, params) for one symbol's series, optionally with its
+    # indicator columns joined on the primary key (one index lookup per row)
+    table, where, params = "candles", "c.symbol=?", []
+    if tf is not None:
+        table, col = _series_table(tf)
+        where, params = f"c.symbol=? AND c.{col}=?", [tf]
+    sql = "SELECT " + ",".join("c." + col for col in CANDLE_COLUMNS)
+    if indicators:
+        on_tf = f"c.{col}" if tf is not None else "''"
+        sql += "," + ",".join("i." + col for col in INDICATOR_COLUMNS)
+        sql += f" FROM {table} c LEFT JOIN indicators i ON i.symbol=c.symbol AND i.tf={on_tf} AND i.t_start_ms=c.t_start_ms"
+    else:
+        sql += f" FROM {table} c"
+    return sql, where, params
+
+def _dtypes(indicators: bool) -> Optional[dict]:
+    # all-NULL indicator columns (warming up) would otherwise come back as object
+    return dict.fromkeys(INDICATOR_COLUMNS, "float64") if indicators else None
+
+def read_candles(path: str, symbol: str, limit: int = 500, tf: Optional[str] = None,
+                 indicators: bool = False) -> pd.DataFrame:
+    # tf=None reads the base candles, otherwise the precomputed rollups for that timeframe (or a bar series);
+    # indicators=True adds the stored indicator columns (NaN where none were stored).
+    # Topped up from the archive tier (src/archive.py) when SQLite holds fewer than `limit`.
+    sql, where, params = _select(tf, indicators)
+    con = connect(path)
     try:
         df = pd.read_sql_query(
-            "SELECT * FROM candles WHERE symbol=? ORDER BY t_start_ms DESC LIMIT ?",
-            con, params=(symbol, limit)
+            f"{sql} WHERE {where} ORDER BY c.t_start_ms DESC LIMIT ?",
+            con, params=(symbol, *params, limit), dtype=_dtypes(indicators)
         )
-        if df.empty:
-            return df
-        df = df.sort_values("t_start_ms")
+    finally:
+        con.close()
+    if len(df) < limit:
+        before = int(df["t_start_ms"].min()) if not df.empty else 2**62
+        older = get_archive(path).tail(symbol, tf or BASE_SERIES, limit - len(df), before)
+        if len(older):
+            df = _with_archived(to_frame(symbol, older), df, indicators)
+    if df.empty:
         return df
+    df = df.sort_values("t_start_ms")
+    return df
+
+def _with_archived(archived: pd.DataFrame, df: pd.DataFrame, indicators: bool) -> pd.DataFrame:
+    # day files carry the indicator columns; keep them only when asked for, like _select.
+    # concat skips an empty SQLite result (pandas warns on empty frames in concat)
+    if not indicators:
+        archived = archived.drop(columns=list(INDICATOR_COLUMNS))
+    return archived if df.empty else pd.concat([archived, df], ignore_index=True)
+
+def read_candle_range(path: str, symbol: str, start_ms: int, end_ms: int,
+                      tf: Optional[str] = None, limit: int = 5000, indicators: bool = False) -> pd.DataFrame:
+    # candles with start_ms <= t_start_ms < end_ms, oldest first (at most `limit`), from both tiers
+    sql, where, params = _select(tf, indicators)
+    con = connect(path)
+    try:
+        df = pd.read_sql_query(
+            f"{sql} WHERE {where} AND c.t_start_ms>=? AND c.t_start_ms<? ORDER BY c.t_start_ms LIMIT ?",
+            con, params=(symbol, *params, start_ms, end_ms, limit), dtype=_dtypes(indicators)
+        )
+    finally:
+        con.close()
+    # older days may live in the archive tier; a day present in both prefers SQLite
+    archived = get_archive(path).read(symbol, tf or BASE_SERIES, start_ms, end_ms)
+    if len(archived):
+        df = _with_archived(to_frame(symbol, archived), df, indicators)
+        df = df.drop_duplicates("t_start_ms", keep="last").sort_values("t_start_ms", kind="stable")
+        df = df.head(limit).reset_index(drop=True)
+    return df
+
+def read_candles_since(path: str, symbol: str, since_ms: int) -> pd.DataFrame:
+    # base candles with t_start_ms >= since_ms, oldest first
+    con = connect(path)
+    try:
+        return pd.read_sql_query(
+            "SELECT * FROM candles WHERE symbol=? AND t_start_ms>=? ORDER BY t_start_ms",
+            con, params=(symbol, since_ms)
+        )
+    finally:
+        con.close()
+
+def last_rollup_end(path: str, symbol: str, tf: str) -> Optional[int]:
+    # end of the last stored rollup (or bar, for a bar label)
+    table, col = _series_table(tf)
+    con = connect(path)
+    try:
+        row = con.execute(
+            f"SELECT t_end_ms FROM {table} WHERE symbol=? AND {col}=? ORDER BY t_start_ms DESC LIMIT 1",
+            (symbol, tf)
+        ).fetchone()
+        return row[0] if row else None
     finally:
         con.close()
 
+class CandleCache:
+    '''
+    Process-wide cache of the last `limit` candles per (symbol, timeframe) for
+    readers that poll (the dashboard). The first get() loads the tail once;
+    after that each get() only asks SQLite for rows from the last cached
+    t_start_ms on (the primary-key index makes that a short range scan), so a
+    refresh costs O(new candles). The last cached row is re-read too, in case
+    it was rewritten (INSERT OR REPLACE after a restart).
+    With indicators=True the stored indicator columns come along (same query).
+    One shared connection, guarded by a lock; safe to use from several threads.
+    '''
+    def __init__(self, path: str, limit: int = 500, indicators: bool = False):
+        self.path = path
+        self.limit = limit
+        self.indicators = indicators
+        self.columns = list(CANDLE_COLUMNS) + (list(INDICATOR_COLUMNS) if indicators else [])
+        self.con = connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.frames: dict[tuple, pd.DataFrame] = {}
+        # hits: nothing new; misses: new rows fetched; loads: cold tail reads
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "rows": 0}
+
+    def get(self, symbol: str, tf: Optional[str] = None) -> pd.DataFrame:
+        key = (symbol, tf)
+        with self.lock:
+            df = self.frames.get(key)
+            if df is None or df.empty:
+                rows = self._query(symbol, tf, None)
+                self.stats["loads"] += 1
+                self.stats["rows"] += len(rows)
+                df = self.frames[key] = self._frame(rows)
+                return df
+
+            last = int(df["t_start_ms"].iat[-1])
+            rows = self._query(symbol, tf, last)
+            # indicators are committed with their candle, so comparing the candle is enough
+            n = len(CANDLE_COLUMNS)
+            if len(rows) == 1 and rows[0][:n] == tuple(df.iloc[-1, :n]):
+                self.stats["hits"] += 1
+                return df
+
+            self.stats["misses"] += 1
+            self.stats["rows"] += len(rows)
+            new = self._frame(rows)
+            df = pd.concat([df.iloc[:-1], new], ignore_index=True).tail(self.limit).reset_index(drop=True)
+            self.frames[key] = df
+            return df
+
+    def _frame(self, rows: list[tuple]) -> pd.DataFrame:
+        df = pd.DataFrame(rows, columns=self.columns)
+        return df.astype(_dtypes(True)) if self.indicators else df
+
+    def _query(self, symbol: str, tf: Optional[str], since_ms: Optional[int]) -> list[tuple]:
+        sql, where, params = _select(tf, self.indicators)
+        if since_ms is None:
+            rows = self.con.execute(
+                f"{sql} WHERE {where} ORDER BY c.t_start_ms DESC LIMIT ?",
+                (symbol, *params, self.limit)
+            ).fetchall()
+            return rows[::-1]
+        return self.con.execute(
+            f"{sql} WHERE {where} AND c.t_start_ms>=? ORDER BY c.t_start_ms",
+            (symbol, *params, since_ms)
+        ).fetchall()
+
+    def close(self) -> None:
+        self.con.close()
+
 def write_latest(r: redis.Redis, key: str, mapping: dict) -> None:
     r.hset(key, mapping=mapping)
 
+def publish_update(r: redis.Redis, stream: str, key: str, mapping: dict, maxlen: int) -> None:
+    # one entry per latest:{key} change; `data` is the JSON frame push clients receive
+    r.xadd(stream, {"key": key, "data": jdump({"key": key, **mapping})}, maxlen=maxlen, approximate=True)
+
 def read_latest(r: redis.Redis, key: str) -> Optional[dict]:
     m = r.hgetall(key)
     return m or None
+
+def read_hashes(r: redis.Redis, keys: list[str]) -> list[dict]:
+    # several HGETALLs in one round trip
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    return pipe.execute()
@@ -0,0 +1,177 @@
+import numpy as np
+
+from src.aggregator import Candle, CandleAggregator, RollupAggregator, BarAggregator, TimingWheel
+from src.common import bar_spec
+
+
+def test_timing_wheel_fires_at_or_after_deadline():
+    w = TimingWheel(tick_ms=100)
+    w.schedule(1050, "a")
+    w.schedule(1200, "b")
+    w.schedule(99_000, "c")
+    assert w.advance(1000) == []
+    assert w.advance(1100) == ["a"]
+    assert w.advance(1199) == []
+    assert w.advance(5000) == ["b"]
+    # scheduling in the past fires on the next advance
+    w.schedule(10, "late")
+    assert w.advance(5001) == ["late"]
+    assert w.advance(10**9) == ["c"]
+    assert len(w) == 0
+
+
+def test_trade_in_next_bucket_finalizes_previous():
+    agg = CandleAggregator(5000)
+    assert agg.add("btc", 1000, 10.0, 1.0) == []
+    assert agg.add("btc", 2000, 12.0, 2.0) == []
+    assert agg.add("btc", 3000, 9.0, 1.0) == []
+    closed = agg.add("btc", 6000, 11.0, 1.0)
+    assert len(closed) == 1
+    sym, c = closed[0]
+    assert sym == "btc"
+    assert (c.t_start_ms, c.t_end_ms, c.open, c.high, c.low, c.close, c.volume) == (0, 5000, 10.0, 12.0, 9.0, 9.0, 4.0)
+
+
+def test_timer_finalizes_after_grace_and_drops_late_trades():
+    agg = CandleAggregator(5000, grace_ms=500)
+    agg.add("btc", 1000, 10.0, 1.0)
+    assert agg.advance(5400) == []
+    closed = agg.advance(5500)
+    assert [(s, c.t_start_ms) for s, c in closed] == [("btc", 0)]
+    assert "btc" not in agg.current
+
+    # a trade for the finalized bucket is late
+    assert agg.add("btc", 4999, 99.0, 1.0) == []
+    assert agg.late_trades == 1
+    assert "btc" not in agg.current
+
+
+def test_gap_fill_forward_fills_empty_buckets():
+    agg = CandleAggregator(5000, grace_ms=0, gap_fill=True)
+    agg.add("btc", 1000, 10.0, 1.0)
+    assert [c.t_start_ms for _, c in agg.advance(5000)] == [0]
+    # nothing traded in [5000, 10000): filled from the timer
+    filled = agg.advance(10_000)
+    assert [(c.t_start_ms, c.open, c.close, c.volume) for _, c in filled] == [(5000, 10.0, 10.0, 0.0)]
+
+    # next trade jumps two buckets ahead: the skipped one is filled too
+    agg.add("btc", 21_000, 12.0, 1.0)
+    assert [c.t_start_ms for _, c in agg.flush()] == [20_000]
+    assert agg.closed_until["btc"] == 25_000
+
+
+def test_gap_fill_from_trade_path():
+    agg = CandleAggregator(5000, gap_fill=True)
+    agg.add("btc", 1000, 10.0, 1.0)
+    closed = agg.add("btc", 16_000, 11.0, 1.0)
+    assert [(c.t_start_ms, c.volume) for _, c in closed] == [(0, 1.0), (5000, 0.0), (10_000, 0.0)]
+
+
+def test_flush_and_release():
+    agg = CandleAggregator(5000)
+    agg.add("btc", 1000, 10.0, 1.0)
+    agg.add("eth", 1000, 2.0, 1.0)
+    c = agg.release("eth")
+    assert c.open == 2.0 and "eth" not in agg.current
+    assert [s for s, _ in agg.flush()] == ["btc"]
+    assert agg.current == {}
+
+
+def _trades(n, seed=3):
+    rng = np.random.default_rng(seed)
+    # mostly increasing event times with some out-of-order (late) ones and a gap
+    ts = 1_700_000_000_000 + np.cumsum(rng.integers(0, 40, n))
+    ts[n // 2:] += 23_000
+    jitter = rng.random(n) < 0.05
+    ts[jitter] -= 9_000
+    price = [f"{v:.8f}" for v in 30000 + np.cumsum(rng.normal(0, 3, n))]
+    qty = [f"{v:.8f}" for v in rng.exponential(0.1, n)]
+    return ts, price, qty
+
+
+def test_add_batch_matches_per_trade_loop():
+    ts, price, qty = _trades(5000)
+    sell = np.random.default_rng(11).random(len(ts)) < 0.4
+    for gap_fill in (False, True):
+        a, b = CandleAggregator(5000, gap_fill=gap_fill), CandleAggregator(5000, gap_fill=gap_fill)
+        out_a = []
+        for t, p, q, s in zip(ts.tolist(), price, qty, sell.tolist()):
+            out_a += a.add("btc", t, float(p), float(q), s)
+
+        out_b = []
+        for i in range(0, len(ts), 700):  # several reads, candles span batch edges
+            sl = slice(i, i + 700)
+            out_b += b.add_batch("btc", ts[sl], np.array(price[sl]).astype(np.float64), np.array(qty[sl]).astype(np.float64), sell[sl])
+
+        assert out_a == out_b  # exact, including volume and order flow
+        assert a.current == b.current
+        assert a.last_trade == b.last_trade == {"btc": (int(ts[-1]), float(price[-1]), float(qty[-1]))}
+        assert a.late_trades == b.late_trades > 0
+        assert all(type(c.open) is float and type(c.t_start_ms) is int for _, c in out_b)
+        traded = [c for _, c in out_b if c.trades] + list(b.current.values())
+        assert sum(c.trades for c in traded) == len(ts) - b.late_trades
+        assert all(np.isclose(c.buy_volume + c.sell_volume, c.volume) and c.low <= c.vwap <= c.high for c in traded)
+
+
+def _base(i, px, vol=1.0, ms=5000):
+    return Candle(t_start_ms=i * ms, t_end_ms=(i + 1) * ms, open=px, high=px + 1, low=px - 1, close=px, volume=vol)
+
+
+def test_rollup_merges_order_flow():
+    roll = RollupAggregator({"1m": 60_000})
+    for i in range(12):
+        c = _base(i, 10.0)
+        c.quote_volume, c.buy_volume, c.sell_volume, c.trades, c.max_qty = 10.0, 0.75, 0.25, 3, 0.1 * i
+        out = roll.add("btc", c)
+    c = out[0][2]
+    assert (c.quote_volume, c.buy_volume, c.sell_volume, c.trades, c.max_qty) == (120.0, 9.0, 3.0, 36, 1.1)
+    assert c.vwap == 10.0
+
+
+def test_rollup_closes_on_bucket_end_and_on_gap():
+    roll = RollupAggregator({"1m": 60_000, "5m": 300_000})
+    out = []
+    for i in range(12):  # one full minute of 5s candles
+        out += roll.add("btc", _base(i, 10.0 + i))
+    assert [(s, tf) for s, tf, _ in out] == [("btc", "1m")]
+    c = out[0][2]
+    assert (c.t_start_ms, c.t_end_ms, c.open, c.high, c.low, c.close, c.volume) == (0, 60_000, 10.0, 22.0, 9.0, 21.0, 12.0)
+    assert roll.current[("btc", "5m")].volume == 12.0
+
+    # minute 2 ends without its last base candle: closed when minute 3 starts
+    assert roll.add("btc", _base(12, 30.0)) == []
+    out = roll.add("btc", _base(25, 40.0))
+    assert [(tf, c.t_start_ms, c.close) for _, tf, c in out] == [("1m", 60_000, 30.0)]
+
+    # replayed history before the watermark is ignored
+    assert roll.add("btc", _base(3, 99.0)) == []
+    assert roll.current[("btc", "1m")].t_start_ms == 120_000
+
+
+def test_bars_batch_matches_per_trade_loop():
+    rng = np.random.default_rng(4)
+    n = 6000
+    ts = 1_700_000_000_000 + np.cumsum(rng.integers(0, 3, n))  # many trades share a millisecond
+    price = 30000 + np.cumsum(rng.normal(0, 3, n))
+    qty = rng.exponential(0.1, n)
+    sell = rng.random(n) < 0.5
+    specs = {label: bar_spec(label) for label in ("t1", "t50", "v5", "d100000")}
+
+    a, b = BarAggregator(specs), BarAggregator(specs)
+    out_a, out_b = [], []
+    for t, p, q, s in zip(ts.tolist(), price.tolist(), qty.tolist(), sell.tolist()):
+        out_a += a.add("btc", t, p, q, s)
+    for i in range(0, n, 700):
+        out_b += b.add_batch("btc", ts[i:i + 700], price[i:i + 700], qty[i:i + 700], sell[i:i + 700])
+
+    by_label = lambda out: sorted(out, key=lambda o: (o[1], o[2].t_start_ms))
+    assert by_label(out_a) == by_label(out_b)  # exact, batch cuts are sequential sums like add()
+    assert a.current == b.current
+
+    for label, (field, threshold) in specs.items():
+        bars = [c for _, lb, c in out_a if lb == label]
+        assert all(getattr(c, field) >= threshold for c in bars)
+        # bars tile time without overlap, even when several close in one millisecond
+        assert all(c.t_start_ms < c.t_end_ms <= d.t_start_ms for c, d in zip(bars, bars[1:]))
+    assert len([1 for _, lb, _ in out_a if lb == "t1"]) == n
+    assert len([1 for _, lb, _ in out_a if lb == "t50"]) == n // 50
@@ -0,0 +1,140 @@
+import json
+import asyncio
+
+import websockets
+
+from src.api import ApiServer, Hub, Subscriber
+from src.common import Config
+from src.storage import init_sqlite, CandleWriter
+
+
+class FakeWS:
+    def __init__(self, block=False):
+        self.frames = []
+        self.block = block
+        self.closed = None
+        self.remote_address = ("127.0.0.1", 1)
+
+    async def send(self, frame):
+        if self.block:
+            await asyncio.Event().wait()
+        self.frames.append(frame)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = code
+
+
+def test_hub_filters_snapshots_and_coalesces():
+    async def go():
+        hub = Hub()
+        hub.dispatch("btcusdt", "b0")
+        a, b = Subscriber(FakeWS(), 1.0), Subscriber(FakeWS(), 1.0)
+        hub.subscribe(a, ["btcusdt"])
+        hub.subscribe(b, ["*"])
+        assert a.mailbox == {"btcusdt": "b0"}  # snapshot
+
+        hub.dispatch("btcusdt", "b1")
+        hub.dispatch("btcusdt:1m", "m1")
+        hub.dispatch("ethusdt", "e1")
+        assert a.mailbox == {"btcusdt": "b1"} and a.coalesced == 1
+        assert list(b.mailbox.values()) == ["b1", "m1", "e1"]
+
+        pump = asyncio.create_task(a.pump())
+        await asyncio.sleep(0)
+        assert a.ws.frames == ["b1"]
+        hub.remove(a)
+        hub.dispatch("btcusdt", "b2")
+        await asyncio.sleep(0)
+        assert a.ws.frames == ["b1"]
+        pump.cancel()
+        assert hub.by_key == {} and hub.subscribers == {b}
+
+    asyncio.run(go())
+
+
+def test_stuck_client_is_dropped():
+    async def go():
+        api = ApiServer(Config(api_send_timeout_ms=20))
+        sub = Subscriber(FakeWS(block=True), 0.02)
+        api.hub.subscribe(sub, ["*"])
+        api.hub.dispatch("btcusdt", "b0")
+        await api._pump(sub)
+        assert sub.ws.closed == 1013
+
+    asyncio.run(go())
+
+
+def test_follower_skips_bad_update_entries():
+    class FakeRedis:
+        def __init__(self):
+            self.reads = 0
+
+        async def xrevrange(self, stream, count):
+            return [("2-0", {"key": "btcusdt", "data": "b1"}), ("1-0", {"data": "no key"})]
+
+        async def xread(self, streams, count, block):
+            self.reads += 1
+            if self.reads == 1:
+                return [("analytics:updates", [("3-0", {"key": "ethusdt"}), ("4-0", {"key": "ethusdt", "data": "e1"})])]
+            await asyncio.Event().wait()
+
+    async def go():
+        api = ApiServer(Config())
+        follower = asyncio.create_task(api.follow_updates(FakeRedis()))
+        while api.hub.updates < 2:
+            await asyncio.sleep(0.01)
+        assert not follower.done()
+        assert api.hub.last == {"btcusdt": "b1", "ethusdt": "e1"}
+        follower.cancel()
+
+    asyncio.run(asyncio.wait_for(go(), 5))
+
+
+def test_rest_candles_and_websocket_push(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), timeframes=("1m",))
+    init_sqlite(cfg.sqlite_path)
+    with CandleWriter(cfg.sqlite_path) as w:
+        for i in range(10):
+            w.add({"symbol": "btcusdt", "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+                   "open": 1.0, "high": 1.0, "low": 1.0, "close": float(i), "volume": 1.0},
+                  {"sma20": float(i)} if i >= 3 else {})
+
+    async def go():
+        api = ApiServer(cfg)
+        status, _, body = await api.process_request("/candles?symbol=BTCUSDT&start=10000&end=30000&limit=3", {})
+        assert status == 200
+        assert [c["close"] for c in json.loads(body)["candles"]] == [2.0, 3.0, 4.0]
+        assert "sma20" not in json.loads(body)["candles"][0]
+        status, _, body = await api.process_request("/candles?symbol=btcusdt&start=10000&end=30000&indicators=1", {})
+        candles = json.loads(body)["candles"]
+        assert [c["sma20"] for c in candles] == [None, 3.0, 4.0, 5.0] and candles[0]["rsi14"] is None
+        assert (await api.process_request("/candles?symbol=btcusdt&indicators=1&max_points=2", {}))[0] == 400
+        assert (await api.process_request("/candles?symbol=btcusdt&indicators=yes", {}))[0] == 400
+        assert (await api.process_request("/candles?tf=1m", {}))[0] == 400
+        assert (await api.process_request("/candles?symbol=btcusdt&tf=1h", {}))[0] == 400
+        status, _, body = await api.process_request("/candles?symbol=btcusdt&start=0&end=50000&max_points=2", {})
+        assert [c["close"] for c in json.loads(body)["candles"]] == [4.0, 9.0]
+        assert (await api.process_request("/candles?symbol=btcusdt&tf=1m&max_points=2", {}))[0] == 400
+        assert (await api.process_request("/nope", {}))[0] == 404
+        assert await api.process_request("/ws?keys=btcusdt", {}) is None
+
+        async with websockets.serve(api.handle_client, "127.0.0.1", 0, process_request=api.process_request) as srv:
+            port = srv.sockets[0].getsockname()[1]
+            async with websockets.connect(f"ws://127.0.0.1:{port}/ws?keys=btcusdt") as ws:
+                await ws.send(json.dumps({"subscribe": ["ethusdt:1m"]}))
+                while len(api.hub.by_key) < 2:
+                    await asyncio.sleep(0.01)
+                api.hub.dispatch("solusdt", '{"key":"solusdt"}')
+                api.hub.dispatch("ethusdt:1m", '{"key":"ethusdt:1m"}')
+                api.hub.dispatch("btcusdt", '{"key":"btcusdt"}')
+                got = [json.loads(await asyncio.wait_for(ws.recv(), 2))["key"] for _ in range(2)]
+                assert got == ["ethusdt:1m", "btcusdt"]
+                # a bare string is not split into one-character keys
+                for bad in ({"subscribe": "solusdt"}, {"unsubscribe": ["btcusdt", 1]}):
+                    await ws.send(json.dumps(bad))
+                    assert "error" in json.loads(await asyncio.wait_for(ws.recv(), 2))
+                assert set(api.hub.by_key) == {"btcusdt", "ethusdt:1m"}
+            status = json.loads((await api.process_request("/health", {}))[2])
+            assert status["updates"] == 3
+
+    asyncio.run(go())
@@ -0,0 +1,121 @@
+import os
+import json
+
+import numpy as np
+
+from src import archive
+from src.archive import compact, archive_root, get_archive, DAY_MS
+from src.storage import init_sqlite, connect, CandleWriter, read_candles, read_candle_range, INDICATOR_COLUMNS
+from src.downsample import read_series
+
+BUCKET = 3_600_000  # hourly candles keep the test small
+
+
+def _fill(path, days, symbol="btcusdt"):
+    with CandleWriter(path, batch_size=10_000) as w:
+        for i in range(days * 24):
+            t = i * BUCKET
+            w.add({"symbol": symbol, "t_start_ms": t, "t_end_ms": t + BUCKET,
+                   "open": 1.0, "high": 2.0, "low": 0.5, "close": float(i), "volume": 1.0})
+            if i % 24 == 23:
+                w.add_rollup("1d", {"symbol": symbol, "t_start_ms": t - 23 * BUCKET, "t_end_ms": t + BUCKET,
+                                    "open": 1.0, "high": 2.0, "low": 0.5, "close": float(i), "volume": 24.0})
+
+
+def _count(path, table):
+    con = connect(path)
+    try:
+        return con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_compaction_moves_old_days_and_reads_span_tiers(tmp_path):
+    path = str(tmp_path / "t.db")
+    init_sqlite(path)
+    _fill(path, 5)
+    _fill(path, 5, symbol="ethusdt")
+    before = read_candle_range(path, "btcusdt", 0, 5 * DAY_MS, limit=1000)
+
+    con = connect(path)
+    stats = compact(con, path, retention_days=2, now_ms=5 * DAY_MS + 1)
+    con.close()
+    # days 0..2 of both symbols, base + 1d rollups
+    assert stats == {"days": 12, "rows": 2 * 3 * 24 + 2 * 3}
+    assert _count(path, "candles") == 2 * 2 * 24
+    assert _count(path, "candles_tf") == 2 * 2
+
+    with open(os.path.join(archive_root(path), "manifest.json")) as f:
+        days = json.load(f)["series"]["btcusdt/base"]
+    assert sorted(days) == ["1970-01-01", "1970-01-02", "1970-01-03"]
+    assert days["1970-01-02"] == {"file": "btcusdt/base/1970-01-02.npy", "rows": 24,
+                                  "t_min": DAY_MS, "t_max": DAY_MS + 23 * BUCKET}
+
+    after = read_candle_range(path, "btcusdt", 0, 5 * DAY_MS, limit=1000)
+    assert after.equals(before)
+    assert read_candle_range(path, "btcusdt", DAY_MS, DAY_MS + 2 * BUCKET)["close"].tolist() == [24.0, 25.0]
+    assert read_candle_range(path, "btcusdt", 0, 5 * DAY_MS, limit=30)["close"].tolist() == [float(i) for i in range(30)]
+
+    latest = read_candles(path, "btcusdt", limit=60)
+    assert latest["close"].tolist() == [float(i) for i in range(60, 120)]
+    assert latest["symbol"].tolist() == ["btcusdt"] * 60
+    assert read_candles(path, "btcusdt", limit=3, tf="1d")["close"].tolist() == [71.0, 95.0, 119.0]
+    assert read_candles(path, "btcusdt", limit=10, tf="1d")["close"].tolist() == [23.0, 47.0, 71.0, 95.0, 119.0]
+
+    # downsampled long-range reads go through the same path
+    series = read_series(path, "btcusdt", 0, 5 * DAY_MS, 10, BUCKET, {})
+    assert len(series) == 10 and series["volume"].sum() == 120.0
+
+
+def test_recompaction_merges_and_sqlite_copy_wins(tmp_path):
+    path = str(tmp_path / "t.db")
+    init_sqlite(path)
+    _fill(path, 3)
+    con = connect(path)
+    compact(con, path, retention_days=1, now_ms=3 * DAY_MS)
+
+    # a backfill re-writes part of an archived day
+    with CandleWriter(path) as w:
+        w.add({"symbol": "btcusdt", "t_start_ms": BUCKET, "t_end_ms": 2 * BUCKET,
+               "open": 1.0, "high": 2.0, "low": 0.5, "close": 99.0, "volume": 1.0})
+    assert read_candle_range(path, "btcusdt", 0, 3 * BUCKET)["close"].tolist() == [0.0, 99.0, 2.0]
+
+    assert compact(con, path, retention_days=1, now_ms=3 * DAY_MS) == {"days": 1, "rows": 1}
+    con.close()
+    arr = np.load(os.path.join(archive_root(path), "btcusdt", "base", "1970-01-01.npy"))
+    assert len(arr) == 24 and arr["close"][1] == 99.0
+    assert get_archive(path).days("btcusdt", "base")["1970-01-01"]["rows"] == 24
+    assert read_candle_range(path, "btcusdt", 0, 3 * BUCKET)["close"].tolist() == [0.0, 99.0, 2.0]
+
+
+def test_indicator_values_are_archived_with_their_candles(tmp_path):
+    assert archive.INDICATOR_COLUMNS == INDICATOR_COLUMNS
+    path = str(tmp_path / "t.db")
+    init_sqlite(path)
+    with CandleWriter(path) as w:
+        for i in range(48):
+            t = i * BUCKET
+            w.add({"symbol": "btcusdt", "t_start_ms": t, "t_end_ms": t + BUCKET,
+                   "open": 1.0, "high": 2.0, "low": 0.5, "close": float(i), "volume": 1.0},
+                  {"sma20": float(i), "rsi14": 50.0} if i % 2 else {})
+    before = read_candles(path, "btcusdt", limit=48, indicators=True)
+
+    con = connect(path)
+    compact(con, path, retention_days=1, now_ms=2 * DAY_MS)
+    assert _count(path, "candles") == 24 and _count(path, "indicators") == 12
+
+    after = read_candles(path, "btcusdt", limit=48, indicators=True)
+    assert after.reset_index(drop=True).equals(before.reset_index(drop=True))
+    assert after["sma20"].tolist()[:4][1::2] == [1.0, 3.0] and np.isnan(after["sma20"].iloc[0])
+    ranged = read_candle_range(path, "btcusdt", 0, 4 * BUCKET, indicators=True)
+    assert ranged["rsi14"].tolist()[1::2] == [50.0, 50.0]
+    assert "sma20" not in read_candle_range(path, "btcusdt", 0, 4 * BUCKET).columns
+
+    # a backfilled candle without indicator values keeps the archived ones on re-compaction
+    with CandleWriter(path) as w:
+        w.add({"symbol": "btcusdt", "t_start_ms": BUCKET, "t_end_ms": 2 * BUCKET,
+               "open": 1.0, "high": 2.0, "low": 0.5, "close": 99.0, "volume": 1.0})
+    compact(con, path, retention_days=1, now_ms=2 * DAY_MS)
+    con.close()
+    row = read_candle_range(path, "btcusdt", BUCKET, 2 * BUCKET, indicators=True).iloc[0]
+    assert row["close"] == 99.0 and row["sma20"] == 1.0
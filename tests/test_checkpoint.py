@@ -0,0 +1,141 @@
+import json
+
+import numpy as np
+
+from src.common import Config, rollup_frames, bar_specs
+from src.aggregator import CandleAggregator, RollupAggregator, BarAggregator
+from src.checkpoint import checkpoint_key, load_checkpoints, restore_symbol, catch_up_engines, ENGINE_PREFIX
+from src.consumer import handle_batch, replay_pending
+from src.storage import init_sqlite, CandleWriter, read_candles
+
+ST = "trades:btcusdt"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.streams = {}
+        self.acked = []
+        self.pel = []  # (id, fields) delivered but not acked
+
+    def hset(self, key, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def xadd(self, stream, fields, **kw):
+        self.streams.setdefault(stream, []).append(fields)
+
+    def xack(self, stream, group, *ids):
+        self.acked.extend(ids)
+        self.pel = [(i, f) for i, f in self.pel if i not in ids]
+
+    def xreadgroup(self, group, consumer, streams, count=None):
+        return [(ST, self.pel[:count])] if self.pel else []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *a, **kw: self.calls.append((getattr(self.r, name), a, kw))
+
+    def execute(self):
+        return [fn(*a, **kw) for fn, a, kw in self.calls]
+
+
+def _batches(n=1200, size=40, seed=7):
+    # 10 minutes of trades, one every 0.5s, as XREADGROUP responses
+    rng = np.random.default_rng(seed)
+    price = 100 + np.cumsum(rng.normal(0, 0.1, n))
+    msgs = [(f"{i + 1}-0", {"ts_ms": str(i * 500), "price": f"{p:.4f}", "qty": "1"}) for i, p in enumerate(price)]
+    return [[(ST, msgs[i:i + size])] for i in range(0, n, size)]
+
+
+def _state(cfg):
+    # fresh in-memory consumer state: aggregator, rollups, engines, bars
+    return CandleAggregator(5000), RollupAggregator(rollup_frames(cfg)), {}, BarAggregator(bar_specs(cfg))
+
+
+def _run(cfg, r, batches, agg, rollups, engines, bars=None):
+    with CandleWriter(cfg.sqlite_path) as w:
+        for resp in batches:
+            handle_batch(cfg, r, resp, agg, engines, w, True, rollups, bars=bars)
+
+
+def _result(cfg, r, agg):
+    latest = {k: v for k, v in r.hashes["latest:btcusdt"].items() if k != "published_ms"}
+    return (
+        # stored indicator values included (NaN while warming up, filled so records compare)
+        read_candles(cfg.sqlite_path, "btcusdt", limit=1000, indicators=True).fillna(-1).to_dict("records"),
+        read_candles(cfg.sqlite_path, "btcusdt", limit=1000, tf="1m", indicators=True).fillna(-1).to_dict("records"),
+        read_candles(cfg.sqlite_path, "btcusdt", limit=1000, tf="t7", indicators=True).fillna(-1).to_dict("records"),
+        latest, r.hashes["latest:btcusdt:t7"]["close"], agg.current["btcusdt"],
+    )
+
+
+def test_restore_resumes_exactly(tmp_path):
+    batches = _batches()
+    expected = None
+    for name in ("straight", "restarted", "engine_behind"):
+        cfg = Config(sqlite_path=str(tmp_path / f"{name}.db"), candle_sec=5, timeframes=("1m",), bars=("t7",))
+        init_sqlite(cfg.sqlite_path)
+        r = FakeRedis()
+        agg, rollups, engines, bars = _state(cfg)
+        if name == "straight":
+            _run(cfg, r, batches, agg, rollups, engines, bars)
+            expected = _result(cfg, r, agg)
+            continue
+
+        _run(cfg, r, batches[:14], agg, rollups, engines, bars)
+        key = checkpoint_key(cfg, "btcusdt")
+        stale = r.hashes[key][ENGINE_PREFIX + "btcusdt"]
+        _run(cfg, r, batches[14:20], agg, rollups, engines, bars)
+        assert r.hashes[key]["last_id"] == batches[19][0][1][-1][0]
+        if name == "engine_behind":
+            # the engine fields of the last checkpoints were lost
+            r.hashes[key][ENGINE_PREFIX + "btcusdt"] = stale
+
+        # crash: everything in memory is gone, batch 20 was delivered but not acked
+        agg, rollups, engines, bars = _state(cfg)
+        saved = load_checkpoints(r, cfg, ["btcusdt", "ethusdt"])
+        assert list(saved) == ["btcusdt"]
+        assert restore_symbol(agg, rollups, engines, "btcusdt", saved["btcusdt"], bars=bars)
+        assert ("btcusdt", "t7") in bars.current  # the open bar came back with the rest
+        fed = catch_up_engines(cfg, engines, agg, rollups, "btcusdt", bars)
+        assert (fed > 0) == (name == "engine_behind")
+        _run(cfg, r, batches[20:], agg, rollups, engines, bars)
+        assert _result(cfg, r, agg) == expected
+
+
+def test_restore_needs_seeding_when_timeframes_change(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), candle_sec=5, timeframes=("1m",))
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedis()
+    agg, rollups, engines, _ = _state(cfg)
+    _run(cfg, r, _batches()[:5], agg, rollups, engines)
+    fields = load_checkpoints(r, cfg, ["btcusdt"])["btcusdt"]
+    assert json.loads(fields["rollups"])["1m"]["current"]["t_start_ms"] == 60_000
+    assert not restore_symbol(CandleAggregator(5000), RollupAggregator({"1m": 60_000, "5m": 300_000}), {}, "btcusdt", fields)
+
+
+def test_replay_pending_skips_acked_and_trimmed():
+    cfg = Config(read_count=2)
+    r = FakeRedis()
+    r.pel = [("1-0", {"a": 1}), ("2-0", {"a": 2}), ("3-0", None), ("4-0", {"a": 4}), ("10-0", {"a": 10})]
+    seen = []
+
+    def handle(resp):
+        for st, msgs in resp:
+            seen.extend(i for i, _ in msgs)
+            r.xack(st, cfg.consumer_group, *[i for i, _ in msgs])
+
+    assert replay_pending(cfg, r, [ST], {"btcusdt": "2-0"}, handle) == 2
+    assert seen == ["4-0", "10-0"]
+    assert sorted(r.acked) == ["1-0", "10-0", "2-0", "3-0", "4-0"] and r.pel == []
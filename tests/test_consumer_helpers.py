@@ -1,7 +1,19 @@
+import json
+
+import numpy as np
+import pandas as pd
 import pytest
 
 import redis
-from src.consumer import floor_bucket, ensure_group
+from src.common import Config
+from src.consumer import (
+    floor_bucket, ensure_group, compute_and_cache, MIN_CANDLES, process_batch, ack_batch,
+    finalize_candles, rollup_frames, seed_rollups, publish_rows, update_values, indicator_pool, seed_bars,
+)
+from src.storage import init_sqlite, CandleWriter, read_candles
+from src.indicators import ema, rsi
+from src.aggregator import Candle, CandleAggregator, RollupAggregator, BarAggregator
+from src.common import bar_specs
 
 
 def test_floor_bucket_5s():
@@ -39,3 +51,278 @@ def test_ensure_group_ignores_busygrouperror():
     r = FakeRedisBusy()
     # should not raise
     ensure_group(r, "trades:btcusdt", "cg_analytics")
+
+
+class FakeRedisHash:
+    def __init__(self):
+        self.hashes = {}
+        self.streams = {}
+
+    def hset(self, key, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def xadd(self, stream, fields, maxlen=None, approximate=True):
+        self.streams.setdefault(stream, []).append(fields)
+
+    def pipeline(self, transaction=True):
+        return FakeImmediatePipeline(self)
+
+
+class FakeImmediatePipeline:
+    # applies each command right away
+    def __init__(self, r):
+        self.r = r
+
+    def __getattr__(self, name):
+        return getattr(self.r, name)
+
+    def execute(self):
+        return []
+
+
+def test_compute_and_cache_publishes_incrementally(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"))
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedisHash()
+    engines = {}
+
+    for i in range(MIN_CANDLES):
+        row = {"symbol": "btcusdt", "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+               "open": 1.0, "high": 1.0, "low": 1.0, "close": float(i + 1), "volume": 1.0}
+        compute_and_cache(cfg, r, engines, row)
+        if i < MIN_CANDLES - 1:
+            assert "latest:btcusdt" not in r.hashes
+    # every closed candle was pushed; before warm-up without indicator values
+    updates = r.streams[cfg.updates_stream]
+    assert [json.loads(u["data"])["close"] for u in updates] == [float(i + 1) for i in range(MIN_CANDLES)]
+    assert "rsi14" not in json.loads(updates[-2]["data"])
+
+    latest = r.hashes["latest:btcusdt"]
+    assert latest["symbol"] == "btcusdt"
+    assert float(latest["close"]) == float(MIN_CANDLES)
+    assert float(latest["sma20"]) == sum(range(11, 31)) / 20
+    assert latest["rsi14"] == "100.0"
+
+    # the same update went to the push stream, as JSON with real numbers
+    assert updates[-1]["key"] == "btcusdt"
+    data = json.loads(updates[-1]["data"])
+    assert data["key"] == "btcusdt" and data["close"] == float(MIN_CANDLES) and data["rsi14"] == 100.0
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.ops = []
+
+    def xadd(self, stream, fields, **kw):
+        self.ops.append(("xadd", stream, fields))
+
+    def hset(self, key, mapping=None):
+        self.ops.append(("hset", key, mapping))
+
+    def xack(self, stream, group, *ids):
+        self.ops.append(("xack", stream, group, ids))
+
+    def execute(self):
+        self.r.executed.append(self.ops)
+        return [1] * len(self.ops)
+
+
+class FakeRedisPipe(FakeRedisHash):
+    def __init__(self):
+        super().__init__()
+        self.executed = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def _msg(i, ts, price, qty="1"):
+    return (f"{i}-0", {"ts_ms": str(ts), "price": price, "qty": qty})
+
+
+def test_process_batch_collects_acks_and_dlq(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), checkpoint=False)
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedisPipe()
+    agg, engines = CandleAggregator(5000), {}
+
+    resp = [
+        ("trades:btcusdt", [_msg(1, 1000, "10"), _msg(2, 2000, "12"), ("3-0", {"ts_ms": "x"}), _msg(4, 6000, "11")]),
+        ("trades:ethusdt", [_msg(5, 1000, "2")]),
+    ]
+    with CandleWriter(cfg.sqlite_path, batch_size=100, flush_ms=60_000) as w:
+        acks, dlq = process_batch(cfg, r, resp, agg, engines, w)
+        # the 0-5s btc candle closed when the 6000ms trade arrived
+        assert [row[1] for row in w.pending] == [0]
+        assert w.pending[0][3:7] == (10.0, 12.0, 10.0, 12.0)
+
+    assert acks == {"trades:btcusdt": ["1-0", "2-0", "3-0", "4-0"], "trades:ethusdt": ["5-0"]}
+    assert [e["id"] for e in dlq] == ["3-0"]
+    assert agg.current["btcusdt"].t_start_ms == 5000
+
+    # the closed candle went to the push updates (before warm-up too); then one round trip for the acks
+    assert [op[:2] for op in r.executed[0]] == [("xadd", cfg.updates_stream)]
+    ack_batch(cfg, r, acks, dlq)
+    assert len(r.executed) == 2
+    ops = r.executed[1]
+    assert ops[0][0] == "xadd" and ops[0][1] == cfg.dlq_stream
+    assert ops[1] == ("xack", "trades:btcusdt", cfg.consumer_group, ("1-0", "2-0", "3-0", "4-0"))
+    assert ops[2] == ("xack", "trades:ethusdt", cfg.consumer_group, ("5-0",))
+
+
+def test_process_batch_vectorized_path_matches_and_falls_back(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), batch_agg_min=2)
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedisPipe()
+
+    good = [_msg(1, 1000, "10"), _msg(2, 2000, "12"), _msg(3, 6000, "11", "0.5")]
+    bad = good[:2] + [("9-0", {"ts_ms": "x"})] + good[2:]
+
+    results = []
+    for msgs, min_batch in ((good, 2), (good, 0), (bad, 2)):
+        cfg = Config(sqlite_path=cfg.sqlite_path, batch_agg_min=min_batch)
+        agg = CandleAggregator(5000)
+        with CandleWriter(cfg.sqlite_path, batch_size=100, flush_ms=60_000) as w:
+            acks, dlq = process_batch(cfg, r, [("trades:btcusdt", msgs)], agg, {}, w)
+            results.append((list(w.pending), agg.current["btcusdt"], acks, [e["id"] for e in dlq]))
+
+    vec, loop, fallback = results
+    assert vec[:2] == loop[:2]
+    assert vec[2] == {"trades:btcusdt": ["1-0", "2-0", "3-0"]}
+    assert fallback[:2] == loop[:2]
+    assert fallback[3] == ["9-0"]
+
+
+def test_bars_are_stored_published_and_resume_after_the_last_stored_bar(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), bars=("t3",), checkpoint=False)
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedisHash()
+    bars, engines = BarAggregator(bar_specs(cfg)), {}
+    msgs = [_msg(i, 1000 + i, str(10 + i)) for i in range(3 * MIN_CANDLES + 2)]
+    with CandleWriter(cfg.sqlite_path, batch_size=1000, flush_ms=60_000) as w:
+        process_batch(cfg, r, [("trades:btcusdt", msgs)], CandleAggregator(5000), engines, w, bars=bars)
+
+    df = read_candles(cfg.sqlite_path, "btcusdt", tf="t3", indicators=True)
+    assert len(df) == MIN_CANDLES and (df["trades"] == 3).all()
+    assert df["t_start_ms"].tolist()[:2] == [1000, 1003] and df["close"].iat[-1] == 10 + 3 * MIN_CANDLES - 1
+    assert df["ema20"].notna().iat[-1]
+    assert float(r.hashes["latest:btcusdt:t3"]["close"]) == df["close"].iat[-1]
+    assert bars.current[("btcusdt", "t3")].trades == 2
+
+    # restart without a checkpoint: the next bar starts after the last stored one
+    bars = BarAggregator(bar_specs(cfg))
+    seed_bars(cfg, bars, "btcusdt")
+    assert bars.add("btcusdt", 500, 1.0, 1.0) == [] and bars.current[("btcusdt", "t3")].t_start_ms == df["t_end_ms"].iat[-1]
+
+
+def test_rollups_publish_per_timeframe_and_reseed_after_restart(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), candle_sec=5, timeframes=("1m", "7s"))
+    init_sqlite(cfg.sqlite_path)
+    r = FakeRedisHash()
+    assert rollup_frames(cfg) == {"1m": 60_000}
+
+    def base(i):
+        return ("btcusdt", Candle(i * 5000, (i + 1) * 5000, 1.0, 2.0, 0.5, float(i), 1.0))
+
+    engines, rollups = {}, RollupAggregator(rollup_frames(cfg))
+    with CandleWriter(cfg.sqlite_path, batch_size=1000, flush_ms=60_000) as w:
+        finalize_candles(cfg, r, engines, w, [base(i) for i in range(12 * MIN_CANDLES + 5)], rollups)
+    assert float(r.hashes["latest:btcusdt:1m"]["close"]) == 12.0 * MIN_CANDLES - 1
+    assert float(r.hashes["latest:btcusdt:1m"]["volume"]) == 12.0
+    assert "btcusdt:1m" in engines
+    stored = read_candles(cfg.sqlite_path, "btcusdt", limit=1000, tf="1m")
+    assert len(stored) == MIN_CANDLES
+
+    # restart: the open minute (5 base candles) is rebuilt from stored candles
+    rollups = RollupAggregator(rollup_frames(cfg))
+    with CandleWriter(cfg.sqlite_path, batch_size=1000, flush_ms=60_000) as w:
+        seed_rollups(cfg, r, {}, w, rollups, "btcusdt")
+        assert rollups.current[("btcusdt", "1m")].volume == 5.0
+        finalize_candles(cfg, r, {}, w, [base(i) for i in range(12 * MIN_CANDLES + 5, 12 * MIN_CANDLES + 12)], rollups)
+    last = read_candles(cfg.sqlite_path, "btcusdt", limit=1, tf="1m").iloc[-1]
+    assert (int(last["t_start_ms"]), float(last["close"]), float(last["volume"])) == (MIN_CANDLES * 60_000, 12.0 * MIN_CANDLES + 11, 12.0)
+
+
+def test_packed_and_mixed_batches_match_text(tmp_path):
+    from src.wire import PACKED_FIELD, pack_trade
+
+    def packed(i, ts, price, qty="1"):
+        return (f"{i}-0", {PACKED_FIELD: pack_trade(ts, float(price), float(qty), "buy").decode("latin-1")})
+
+    text = [_msg(1, 1000, "10"), _msg(2, 2000, "12"), _msg(3, 6000, "11", "0.5")]
+    cases = {
+        "text": text,
+        "packed": [packed(1, 1000, "10"), packed(2, 2000, "12"), packed(3, 6000, "11", "0.5")],
+        "mixed": [text[0], packed(2, 2000, "12"), text[2]],
+    }
+    results = {}
+    for name, msgs in cases.items():
+        cfg = Config(sqlite_path=str(tmp_path / f"{name}.db"), batch_agg_min=2)
+        init_sqlite(cfg.sqlite_path)
+        agg = CandleAggregator(5000)
+        with CandleWriter(cfg.sqlite_path, batch_size=100, flush_ms=60_000) as w:
+            acks, dlq = process_batch(cfg, FakeRedisPipe(), [("trades:btcusdt", msgs)], agg, {}, w)
+            results[name] = (list(w.pending), agg.current["btcusdt"], acks, dlq)
+
+    assert results["packed"] == results["text"]
+    assert results["mixed"] == results["text"]
+
+
+def test_pool_coalesces_publishes_of_fed_candles(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"))
+    init_sqlite(cfg.sqlite_path)
+    rows = [{"symbol": "btcusdt", "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+             "open": 1.0, "high": 1.0, "low": 1.0, "close": float(i + 1), "volume": 1.0}
+            for i in range(MIN_CANDLES + 5)]
+
+    inline_r, inline_engines = FakeRedisHash(), {}
+    for row in rows:
+        compute_and_cache(cfg, inline_r, inline_engines, row)
+
+    r, engines = FakeRedisHash(), {}
+    values = [{} for _ in rows]
+    fed, warm = update_values(cfg, engines, list(zip(rows, values)))  # one coalesced job
+    assert warm and len(fed) == len(rows) and fed[-1]["sma20"] == values[-1]["sma20"]
+    publish_rows(cfg, r, fed, warm=warm)
+    # every coalesced close is pushed, latest:* gets the newest
+    assert [json.loads(u["data"])["close"] for u in r.streams[cfg.updates_stream]] == [row["close"] for row in rows]
+    got, want = r.hashes["latest:btcusdt"], inline_r.hashes["latest:btcusdt"]
+    assert {k: v for k, v in got.items() if k != "published_ms"} == {k: v for k, v in want.items() if k != "published_ms"}
+
+    # the same through finalize_candles and a threaded pool
+    r, engines = FakeRedisHash(), {}
+    pool = indicator_pool(Config(sqlite_path=cfg.sqlite_path, indicator_workers=2), r, engines)
+    with CandleWriter(str(tmp_path / "pool.db"), wait=pool.wait_values) as w:
+        init_sqlite(w.path)
+        finalize_candles(cfg, r, engines, w, [("btcusdt", Candle(**{k: v for k, v in row.items() if k != "symbol"}))
+                                              for row in rows], pool=pool)
+        w.flush()
+        # the commit waited for every candle's values, not for the pool to go idle
+        assert pool.unfilled == 0
+    pool.close(5)
+    assert r.hashes["latest:btcusdt"]["sma20"] == want["sma20"]
+    assert engines["btcusdt"].count == len(rows)
+    stored = read_candles(str(tmp_path / "pool.db"), "btcusdt", limit=1000, indicators=True)
+    assert len(stored) == len(rows) and str(stored["sma20"].iat[-1]) == want["sma20"]
+
+
+def test_finalized_candles_store_their_indicators(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), timeframes=("1m",))
+    init_sqlite(cfg.sqlite_path)
+    closes = [100.0 + (i * 7919 % 13) for i in range(60)]
+    closed = [("btcusdt", Candle(i * 5000, (i + 1) * 5000, c, c, c, c, 1.0)) for i, c in enumerate(closes)]
+    r, engines = FakeRedisHash(), {}
+    with CandleWriter(cfg.sqlite_path) as w:
+        finalize_candles(cfg, r, engines, w, closed, RollupAggregator(rollup_frames(cfg)))
+
+    df = read_candles(cfg.sqlite_path, "btcusdt", limit=100, indicators=True)
+    want = pd.Series(closes)
+    assert np.allclose(df["sma20"].iloc[19:], want.rolling(20).mean().iloc[19:])
+    assert df["sma20"].iloc[:19].isna().all()
+    assert np.allclose(df["rsi14"].iloc[1:], rsi(want).iloc[1:])
+    # the published latest:* values are the stored ones
+    assert float(r.hashes["latest:btcusdt"]["macd"]) == df["macd"].iat[-1]
+    # rollups get their own series (1m close = close of every 12th base candle)
+    tf = read_candles(cfg.sqlite_path, "btcusdt", tf="1m", indicators=True)
+    assert np.allclose(tf["ema20"], ema(pd.Series(closes[11::12]), 20))
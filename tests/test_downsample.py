@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+
+from src.downsample import merge_candles, lttb_indices, pick_source, read_series, RangeCache
+from src.storage import init_sqlite, CandleWriter
+
+FRAMES = {"1m": 60_000, "1h": 3_600_000}
+
+
+def _candles(n, ms=5000, seed=3):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    t = np.arange(n, dtype=np.int64) * ms
+    buy, sell = rng.random(n), rng.random(n)
+    return pd.DataFrame({
+        "symbol": "btcusdt", "t_start_ms": t, "t_end_ms": t + ms,
+        "open": close, "high": close + rng.random(n), "low": close - rng.random(n),
+        "close": close, "volume": buy + sell, "quote_volume": (buy + sell) * close,
+        "buy_volume": buy, "sell_volume": sell, "trades": rng.integers(1, 50, n), "max_qty": np.maximum(buy, sell),
+    })
+
+
+def test_merge_candles_preserves_ohlc():
+    df = _candles(1000)
+    out = merge_candles(df, 60_000)
+    assert len(out) == 84
+    first = df.iloc[:12]
+    assert out.iloc[0][["open", "high", "low", "close"]].tolist() == [
+        first["open"].iat[0], first["high"].max(), first["low"].min(), first["close"].iat[-1]]
+    assert out["high"].max() == df["high"].max() and out["low"].min() == df["low"].min()
+    assert np.isclose(out["volume"].sum(), df["volume"].sum())
+    assert out["trades"].sum() == df["trades"].sum()
+    assert out["max_qty"].iat[0] == first["max_qty"].max()
+    assert out["t_end_ms"].iat[-1] == df["t_end_ms"].iat[-1]
+
+
+def test_lttb_keeps_endpoints_and_spikes():
+    y = np.zeros(10_000)
+    y[4321] = 50.0
+    idx = lttb_indices(np.arange(len(y)), y, 100)
+    assert len(idx) == 100 and idx[0] == 0 and idx[-1] == len(y) - 1
+    assert 4321 in idx
+    assert np.all(np.diff(idx) > 0)
+    assert lttb_indices(np.arange(5), np.arange(5), 10).tolist() == [0, 1, 2, 3, 4]
+
+
+def test_pick_source_is_coarsest_fine_enough():
+    assert pick_source(3_600_000, 1000, 5000, FRAMES) == (None, 5000)
+    assert pick_source(86_400_000, 1000, 5000, FRAMES) == ("1m", 60_000)
+    assert pick_source(365 * 86_400_000, 1000, 5000, FRAMES) == ("1h", 3_600_000)
+
+
+def _store(path, df):
+    init_sqlite(path)
+    with CandleWriter(path, batch_size=100_000) as w:
+        w.add_many(list(df.itertuples(index=False, name=None)))
+        # completed 1m rollups, except the last 5 minutes
+        roll = merge_candles(df, 60_000).iloc[:-5]
+        for row in roll.to_dict("records"):
+            w.add_rollup("1m", row)
+
+
+def test_read_series_bounded_and_fills_rollup_tail(tmp_path):
+    path = str(tmp_path / "t.db")
+    df = _candles(17_280)  # one day of 5s candles
+    _store(path, df)
+    day = 86_400_000
+
+    out = read_series(path, "btcusdt", 0, day, 500, 5000, FRAMES)
+    assert 0 < len(out) <= 500
+    assert out["high"].max() == df["high"].max() and out["low"].min() == df["low"].min()
+    # the tail (no rollups stored yet) comes from base candles
+    assert out["close"].iat[-1] == df["close"].iat[-1]
+    assert np.isclose(out["volume"].sum(), df["volume"].sum())
+
+    line = read_series(path, "btcusdt", 0, day, 300, 5000, FRAMES, mode="lttb")
+    assert len(line) == 300
+
+    small = read_series(path, "btcusdt", 0, 60_000, 500, 5000, FRAMES)
+    assert len(small) == 12
+
+
+def test_range_cache_snaps_sliding_windows(tmp_path):
+    path = str(tmp_path / "t.db")
+    _store(path, _candles(2000))
+    cache = RangeCache(maxsize=2)
+
+    a = cache.get(path, "btcusdt", 10_000, 3_610_000, 100, 5000, FRAMES)
+    # window slid, but within the same 36s output bucket: same entry
+    b = cache.get(path, "btcusdt", 20_000, 3_620_000, 100, 5000, FRAMES)
+    assert a is b and cache.stats == {"hits": 1, "misses": 1}
+
+    cache.get(path, "btcusdt", 0, 7_200_000, 100, 5000, FRAMES)
+    cache.get(path, "btcusdt", 0, 600_000, 100, 5000, FRAMES)
+    assert len(cache.entries) == 2
+    cache.get(path, "btcusdt", 10_000, 3_610_000, 100, 5000, FRAMES)  # evicted (LRU)
+    assert cache.stats["misses"] == 4
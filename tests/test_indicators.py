@@ -1,7 +1,9 @@
+import json
+
 import numpy as np
 import pandas as pd
 
-from src.indicators import sma, ema, rsi, macd, bollinger
+from src.indicators import sma, ema, rsi, macd, bollinger, IndicatorEngine
 
 
 def test_sma_basic():
@@ -53,3 +55,65 @@ def test_bollinger_ordering():
     mask = mid.notna() & lo.notna() & up.notna()
     assert (lo[mask] <= mid[mask]).all()
     assert (mid[mask] <= up[mask]).all()
+
+
+def _random_walk(n=1500, seed=7):
+    rng = np.random.default_rng(seed)
+    return pd.Series(30000 + np.cumsum(rng.normal(0, 25, n)), dtype=float)
+
+
+def _stream(engine, s):
+    return pd.DataFrame([engine.update(v) for v in s])
+
+
+def test_incremental_engine_matches_pandas():
+    s = _random_walk()
+    out = _stream(IndicatorEngine(), s)
+
+    m, sig, hist = macd(s)
+    lo, mid, up = bollinger(s, 20, 2.0)
+    expected = {
+        "sma20": sma(s, 20),
+        "ema20": ema(s, 20),
+        "rsi14": rsi(s, 14),
+        "macd": m,
+        "macd_signal": sig,
+        "macd_hist": hist,
+        "bb_lower": lo,
+        "bb_mid": mid,
+        "bb_upper": up,
+    }
+    for col, exp in expected.items():
+        assert np.allclose(out[col].values, exp.values, rtol=1e-9, atol=1e-9, equal_nan=True), col
+
+
+def test_incremental_rsi_edge_cases_match_pandas():
+    for s in (
+        pd.Series(np.arange(1, 60), dtype=float),        # only gains
+        pd.Series(np.arange(60, 1, -1), dtype=float),    # only losses
+        pd.Series(np.full(40, 5.0)),                     # flat
+    ):
+        out = _stream(IndicatorEngine(), s)
+        assert np.allclose(out["rsi14"].values, rsi(s, 14).values, equal_nan=True)
+
+
+def test_incremental_warm_then_update():
+    s = _random_walk(400)
+    eng = IndicatorEngine()
+    eng.warm(s.iloc[:-1])
+    last = eng.update(s.iloc[-1])
+    assert eng.count == len(s)
+    assert np.isclose(last["ema20"], ema(s, 20).iloc[-1], rtol=1e-9)
+    assert np.isclose(last["bb_upper"], bollinger(s)[2].iloc[-1], rtol=1e-9)
+
+
+def test_engine_state_round_trip():
+    rng = np.random.default_rng(1)
+    closes = (100 + np.cumsum(rng.normal(0, 1, 80))).tolist()
+    a = IndicatorEngine()
+    a.warm(closes[:50])
+    a.until_ms = 123
+    b = IndicatorEngine.from_dict(json.loads(json.dumps(a.to_dict())))
+    assert b.until_ms == 123 and b.count == 50
+    for c in closes[50:]:
+        assert a.update(c) == b.update(c)
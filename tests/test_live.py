@@ -0,0 +1,71 @@
+from src.common import Config
+from src.aggregator import Candle, CandleAggregator, RollupAggregator
+from src.live import LivePublisher, forming_rollup
+
+
+class FakeRedis:
+    def __init__(self):
+        self.hashes = {}
+        self.updates = []
+        self.round_trips = 0
+
+    def hset(self, key, mapping=None):
+        self.hashes.setdefault(key, {}).update(mapping)
+
+    def xadd(self, stream, fields, **kw):
+        self.updates.append(fields["key"])
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, r):
+        self.r = r
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *a, **kw: self.calls.append((getattr(self.r, name), a, kw))
+
+    def execute(self):
+        self.r.round_trips += 1
+        return [fn(*a, **kw) for fn, a, kw in self.calls]
+
+
+def test_live_writes_are_coalesced_per_interval():
+    cfg = Config(live_interval_ms=250, updates_stream="updates")
+    r, agg, live = FakeRedis(), CandleAggregator(5000), LivePublisher(cfg)
+    for i in range(100):  # a burst: 100 reads before the interval is up
+        agg.add("btc", 1000 + i, 10.0 + i, 1.0)
+        live.touch(["btc"])
+        live.maybe_flush(r, agg, None, now=10_000 + i)
+    assert r.round_trips == 1
+    assert r.updates == ["btc:live"]
+    assert live.maybe_flush(r, agg, None, now=10_300) == 1  # the rest of the burst, once
+    assert r.round_trips == 2
+    assert float(r.hashes["live:btc"]["close"]) == 109.0
+    assert float(r.hashes["live:btc"]["volume"]) == 100.0
+    assert r.hashes["last_trade:btc"] == {"ts_ms": 1099, "price": 109.0, "qty": 1.0}
+    # nothing touched since: no write, however much time passes
+    assert live.maybe_flush(r, agg, None, now=99_999) == 0
+    assert r.round_trips == 2
+
+    off = LivePublisher(Config(live_interval_ms=0))
+    off.touch(["btc"])
+    assert off.maybe_flush(r, agg, None, now=10**9) == 0
+
+
+def test_live_rollup_includes_open_base_candle():
+    cfg = Config(live_interval_ms=250, updates_stream="")
+    r, agg, rollups = FakeRedis(), CandleAggregator(5000), RollupAggregator({"1m": 60_000})
+    rollups.add("btc", Candle(60_000, 65_000, 10.0, 15.0, 9.0, 12.0, 2.0))
+    agg.add("btc", 66_000, 20.0, 3.0)
+    live = LivePublisher(cfg)
+    live.touch(["btc"])
+    live.maybe_flush(r, agg, rollups, now=70_000)
+    h = r.hashes["live:btc:1m"]
+    assert (h["t_start_ms"], h["open"], h["high"], h["low"], h["close"], h["volume"]) == (60_000, 10.0, 20.0, 9.0, 20.0, 5.0)
+    assert r.updates == []
+    # a base candle in a new rollup bucket starts the forming rollup over
+    c = forming_rollup(Candle(0, 60_000, 1.0, 2.0, 0.5, 1.5, 1.0), Candle(60_000, 65_000, 3.0, 3.0, 3.0, 3.0, 1.0), 60_000)
+    assert (c.t_start_ms, c.open, c.volume) == (60_000, 3.0, 1.0)
@@ -0,0 +1,91 @@
+import socket
+import urllib.request
+
+from src import metrics
+from src.common import Config
+from src.consumer import group_metrics, process_batch, CONSUMED, DEAD_LETTERED, READ_LAG
+from src.aggregator import CandleAggregator
+from src.storage import init_sqlite, CandleWriter
+
+
+def test_histogram_counter_and_labels_render():
+    reg = metrics.Registry()
+    h = reg.register(metrics.Histogram("t_seconds", "latency", buckets=(0.1, 1.0)))
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.observe(v)
+    h.observe_many([0.01, 2.0])
+    c = reg.register(metrics.Counter("t_total", "things", ("conn",)))
+    c.labels("a").inc()
+    c.labels("a").inc(2)
+    c.labels('b"x').inc()
+    assert reg.register(metrics.Counter("t_total", "again")) is c
+    reg.add_collector(lambda: metrics.family("t_depth", "gauge", "depth", [({"stream": "s"}, 3)]))
+    reg.add_collector(lambda: 1 / 0)  # a broken collector doesn't break the scrape
+
+    text = reg.render()
+    assert 't_seconds_bucket{le="0.1"} 2' in text
+    assert 't_seconds_bucket{le="1.0"} 4' in text
+    assert 't_seconds_bucket{le="+Inf"} 6' in text
+    assert "t_seconds_count 6" in text and "t_seconds_sum 6.06" in text
+    assert 't_total{conn="a"} 3' in text and 't_total{conn="b\\"x"} 1' in text
+    assert "# TYPE t_total counter" in text and 't_depth{stream="s"} 3' in text
+
+
+def test_serve_exposes_registry():
+    reg = metrics.Registry()
+    reg.register(metrics.Gauge("up", "1 if running", fn=lambda: 1))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    srv = metrics.serve(port, "127.0.0.1", reg)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as resp:
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "up 1" in resp.read().decode()
+        # the port is taken now: warn, don't raise
+        assert metrics.serve(port, "127.0.0.1", reg) is None
+    finally:
+        srv.shutdown()
+        srv.server_close()
+    assert metrics.serve(0) is None
+
+
+class FakePipe:
+    def __init__(self, replies):
+        self.replies = replies
+        self.n = 0
+
+    def xinfo_groups(self, st):
+        self.n += 1
+
+    def execute(self, raise_on_error=True):
+        return self.replies[:self.n]
+
+
+class FakeRedis:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def pipeline(self, transaction=True):
+        return FakePipe(self.replies)
+
+
+def test_group_metrics_and_consumer_counters(tmp_path):
+    cfg = Config(sqlite_path=str(tmp_path / "t.db"), checkpoint=False)
+    replies = [
+        [{"name": "other", "pending": 9, "lag": 9}, {"name": cfg.consumer_group, "pending": 4, "lag": 7}],
+        [{"name": cfg.consumer_group, "pending": 0, "lag": None}],
+        ValueError("no such key"),
+    ]
+    text = "\n".join(group_metrics(cfg, FakeRedis(replies), ["trades:a", "trades:b", "trades:c"]))
+    assert 'consumer_group_pending{stream="trades:a"} 4' in text
+    assert 'consumer_group_pending{stream="trades:b"} 0' in text
+    assert 'consumer_group_lag{stream="trades:a"} 7' in text
+    assert "trades:c" not in text and 'lag{stream="trades:b"}' not in text
+
+    init_sqlite(cfg.sqlite_path)
+    before = (CONSUMED.value, DEAD_LETTERED.value, READ_LAG.count)
+    msgs = [("1-0", {"ts_ms": "1000", "price": "1", "qty": "1"}), ("2-0", {"ts_ms": "x"})]
+    with CandleWriter(cfg.sqlite_path) as w:
+        process_batch(cfg, None, [("trades:btcusdt", msgs)], CandleAggregator(5000), {}, w)
+    assert (CONSUMED.value, DEAD_LETTERED.value, READ_LAG.count) == (before[0] + 2, before[1] + 1, before[2] + 1)
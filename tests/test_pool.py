@@ -0,0 +1,77 @@
+import time
+import threading
+
+from src.pool import CoalescingPool
+
+
+def test_coalesces_per_key_and_keeps_order():
+    gate = threading.Event()
+    calls, active, overlap = [], set(), []
+
+    def fn(key, items):
+        if key in active:
+            overlap.append(key)
+        active.add(key)
+        if key == "a" and not gate.is_set():
+            gate.wait(2)
+        calls.append((key, list(items)))
+        active.discard(key)
+
+    pool = CoalescingPool(fn, workers=3)
+    pool.submit("a", 1)
+    while not pool.running:
+        time.sleep(0.001)
+    # "a" is busy: these wait for it and go to its next run as one list
+    for i in range(2, 6):
+        pool.submit("a", i)
+    pool.submit("b", 1)
+    assert pool.depth() == 2
+    gate.set()
+    assert pool.drain(2)
+
+    assert [items for key, items in calls if key == "a"] == [[1], [2, 3, 4, 5]]
+    assert ("b", [1]) in calls and not overlap
+    snap = pool.snapshot()
+    assert snap["jobs"] == 3 and snap["items"] == 6 and snap["coalesced"] == 3 and snap["depth"] == 0
+    assert snap["run_p99_ms"] >= snap["run_p50_ms"] >= 0
+    pool.close(2)
+    assert not any(t.is_alive() for t in pool.threads)
+
+
+def test_discard_drops_pending_and_waits_for_running():
+    gate = threading.Event()
+    seen = []
+
+    def fn(key, items):
+        gate.wait(2)
+        seen.append((key, items))
+
+    pool = CoalescingPool(fn, workers=1)
+    pool.submit("btcusdt", 1)
+    while not pool.running:
+        time.sleep(0.001)
+    pool.submit("btcusdt", 2)
+    pool.submit("btcusdt:1m", 3)
+    pool.submit("ethusdt", 4)
+    threading.Timer(0.05, gate.set).start()
+    assert pool.discard(lambda k: k.split(":")[0] == "btcusdt") == 2
+    # returned only after the running btcusdt job finished
+    assert seen[0] == ("btcusdt", [1])
+    pool.close(2)
+    assert seen == [("btcusdt", [1]), ("ethusdt", [4])]
+
+
+def test_inline_pool_and_errors():
+    calls = []
+
+    def fn(key, items):
+        if items == ["boom"]:
+            raise ValueError("boom")
+        calls.append((key, items))
+
+    pool = CoalescingPool(fn, workers=0)
+    pool.submit("a", 1)
+    pool.submit("a", "boom")
+    pool.submit("a", 2)
+    assert calls == [("a", [1]), ("a", [2])]
+    assert pool.snapshot()["errors"] == 1
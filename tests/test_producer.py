@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+import redis.asyncio as aioredis
+
+from src.producer import (
+    normalize_binance_trade,
+    normalize_binance_trade_fast,
+    combined_url,
+    split_symbols,
+    StreamPublisher,
+)
+
+
+def test_normalize_binance_trade():
+    msg = {"e": "aggTrade", "E": 1700000000123, "p": "42000.5", "q": "0.001", "m": True}
+    ev = normalize_binance_trade(msg, "btcusdt")
+    assert ev["ts_ms"] == "1700000000123"
+    assert ev["symbol"] == "btcusdt"
+    assert float(ev["price"]) == 42000.5
+    assert float(ev["qty"]) == 0.001
+    assert ev["side"] == "sell"
+
+
+class FakeAsyncPipeline:
+    def __init__(self, r):
+        self.r = r
+        self.ops = []
+
+    def xadd(self, key, fields, maxlen=None, approximate=False):
+        self.ops.append((key, fields, maxlen, approximate))
+
+    async def execute(self, raise_on_error=True):
+        self.r.batches.append(self.ops)
+        return [b"1-0"] * len(self.ops)
+
+
+class FakeAsyncRedis:
+    def __init__(self):
+        self.batches = []
+
+    def pipeline(self, transaction=True):
+        return FakeAsyncPipeline(self)
+
+
+def _run_publisher(pub, events, policy_wait=0.05):
+    async def go():
+        for e in events:
+            await pub.publish("trades:btcusdt", e)
+        task = asyncio.create_task(pub.run())
+        await asyncio.sleep(policy_wait)
+        task.cancel()
+
+    asyncio.run(go())
+
+
+def test_publisher_batches_xadds_with_trimming():
+    r = FakeAsyncRedis()
+    pub = StreamPublisher(r, maxlen=123, queue_size=100, batch_size=4, linger_ms=1)
+    _run_publisher(pub, [{"i": str(i)} for i in range(10)])
+
+    assert [len(b) for b in r.batches] == [4, 4, 2]
+    assert all(op[2] == 123 and op[3] is True for b in r.batches for op in b)
+    assert [op[1]["i"] for b in r.batches for op in b] == [str(i) for i in range(10)]
+    assert pub.stats.published == 10
+    assert pub.stats.max_batch == 4
+
+
+def test_publisher_drops_when_full():
+    r = FakeAsyncRedis()
+    pub = StreamPublisher(r, maxlen=10, queue_size=3, batch_size=10, linger_ms=0, drop_when_full=True)
+    _run_publisher(pub, [{"i": str(i)} for i in range(5)])
+
+    assert pub.stats.dropped == 2
+    assert pub.stats.published == 3
+
+
+def test_normalize_fast_passes_strings_through():
+    msg = {"E": 1700000000123, "p": "42000.50000000", "q": "0.00100000", "m": False}
+    ev = normalize_binance_trade_fast(msg, "btcusdt")
+    assert ev["price"] == "42000.50000000"
+    assert ev["qty"] == "0.00100000"
+    assert ev["side"] == "buy"
+    # same numbers as the legacy path once the consumer parses them
+    legacy = normalize_binance_trade(msg, "btcusdt")
+    assert float(ev["price"]) == float(legacy["price"])
+    assert ev.keys() == legacy.keys()
+
+
+def test_normalize_fast_rejects_a_non_numeric_event_time():
+    from src.producer import MALFORMED_ERRORS
+
+    msg = {"E": "soon", "p": "42000.5", "q": "0.001", "m": False}
+    with pytest.raises(MALFORMED_ERRORS):
+        normalize_binance_trade_fast(msg, "btcusdt")
+    assert normalize_binance_trade_fast({**msg, "E": "1700000000123"}, "btcusdt")["ts_ms"] == "1700000000123"
+
+
+def test_publisher_survives_a_bad_event_time():
+    r = FakeAsyncRedis()
+    pub = StreamPublisher(r, maxlen=10, queue_size=10, batch_size=1, linger_ms=0)
+
+    async def go():
+        await pub.publish("trades:btcusdt", {"i": "0"}, "soon")
+        await pub.publish("trades:btcusdt", {"i": "1"}, 1700000000123)
+        task = asyncio.create_task(pub.run())
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        task.cancel()
+
+    asyncio.run(go())
+    assert [op[1]["i"] for b in r.batches for op in b] == ["0", "1"]
+    assert pub.stats.published == 2
+
+
+class FlakyAsyncRedis(FakeAsyncRedis):
+    # fails chosen XADDs: errors[key] is a list of exceptions, one used per attempt
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = errors
+
+    def pipeline(self, transaction=True):
+        r = self
+
+        class Pipe(FakeAsyncPipeline):
+            async def execute(self, raise_on_error=True):
+                assert raise_on_error is False
+                r.batches.append(self.ops)
+                out = []
+                for key, *_ in self.ops:
+                    errs = r.errors.get(key)
+                    out.append(errs.pop(0) if errs else "1-0")
+                return out
+        return Pipe(self)
+
+
+def _write(pub, events):
+    async def go():
+        await pub._write([(key, {"i": str(i)}, None) for i, key in enumerate(events)])
+    asyncio.run(go())
+
+
+def test_publisher_resends_only_failed_entries():
+    r = FlakyAsyncRedis({"trades:b": [aioredis.ConnectionError("reset"), aioredis.TimeoutError("slow")]})
+    pub = StreamPublisher(r, maxlen=10, max_attempts=5)
+    _write(pub, ["trades:a", "trades:b", "trades:c"])
+    assert [[op[0] for op in b] for b in r.batches] == [["trades:a", "trades:b", "trades:c"], ["trades:b"], ["trades:b"]]
+    assert pub.stats.published == 3 and pub.stats.errors == 2 and pub.stats.failed == 0
+
+
+def test_publisher_drops_entries_that_cannot_succeed():
+    # a permanent error is not retried; a transient one only max_attempts times
+    wrongtype = aioredis.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+    r = FlakyAsyncRedis({"trades:bad": [wrongtype], "trades:down": [aioredis.ConnectionError("down")] * 10})
+    pub = StreamPublisher(r, maxlen=10, max_attempts=2)
+    _write(pub, ["trades:a", "trades:bad", "trades:down"])
+    assert [[op[0] for op in b] for b in r.batches] == [["trades:a", "trades:bad", "trades:down"], ["trades:down"]]
+    assert pub.stats.published == 1 and pub.stats.failed == 2
+
+
+def test_combined_stream_url_and_split():
+    assert combined_url("wss://x", ["a", "b"]) == "wss://x/stream?streams=a@aggTrade/b@aggTrade"
+    groups = split_symbols(("a", "b", "c", "d", "e"), 2)
+    assert groups == [["a", "c", "e"], ["b", "d"]]
+    assert split_symbols(("a",), 4) == [["a"]]
+
+
+def test_normalize_packed_is_one_binary_field():
+    from src.producer import normalize_binance_trade_packed
+    from src.wire import decode_trade, unpack_trades, PACKED_FIELD
+
+    msg = {"e": "aggTrade", "E": 1700000000123, "p": "42000.5", "q": "0.001", "m": True}
+    ev = normalize_binance_trade_packed(msg, "btcusdt")
+    assert list(ev) == [PACKED_FIELD] and isinstance(ev[PACKED_FIELD], bytes)
+    assert decode_trade(ev) == (1700000000123, 42000.5, 0.001, True)
+    assert unpack_trades([ev[PACKED_FIELD]])["flags"].tolist() == [1]
@@ -0,0 +1,89 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.common import Config, jdump
+from src.indicators import rsi, macd, bollinger
+from src.screener import Screener, seed, wanted, ingest
+from src.storage import init_sqlite, CandleWriter
+
+MS = 5000
+
+
+def _closes(symbols=4, n=300, seed=3):
+    rng = np.random.default_rng(seed)
+    return 100 + np.cumsum(rng.normal(0, 1, (symbols, n)), axis=1)
+
+
+def test_matches_per_symbol_indicators():
+    closes = _closes()
+    syms = [f"s{i}" for i in range(len(closes))]
+    scr = Screener(syms, MS, window=closes.shape[1])
+    for t in range(closes.shape[1]):
+        for i, s in enumerate(syms):
+            scr.add(s, t * MS, closes[i, t], 1.0)
+    res = scr.compute()
+
+    for i in range(len(syms)):
+        c = pd.Series(closes[i])
+        _, _, h = macd(c)
+        lower, _, upper = bollinger(c)
+        assert np.isclose(res["rsi14"][i], rsi(c).iat[-1])
+        assert np.isclose(res["macd_hist"][i], h.iat[-1])
+        assert np.isclose(res["bb_pos"][i], (c.iat[-1] - lower.iat[-1]) / (upper.iat[-1] - lower.iat[-1]))
+        assert np.isclose(res["ret_12"][i], c.iat[-1] / c.iat[-13] - 1)
+        assert res["macd_cross"][i] == int(np.sign(h.iat[-1])) * (np.sign(h.iat[-1]) != np.sign(h.iat[-2]))
+    assert not res["stale"].any()
+
+
+def test_window_slides_and_missing_candles_are_forward_filled():
+    scr = Screener(["a", "b", "c"], MS, window=30)
+    for t in range(40):
+        scr.add("a", t * MS, 100.0 + t, 1.0 + t % 2)
+        if t < 35:
+            scr.add("b", t * MS, 50.0, 2.0)
+    assert not scr.add("a", 0, 1.0, 1.0)  # fell out of the window
+    assert not scr.add("zzz", 39 * MS, 1.0, 1.0)
+    res = scr.compute(40 * MS)  # nobody has a candle in this bucket yet
+    assert res["stale"].tolist() == [True, True, True]
+    assert res["close"][0] == 139.0 and res["close"][1] == 50.0
+    assert res["ret_1"][0] == 0.0
+
+    scr.add("a", 40 * MS, 150.0, 9.0)
+    res = scr.compute(40 * MS)
+    assert res["stale"].tolist() == [False, True, True]
+    assert res["vol_z"][0] > 3
+    ranks = scr.ranks(res)
+    assert ranks["gainers"][0] == "a" and ranks["volume"] == ["a", "b"]  # c has no data at all
+    rows = scr.rows(res)
+    assert rows[2]["close"] is None and rows[2]["symbol"] == "c"
+    json.loads(jdump(rows))
+
+
+def test_seed_from_sqlite_and_update_keys(tmp_path):
+    cfg = Config(sqlite_path=os.path.join(tmp_path, "t.db"))
+    init_sqlite(cfg.sqlite_path)
+    with CandleWriter(cfg.sqlite_path) as w:
+        for t in range(50):
+            for s in ("a", "b"):
+                w.add({"symbol": s, "t_start_ms": t * MS, "t_end_ms": (t + 1) * MS,
+                       "open": 1, "high": 1, "low": 1, "close": float(t), "volume": 1.0})
+    scr = Screener(["a", "b"], MS, window=20)
+    assert seed(cfg, scr, before_ms=50 * MS) == 40
+    assert scr.last_start == 49 * MS
+    assert scr.close[0].tolist() == [float(t) for t in range(30, 50)]
+
+    assert wanted("a", "") == "a"
+    assert wanted("a:1m", "") is None and wanted("a:live", "") is None
+    assert wanted("a:1m", "1m") == "a" and wanted("a:1m:live", "1m") is None
+
+
+def test_ingest_skips_bad_update_entries():
+    scr = Screener(["a", "b"], MS, window=5)
+    good = {"key": "a", "data": jdump({"t_start_ms": 0, "close": 2.0, "volume": 3.0})}
+    bad = [{}, {"key": "a"}, {"key": "a", "data": "{"}, {"key": "b", "data": jdump({"t_start_ms": 0, "close": 1.0})}]
+    assert [ingest(scr, "", f"{i}-0", f) for i, f in enumerate(bad)] == [False] * len(bad)
+    assert ingest(scr, "", "9-0", good) and not ingest(scr, "", "10-0", {**good, "key": "a:1m"})
+    assert scr.close[:, -1].tolist()[0] == 2.0 and np.isnan(scr.close[1, -1])
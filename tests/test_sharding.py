@@ -0,0 +1,122 @@
+from src.sharding import owner, assign, ShardCoordinator, RENEW_LEASE, RELEASE_LEASE
+
+
+SYMBOLS = [f"sym{i}usdt" for i in range(200)]
+
+
+def test_owner_is_deterministic_and_balanced():
+    workers = ["w1", "w2", "w3", "w4"]
+    a = assign(SYMBOLS, workers)
+    assert a == assign(SYMBOLS, list(reversed(workers)))
+    assert sorted(s for v in a.values() for s in v) == sorted(SYMBOLS)
+    assert all(30 <= len(v) <= 70 for v in a.values())
+
+
+def test_worker_leave_only_moves_its_symbols():
+    before = {s: owner(s, ["w1", "w2", "w3"]) for s in SYMBOLS}
+    after = {s: owner(s, ["w1", "w2"]) for s in SYMBOLS}
+    moved = [s for s in SYMBOLS if before[s] != after[s]]
+    assert moved and all(before[s] == "w3" for s in moved)
+
+
+class FakeRedis:
+    '''just enough of redis for the coordinator (no expiry)'''
+    def __init__(self):
+        self.kv = {}
+        self.zsets = {}
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zremrangebyscore(self, key, lo, hi):
+        z = self.zsets.get(key, {})
+        for m in [m for m, sc in z.items() if sc <= hi]:
+            del z[m]
+
+    def zrange(self, key, start, end):
+        z = self.zsets.get(key, {})
+        return sorted(z, key=z.get)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.kv:
+            return None
+        self.kv[key] = value
+        return True
+
+    def get(self, key):
+        return self.kv.get(key)
+
+    def delete(self, key):
+        self.kv.pop(key, None)
+
+    def pexpire(self, key, ms):
+        return key in self.kv
+
+    def register_script(self, script):
+        # the coordinator's two Lua scripts, in Python
+        def renew(keys, args):
+            return int(self.kv.get(keys[0]) == args[0])
+
+        def release(keys, args):
+            if self.kv.get(keys[0]) != args[0]:
+                return 0
+            if args[1]:
+                self.kv[keys[1]] = args[1]
+            return int(self.kv.pop(keys[0], None) is not None)
+        return {RENEW_LEASE: renew, RELEASE_LEASE: release}[script]
+
+
+def test_coordinator_rebalance_hands_off_state():
+    r = FakeRedis()
+    syms = SYMBOLS[:20]
+    c1 = ShardCoordinator(r, "cg", "w1", syms, ttl_ms=10_000)
+    c2 = ShardCoordinator(r, "cg", "w2", syms, ttl_ms=10_000)
+
+    acquired = {"w1": {}, "w2": {}}
+    c1.rebalance(lambda s: None, lambda s, st: acquired["w1"].__setitem__(s, st))
+    assert c1.owned == set(syms)
+
+    # w2 joins: it can't take symbols until w1 has released their leases
+    c2.rebalance(lambda s: None, lambda s, st: acquired["w2"].__setitem__(s, st))
+    assert c2.owned == set()
+
+    c1.rebalance(lambda s: {"t_start_ms": 5000, "symbol": s}, lambda s, st: None)
+    c2.rebalance(lambda s: None, lambda s, st: acquired["w2"].__setitem__(s, st))
+
+    assert c1.owned | c2.owned == set(syms)
+    assert not (c1.owned & c2.owned)
+    assert c2.owned == {s for s in syms if owner(s, ["w1", "w2"]) == "w2"}
+    # the open state released by w1 arrived at w2
+    assert all(acquired["w2"][s] == {"t_start_ms": 5000, "symbol": s} for s in c2.owned)
+
+    # clean leave: w1's symbols go to w2
+    c1.leave(lambda s: None)
+    c2.rebalance(lambda s: None, lambda s, st: None)
+    assert c2.owned == set(syms)
+
+
+def test_worker_that_lost_its_lease_drops_the_symbol():
+    r = FakeRedis()
+    syms = SYMBOLS[:4]
+    c1 = ShardCoordinator(r, "cg", "w1", syms, ttl_ms=10_000)
+    c1.rebalance(lambda s: None, lambda s, st: None)
+    assert c1.owned == set(syms)
+
+    # w1 stalled past its TTL: its leases expired and w2 took one over
+    taken = syms[0]
+    r.kv[c1.lease_key(taken)] = "w2"
+    lost, released = [], []
+    c1.rebalance(lambda s: released.append(s), lambda s, st: None, lost.append)
+    assert lost == [taken] and taken not in c1.owned
+    assert r.kv[c1.lease_key(taken)] == "w2"
+
+    # leaving never deletes (or hands off over) someone else's lease
+    r.kv[c1.lease_key(syms[1])] = "w2"
+    c1.leave(lambda s: released.append(s) or {"t_start_ms": 1}, lost.append)
+    assert lost == [taken, syms[1]] and released == sorted(syms[2:])
+    assert r.kv[c1.lease_key(syms[1])] == "w2"
+    assert c1.handoff_key(syms[1]) not in r.kv
+    assert all(c1.lease_key(s) not in r.kv for s in syms[2:])
@@ -0,0 +1,87 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.common import Config
+from src.producer import StreamPublisher, run_combined, MALFORMED, WS_RECONNECTS
+from src.simulator import Simulator, Faults, RandomWalk, Replay, parse_path, serve
+from tests.test_producer import FakeAsyncRedis
+
+
+def test_parse_path():
+    assert parse_path("/ws/btcusdt@aggTrade") == (["btcusdt"], False)
+    assert parse_path("/stream?streams=btcusdt@aggTrade/ETHUSDT@aggTrade") == (["btcusdt", "ethusdt"], True)
+    for bad in ("/ws/btcusdt@depth", "/stream", "/other"):
+        with pytest.raises(ValueError):
+            parse_path(bad)
+
+
+def test_random_walk_emits_each_trade_once_in_order():
+    rw = RandomWalk(rate=1000, start_ms=1_000, seed=3)
+    first, second = rw.due(2_000), rw.due(3_000)
+    assert rw.due(3_000) == []
+    ts = [t for t, *_ in first + second]
+    assert ts == sorted(ts) and 1_000 < ts[0] and ts[-1] <= 3_000
+    assert max(t for t, *_ in first) <= 2_000 < min(t for t, *_ in second)
+    assert 1_800 < len(ts) < 2_200
+    assert all(p > 0 and q > 0 for _, p, q, _ in first)
+
+
+def test_replay_rebases_speeds_up_and_loops():
+    recorded = [
+        (np.array([10_000, 12_000]), np.array([1.0, 2.0]), np.array([0.1, 0.2]), np.array([False, True])),
+        (np.array([14_000]), np.array([3.0]), np.array([0.3]), np.array([False])),
+    ]
+    rp = Replay(lambda: iter(recorded), start_ms=500_000, speed=2.0)
+    assert rp.due(500_999) == [(500_000, 1.0, 0.1, False)]
+    assert rp.due(502_000) == [(501_000, 2.0, 0.2, True), (502_000, 3.0, 0.3, False)]
+    # the second pass starts 1ms after the first one ended
+    assert [t for t, *_ in rp.due(504_001)] == [502_001, 503_001, 504_001]
+
+
+def test_producer_skips_malformed_frames_and_keeps_the_connection():
+    sim = Simulator(rate=500, faults=Faults(malformed=0.2), seed=1)
+    r = FakeAsyncRedis()
+    before = MALFORMED.value
+
+    async def go():
+        ready = asyncio.get_running_loop().create_future()
+        tasks = [asyncio.create_task(serve(sim, "127.0.0.1", 0, ready.set_result))]
+        cfg = Config(ws_base_url=f"ws://127.0.0.1:{await ready}")
+        pub = StreamPublisher(r, maxlen=1000, linger_ms=1)
+        tasks += [asyncio.create_task(pub.run()), asyncio.create_task(run_combined(cfg, pub, ["aaausdt", "bbbusdt"]))]
+        while sim.stats["sent"] < 300:
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.1)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(go(), 30))
+    events = [op[1] for b in r.batches for op in b]
+    assert sim.stats["connections"] == 1
+    assert sim.stats["malformed"] > 0
+    # everything but the malformed frames (and a few still in flight at cancel) got through
+    assert 0 < MALFORMED.value - before <= sim.stats["malformed"]
+    assert len(events) >= sim.stats["sent"] - sim.stats["malformed"] - 100
+    assert {e["symbol"] for e in events} == {"aaausdt", "bbbusdt"}
+    assert all(float(e["price"]) > 0 for e in events)
+
+
+def test_combined_connection_reconnects_are_labelled_by_index():
+    async def go():
+        # a port nothing listens on: every connect fails
+        server = await asyncio.start_server(lambda *_: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        cfg = Config(ws_base_url=f"ws://127.0.0.1:{port}")
+        task = asyncio.create_task(run_combined(cfg, StreamPublisher(FakeAsyncRedis(), maxlen=1000), ["aaausdt", "bbbusdt"], conn=3))
+        while ("3",) not in WS_RECONNECTS.children:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(asyncio.wait_for(go(), 10))
+    assert not any("," in label for label, in WS_RECONNECTS.children)
@@ -2,7 +2,10 @@ import os
 import sqlite3
 import tempfile
 
-from src.storage import init_sqlite, insert_candle, read_candles
+from src.storage import (
+    init_sqlite, insert_candle, read_candles, read_candle_range, last_rollup_end, CandleWriter, CandleCache,
+    CANDLE_COLUMNS, INDICATOR_COLUMNS,
+)
 
 
 def test_sqlite_insert_and_read():
@@ -31,3 +34,135 @@ def test_sqlite_insert_and_read():
         assert float(row["low"]) == 0.5
         assert float(row["close"]) == 1.5
         assert float(row["volume"]) == 10.0
+
+
+def test_order_flow_columns_added_to_an_old_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    con = sqlite3.connect(path)
+    con.execute("CREATE TABLE candles (symbol TEXT NOT NULL, t_start_ms INTEGER NOT NULL, t_end_ms INTEGER NOT NULL, "
+                "open REAL NOT NULL, high REAL NOT NULL, low REAL NOT NULL, close REAL NOT NULL, volume REAL NOT NULL, "
+                "PRIMARY KEY(symbol, t_start_ms))")
+    con.execute("INSERT INTO candles VALUES ('btcusdt', 0, 5000, 1, 2, 0.5, 1.5, 10)")
+    con.commit()
+    con.close()
+
+    init_sqlite(path)
+    insert_candle(path, {**_row(1), "quote_volume": 15.0, "buy_volume": 0.75, "sell_volume": 0.25,
+                         "trades": 7, "max_qty": 0.5})
+    df = read_candles(path, "btcusdt")
+    assert list(df.columns) == list(CANDLE_COLUMNS)
+    assert df[["quote_volume", "trades", "max_qty"]].values.tolist() == [[0.0, 0, 0.0], [15.0, 7, 0.5]]
+
+
+def _row(i, symbol="btcusdt"):
+    return {"symbol": symbol, "t_start_ms": i * 5000, "t_end_ms": (i + 1) * 5000,
+            "open": 1.0, "high": 2.0, "low": 0.5, "close": float(i), "volume": 1.0}
+
+
+def test_candle_writer_group_commit(tmp_path):
+    path = str(tmp_path / "test.db")
+    init_sqlite(path)
+
+    w = CandleWriter(path, batch_size=3, flush_ms=60_000)
+    assert w.con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    w.add(_row(0))
+    w.add(_row(1))
+    # buffered, not visible to readers yet
+    assert read_candles(path, "btcusdt").empty
+
+    w.add(_row(2))  # hits batch_size -> one transaction
+    assert len(read_candles(path, "btcusdt")) == 3
+    assert w.pending == []
+
+    w.add(_row(3))
+    w.add(_row(3))  # same key twice in one batch -> replace
+    w.close()
+    df = read_candles(path, "btcusdt")
+    assert df["t_start_ms"].tolist() == [0, 5000, 10000, 15000]
+
+
+def test_candle_writer_time_flush(tmp_path):
+    path = str(tmp_path / "test.db")
+    init_sqlite(path)
+
+    with CandleWriter(path, batch_size=100, flush_ms=0) as w:
+        w.add(_row(0))
+        assert w.maybe_flush() == 1
+        assert w.maybe_flush() == 0
+    assert len(read_candles(path, "btcusdt")) == 1
+
+
+def test_rollups_share_the_writer_transaction(tmp_path):
+    path = str(tmp_path / "test.db")
+    init_sqlite(path)
+
+    with CandleWriter(path, batch_size=100, flush_ms=60_000) as w:
+        w.add(_row(0))
+        w.add_rollup("1m", {**_row(0), "t_end_ms": 60_000})
+        w.add_rollup("5m", {**_row(0), "t_end_ms": 300_000})
+        assert w.flush() == 3
+
+    assert len(read_candles(path, "btcusdt")) == 1
+    df = read_candles(path, "btcusdt", tf="1m")
+    assert list(df.columns) == list(CANDLE_COLUMNS)
+    assert df["t_end_ms"].tolist() == [60_000]
+    assert last_rollup_end(path, "btcusdt", "5m") == 300_000
+    assert last_rollup_end(path, "btcusdt", "1h") is None
+
+
+def test_candle_cache_fetches_only_new_rows(tmp_path):
+    path = str(tmp_path / "test.db")
+    init_sqlite(path)
+    with CandleWriter(path, batch_size=100, flush_ms=60_000) as w:
+        for i in range(5):
+            w.add(_row(i))
+
+    cache = CandleCache(path, limit=4)
+    assert cache.get("btcusdt")["close"].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert cache.get("btcusdt")["close"].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert cache.stats == {"hits": 1, "misses": 0, "loads": 1, "rows": 4}
+
+    with CandleWriter(path, batch_size=100, flush_ms=60_000) as w:
+        w.add({**_row(4), "volume": 9.0})  # last row rewritten
+        w.add(_row(5))
+        w.add(_row(6))
+    df = cache.get("btcusdt")
+    assert df["close"].tolist() == [3.0, 4.0, 5.0, 6.0]
+    assert df["volume"].tolist() == [1.0, 9.0, 1.0, 1.0]
+    assert cache.stats["misses"] == 1 and cache.stats["rows"] == 7
+
+    assert cache.get("btcusdt", "1m").empty
+    cache.close()
+
+
+def test_indicators_are_stored_with_their_candle(tmp_path):
+    path = str(tmp_path / "test.db")
+    init_sqlite(path)
+    values = {c: float(i) for i, c in enumerate(INDICATOR_COLUMNS)}
+
+    with CandleWriter(path, batch_size=100, flush_ms=60_000) as w:
+        w.add(_row(0), {**values, "rsi14": float("nan")})  # still warming up
+        w.add(_row(1), values)
+        w.add(_row(2))  # no values (engine had already seen it)
+        w.add_rollup("1m", {**_row(0), "t_end_ms": 60_000}, {**values, "sma20": 42.0})
+        con = sqlite3.connect(path)
+        assert con.execute("SELECT COUNT(*) FROM indicators").fetchone() == (0,)  # nothing before the commit
+        assert w.flush() == 4
+        assert con.execute("SELECT COUNT(*) FROM indicators").fetchone() == (3,)
+        con.close()
+
+    assert list(read_candles(path, "btcusdt").columns) == list(CANDLE_COLUMNS)
+    df = read_candles(path, "btcusdt", indicators=True)
+    assert list(df.columns) == list(CANDLE_COLUMNS) + list(INDICATOR_COLUMNS)
+    assert df["close"].tolist() == [0.0, 1.0, 2.0]
+    assert df["macd"].tolist()[:2] == [values["macd"]] * 2 and df["macd"].isna().tolist()[2]
+    assert df["rsi14"].isna().tolist() == [True, False, True]
+    assert read_candles(path, "btcusdt", tf="1m", indicators=True)["sma20"].tolist() == [42.0]
+    assert read_candle_range(path, "btcusdt", 5000, 10000, indicators=True)["bb_upper"].tolist() == [values["bb_upper"]]
+
+    cache = CandleCache(path, indicators=True)
+    assert cache.get("btcusdt")["bb_mid"].tolist()[1] == values["bb_mid"]
+    assert cache.get("btcusdt") is cache.get("btcusdt")  # NULL indicators don't defeat the hit check
+    assert cache.stats["hits"] == 2
+    cache.close()
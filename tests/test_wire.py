@@ -0,0 +1,34 @@
+import pytest
+
+from src.wire import PACKED_FIELD, TRADE_STRUCT, pack_trade, unpack_trades, decode_trade
+
+
+def test_pack_roundtrip_bytes_and_latin1():
+    raw = pack_trade(1_700_000_000_123, 42000.5, 0.001, "sell")
+    assert len(raw) == TRADE_STRUCT.size == 26
+    assert decode_trade({PACKED_FIELD: raw}) == (1_700_000_000_123, 42000.5, 0.001, True)
+    # what a latin-1 decode_responses client hands the consumer
+    assert decode_trade({PACKED_FIELD: raw.decode("latin-1")}) == (1_700_000_000_123, 42000.5, 0.001, True)
+    assert decode_trade({"ts_ms": "5", "price": "1.5", "qty": "2", "side": "buy"}) == (5, 1.5, 2.0, False)
+    assert decode_trade({"ts_ms": "5", "price": "1.5", "qty": "2", "side": "sell"})[3] is True
+
+    arr = unpack_trades([raw.decode("latin-1"), pack_trade(2, 3.0, 4.0, "buy").decode("latin-1")])
+    assert arr["ts_ms"].tolist() == [1_700_000_000_123, 2]
+    assert arr["price"].tolist() == [42000.5, 3.0]
+    assert arr["flags"].tolist() == [1, 0]
+
+
+def test_bad_packed_entries_raise():
+    good = pack_trade(1, 2.0, 3.0, "buy")
+    with pytest.raises(ValueError):
+        unpack_trades([good, good[:-1]])
+    # sizes that add up to a whole number of records still fail
+    with pytest.raises(ValueError):
+        unpack_trades([good[:-1], good + b"\x00", good])
+    with pytest.raises(ValueError):
+        unpack_trades([good[:-1].decode("latin-1"), (good + b"\x00").decode("latin-1")])
+    with pytest.raises(ValueError):
+        unpack_trades([b"\x02" + good[1:]])
+    with pytest.raises(ValueError):
+        decode_trade({PACKED_FIELD: b"\x02" + good[1:]})
+    assert len(unpack_trades([])) == 0